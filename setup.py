@@ -29,6 +29,7 @@ setup(
     ],
     install_requires=['mock',
                       'tqdm'],
+    extras_require={'bootstrap': ['numpy']},
     packages=find_packages(),
     entry_points={
         'console_scripts': ['subword-nmt=subword_nmt.subword_nmt:main'],
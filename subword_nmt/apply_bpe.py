@@ -15,7 +15,6 @@ from __future__ import unicode_literals, division
 
 import sys
 import os
-import inspect
 import codecs
 import io
 import argparse
@@ -23,12 +22,36 @@ import re
 import warnings
 import random
 import tempfile
-from multiprocessing import Pool, cpu_count
+import time
+import json
+import threading
+import collections
+import itertools
+import copy
+import queue
+import shutil
+import hashlib
+import zlib
 from contextlib import contextmanager
 
+#hack to get imports working if running this as a script, or within a package
+try:
+    from .get_vocab import read_binary_vocabulary, is_binary_vocabulary
+except ImportError:
+    from get_vocab import read_binary_vocabulary, is_binary_vocabulary
+
+# size of output blocks with --fast-io (see write_blocks())
+BLOCK_SIZE = 1 << 20
+
+# maximum number of entries of each cache of a BPE object (see trim_cache())
+MAX_CACHE_SIZE = 1 << 19
+
+# minimum time between rewrites of the manifest in seconds (see apply_with_manifest())
+MANIFEST_INTERVAL = 10
+
 class BPE(object):
 
-    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None, is_bytes=False):
+    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None, is_bytes=False, max_token_length=None, long_token_policy='chunk'):
 
         codes.seek(0)
         offset=1
@@ -52,7 +75,13 @@ class BPE(object):
         self.newline_char = b'\n' if is_bytes else '\n'
         self.split_char = b' ' if is_bytes else ' '
 
-        self.bpe_codes = [tuple(item.strip(self.strip_chars).split(self.split_char)) for (n, item) in enumerate(codes.read().rstrip(self.newline_char).split(self.newline_char)) if (n < merges or merges == -1)]
+        # with a limited number of merge operations, only read the lines that are used
+        if merges == -1:
+            codes_text = codes.read()
+        else:
+            codes_text = read_first_lines(codes, max(merges, 0), self.newline_char)
+
+        self.bpe_codes = [tuple(item.strip(self.strip_chars).split(self.split_char)) for (n, item) in enumerate(codes_text.rstrip(self.newline_char).split(self.newline_char)) if (n < merges or merges == -1)]
 
         for i, item in enumerate(self.bpe_codes):
             if len(item) != 2:
@@ -67,6 +96,10 @@ class BPE(object):
 
         self.bpe_codes_reverse = dict([(pair[0] + pair[1], pair) for pair,i in self.bpe_codes.items()])
 
+        # byte-level models are applied with integer symbol IDs
+        if is_bytes:
+            self.byte_merges, self.byte_symbols = get_byte_codes(self.bpe_codes)
+
         self.separator = separator
 
         self.vocab = vocab
@@ -82,53 +115,157 @@ class BPE(object):
 
         self.glossaries = glossaries if glossaries else []
 
-        self.cache = {}
+        # tokens longer than max_token_length are split into chunks ('chunk'),
+        # or not segmented at all ('passthrough'), to bound the cost of encode()
+        if long_token_policy not in ('chunk', 'passthrough'):
+            raise ValueError('`long_token_policy` is expected to be "chunk" or "passthrough", but got {}.'.format(long_token_policy))
+        self.max_token_length = max_token_length
+        self.long_token_policy = long_token_policy
+        self.long_tokens = 0
 
-    def process_lines(self, filename, outfile, dropout=0, num_workers=1):
+        # segmentation of segments (words, or parts of words between glossaries), see encode()
+        self.cache = {}
+        # subword units of whole words, with separator if not word-final, see segment_tokens() and segment()
+        self.word_cache = {}
+        # segmentation of UTF-8 encoded words (bytes) of character-level models, rendered as in the output, see process_line_utf8()
+        self.utf8_cache = {}
+        # caches for segment_tokens_limits(), one per set of merge limits
+        self.limits_cache = {}
+        # each cache holds at most max_cache_size entries; the oldest ones are dropped first (see trim_cache())
+        self.max_cache_size = MAX_CACHE_SIZE
+
+        # runtime statistics (see enable_stats())
+        self.stats = None
+
+        # cache of segmented lines (see enable_line_cache())
+        self.line_cache = None
+
+        # fields of TSV or JSON lines records to segment (see enable_fields())
+        self.input_format = 'text'
+        self.fields = None
+        self.field_models = {}
+
+        # random number generator for dropout (None: global generator of the random module)
+        self.rng = None
+
+    def enable_stats(self, report_interval=None, report_file=None):
+        """Collect runtime statistics (throughput, cache hit rate, time per segmentation step), available with get_stats().
+
+        If report_interval is given, statistics are reported every report_interval seconds (and by each worker
+        in parallel mode), to stderr or, as JSON lines, to the file report_file (a path, appended to).
+        Statistics add some overhead, and are disabled by default.
+        """
+        self.stats = SegmentationStats(report_interval, report_file)
+
+    def get_model_hash(self):
+        """return a hash (hex string) of everything that determines the segmentation:
+        merge operations, separator, vocabulary, glossaries and handling of long tokens"""
+        h = hashlib.sha256()
+        h.update(repr((self.version, self.is_bytes, self.separator, self.glossaries,
+                       self.max_token_length, self.long_token_policy)).encode('utf-8'))
+        h.update(repr(sorted(self.bpe_codes.items(), key=lambda item: item[1])).encode('utf-8'))
+        if self.vocab:
+            h.update(repr(sorted(self.vocab)).encode('utf-8'))
+        if self.fields is not None:
+            h.update(repr((self.input_format, self.fields)).encode('utf-8'))
+            for field in sorted(self.field_models, key=str):
+                h.update(repr((field, self.field_models[field].get_model_hash())).encode('utf-8'))
+        return h.hexdigest()
+
+    def enable_fields(self, input_format, fields, models=None):
+        """Segment only some fields of each line, which is a record in TSV ('tsv') or JSON lines ('jsonl') format.
+
+        fields are column numbers (starting at 1) for TSV, and keys for JSON lines. Fields are segmented with this model,
+        or with the BPE model in the dictionary models (from field to model), so that e.g. the source and target side
+        of a parallel corpus can be segmented with different codes. Other fields, JSON values that are not strings,
+        and JSON lines that are not objects are left unchanged; lines without any field to segment are copied verbatim.
+        JSON lines with segmented fields are written again, with non-ASCII characters unescaped."""
+        if input_format not in ('tsv', 'jsonl'):
+            raise ValueError('`input_format` is expected to be "tsv" or "jsonl", but got {}.'.format(input_format))
+        if self.is_bytes or any(model.is_bytes for model in (models or {}).values()):
+            raise ValueError('fields are not supported with byte-level BPE')
+        if input_format == 'tsv':
+            fields = [int(field) for field in fields]
+            if min(fields) < 1:
+                raise ValueError('TSV fields are numbered starting at 1')
+            models = dict((int(field), model) for (field, model) in (models or {}).items())
+        self.input_format = input_format
+        self.fields = list(fields)
+        self.field_models = models or {}
+
+    def enable_line_cache(self, max_size):
+        """Cache up to max_size segmented lines, so that duplicate lines (common in crawled corpora) are only segmented once.
+        The least recently used lines are evicted first. The line cache is not used with dropout.
+
+        Worker threads of BPEExecutor share the line cache. Worker processes cannot share it; when a file is split
+        between them, each starts with the lines that are frequent in the whole file (see find_frequent_lines())."""
+        self.line_cache = LineCache(max_size)
+
+    def get_stats(self):
+        """Return runtime statistics as a dictionary (see enable_stats()).
+        After process_lines() with several workers, 'workers' holds the statistics of each worker."""
+        if self.stats is None:
+            return None
+        stats = self.stats.as_dict(self.get_cache_sizes())
+        if self.line_cache is not None:
+            stats.update(self.line_cache.as_dict())
+        return stats
+
+    def get_cache_sizes(self):
+        """return the number of entries of each cache: segments ('segments'), words ('words'),
+        UTF-8 encoded words ('utf8_words'), and words for segment_tokens_limits() ('limits')"""
+        return {'segments': len(self.cache),
+                'words': len(self.word_cache),
+                'utf8_words': len(self.utf8_cache),
+                'limits': sum(len(cache) for cache in self.limits_cache.values())}
+
+    def process_lines(self, filename, outfile, dropout=0, num_workers=1, backend='processes', seed=None, binary=False):
+        """segment file filename, and write the result to the file object outfile.
+        With num_workers > 1, the file is split between several processes or threads (see BPEExecutor).
+        If binary is True, the file is read (and outfile written) as UTF-8 bytes, which are segmented
+        without decoding them (see process_line()), and written in large blocks."""
 
         if sys.version_info < (3, 0) :
             print("Parallel mode is only supported in Python3")
             sys.exit(1)
 
         if num_workers == 1:
-            _process_lines(self, filename, outfile, dropout, 0, 0)
+            _process_lines(self, filename, outfile, dropout, 0, 0, binary=binary)
         elif num_workers > 1:
-            mode = 'rb' if self.is_bytes else 'r'
-            with open_file(filename, mode) as f:
-                size = os.fstat(f.fileno()).st_size
-                chunk_size = int(size / num_workers)
-                offsets = [0 for _ in range(num_workers + 1)]
-                for i in range(1, num_workers):
-                    f.seek(chunk_size * i)
-                    pos = f.tell()
-                    while True:
-                        try:
-                            line = f.readline()
-                            break
-                        except UnicodeDecodeError:
-                            pos -= 1
-                            f.seek(pos)
-                    offsets[i] = f.tell()
-                    assert 0 <= offsets[i] < 1e20, "Bad new line separator, e.g. '\\r'"
-            res_files = []
-            pool = Pool(processes=num_workers)
-            for i in range(num_workers):
-                tmp = tempfile.NamedTemporaryFile(delete=False)
-                tmp.close()
-                res_files.append(tmp)
-                pool.apply_async(_process_lines, (self, filename, tmp.name, dropout, offsets[i], offsets[i + 1]))
-            pool.close()
-            pool.join()
-            for i in range(num_workers):
-                with open_file(res_files[i].name, mode) as fi:
-                    for line in fi:
-                        outfile.write(line)
-                os.remove(res_files[i].name)
+            with BPEExecutor(self, num_workers, backend=backend, seed=seed) as executor:
+                executor.process_lines(filename, outfile, dropout, binary)
         else:
             raise ValueError('`num_workers` is expected to be a positive number, but got {}.'.format(num_workers))
 
     def process_line(self, line, dropout=0):
-        """segment line, dealing with leading and trailing whitespace"""
+        """segment line, dealing with leading and trailing whitespace.
+        With a character-level model, line can also be UTF-8 encoded bytes (see process_line_utf8())."""
+
+        if self.line_cache is not None and not dropout:
+            out = self.line_cache.get(line)
+            if out is None:
+                out = self._process_line(line)
+                self.line_cache.add(line, out)
+            elif self.stats is not None:
+                self.stats.add_line(line, self)
+            return out
+
+        return self._process_line(line, dropout)
+
+    def _process_line(self, line, dropout=0):
+
+        if self.fields is not None:
+            return self._process_record(line, dropout)
+
+        if not self.is_bytes and isinstance(line, bytes):
+            return self.process_line_utf8(line, dropout)
+
+        if self.stats is not None:
+            self.stats.add_line(line, self)
+
+        return self._segment_line(line, dropout)
+
+    def _segment_line(self, line, dropout=0):
 
         out = b"" if self.is_bytes else ""
 
@@ -144,35 +281,293 @@ class BPE(object):
 
         return out
 
+    def _process_record(self, line, dropout=0):
+        """segment the fields of a TSV or JSON lines record (see enable_fields())"""
+
+        if isinstance(line, bytes):
+            return self._process_record(line.decode('utf-8'), dropout).encode('utf-8')
+
+        if self.stats is not None:
+            self.stats.add_line(line, self)
+
+        body = line.rstrip('\r\n')
+        if self.input_format == 'tsv':
+            record = body.split('\t')
+            keys = [field - 1 for field in self.fields if field <= len(record)]
+        else:
+            record = json.loads(body) if body.strip() else None
+            # only string values of JSON objects are segmented
+            keys = [field for field in self.fields if isinstance(record, dict) and isinstance(record.get(field), str)]
+        if not keys:
+            return line
+
+        for key in keys:
+            model = self.field_models.get(key + 1 if self.input_format == 'tsv' else key)
+            if model is None:
+                record[key] = self._segment_line(record[key], dropout)
+            else:
+                model.rng = self.rng
+                long_tokens = model.long_tokens
+                record[key] = model._segment_line(record[key], dropout)
+                self.long_tokens += model.long_tokens - long_tokens
+
+        if self.input_format == 'tsv':
+            body = '\t'.join(record)
+        else:
+            body = json.dumps(record, ensure_ascii=False)
+        return body + line[len(line.rstrip('\r\n')):]
+
+    def process_line_utf8(self, line, dropout=0):
+        """segment UTF-8 encoded line (bytes) with a character-level model, and return UTF-8 encoded bytes.
+
+        The output is identical to process_line() on the decoded line (with the same line ending), but the line is not decoded:
+        whitespace is ASCII, and never part of a multi-byte character, so the line can be split into tokens
+        as bytes, and only tokens that are not cached yet are decoded and segmented as characters."""
+
+        if self.stats is not None:
+            self.stats.add_line(line, self)
+
+        out = b""
+
+        leading_whitespace = len(line)-len(line.lstrip(b'\r\n '))
+        if leading_whitespace:
+            out += line[:leading_whitespace]
+
+        out += b' '.join(self._segment_words_utf8(line.strip(b'\r\n ').split(b' '), dropout))
+
+        trailing_whitespace = len(line)-len(line.rstrip(b'\r\n '))
+        if trailing_whitespace and trailing_whitespace != len(line):
+            out += line[-trailing_whitespace:]
+
+        return out
+
+    def _segment_words_utf8(self, tokens, dropout=0):
+        """segment UTF-8 encoded tokens (bytes) of a character-level model, and return the segmentation of each word
+        as it appears in the output (subword units joined by space). Without dropout, the rendered words are cached,
+        so that a repeated word costs a single lookup, and is not decoded."""
+        stats = self.stats
+        if stats is not None:
+            misses = stats.cache_misses
+        cache = self.utf8_cache
+        output = []
+        for word in tokens:
+            # eliminate double spaces
+            if not word:
+                continue
+            rendered = None if dropout else cache.get(word)
+            if rendered is None:
+                rendered = self.split_char.join(self._word_units(word.decode('utf-8'), dropout)).encode('utf-8')
+                # long tokens are not cached, so that each occurrence is counted in long_tokens
+                if not dropout and not (self.max_token_length and len(word) > self.max_token_length):
+                    cache[word] = rendered
+                    if len(cache) > self.max_cache_size:
+                        trim_cache(cache, self.max_cache_size)
+            output.append(rendered)
+        if stats is not None:
+            stats.add_words(len(output), stats.cache_misses - misses)
+        return output
+
+    def process_line_limits(self, line, limits):
+        """segment line with several merge limits at once (see segment_tokens_limits()),
+        dealing with leading and trailing whitespace. Returns one line per limit."""
+
+        leading_whitespace = len(line)-len(line.lstrip(self.strip_chars))
+        leading = line[:leading_whitespace]
+
+        trailing_whitespace = len(line)-len(line.rstrip(self.strip_chars))
+        if trailing_whitespace and trailing_whitespace != len(line):
+            trailing = line[-trailing_whitespace:]
+        else:
+            trailing = line[:0]
+
+        tokens = line.strip(self.strip_chars).split(self.split_char)
+        return [leading + self.split_char.join(segments) + trailing
+                for segments in self.segment_tokens_limits(tokens, limits)]
+
+    def decode_line(self, line):
+        """undo segmentation of line (see decode_line())"""
+        return decode_line(line, self.separator)
+
+    def decode_tokens(self, tokens):
+        """undo segmentation of a sequence of subword units (as returned by segment_tokens()), and return a list of words"""
+        return decode_line(self.split_char.join(tokens), self.separator).split(self.split_char)
+
     def segment(self, sentence, dropout=0):
         """segment single sentence (whitespace-tokenized string) with BPE encoding"""
-        segments = self.segment_tokens(sentence.strip(self.strip_chars).split(self.split_char), dropout)
-        return self.split_char.join(segments)
+        tokens = sentence.strip(self.strip_chars).split(self.split_char)
+        return self.split_char.join(self.segment_tokens(tokens, dropout))
 
     def segment_tokens(self, tokens, dropout=0):
-        """segment a sequence of tokens with BPE encoding"""
+        """segment a sequence of tokens with BPE encoding. Without dropout, the subword units of each word
+        (with separator if not word-final) are cached as a tuple, so that a repeated word costs a single lookup."""
+        stats = self.stats
+        if stats is not None:
+            misses = stats.cache_misses
+            tokens = list(tokens)
+        cache = self.word_cache
         output = []
         for word in tokens:
             # eliminate double spaces
             if not word:
                 continue
+            units = None if dropout else cache.get(word)
+            if units is None:
+                units = self._word_units(word, dropout)
+                # long tokens are not cached, so that each occurrence is counted in long_tokens
+                if not dropout and not (self.max_token_length and len(word) > self.max_token_length):
+                    cache[word] = units
+                    if len(cache) > self.max_cache_size:
+                        trim_cache(cache, self.max_cache_size)
+            output.extend(units)
+        if stats is not None:
+            stats.add_words(sum(1 for word in tokens if word), stats.cache_misses - misses)
+        return output
+
+    def _word_units(self, word, dropout=0):
+        """segment a word that is not in the word caches, and return its subword units, with separator if not word-final"""
+        if self.stats is not None:
+            new_word = self._encode_word_stats(word, dropout)
+        else:
             new_word = [out for segment in self._isolate_glossaries(word)
-                        for out in encode(segment,
-                                          self.bpe_codes,
-                                          self.bpe_codes_reverse,
-                                          self.vocab,
-                                          self.separator,
-                                          self.version,
-                                          self.cache,
-                                          self.glossaries_regex,
-                                          self.is_bytes,
-                                          dropout)]
-
-            for item in new_word[:-1]:
-                output.append(item + self.separator)
-            output.append(new_word[-1])
+                        for out in self._encode(segment, dropout)]
+        if len(self.cache) > self.max_cache_size:
+            trim_cache(self.cache, self.max_cache_size)
+        return tuple([item + self.separator for item in new_word[:-1]] + [new_word[-1]])
+
+    def _encode_word_stats(self, word, dropout=0):
+        """isolate glossaries and encode a word like _word_units(), with counters and timers for get_stats()"""
+        stats = self.stats
+        clock = time.perf_counter
+        stats.cache_misses += 1
+        start = clock()
+        segments = self._isolate_glossaries(word)
+        stats.time['glossaries'] += clock() - start
 
-        return output
+        new_word = []
+        for segment in segments:
+            # single characters are not cached, but are as cheap as a cache lookup
+            if not dropout and (segment in self.cache or len(segment) == 1):
+                new_word.extend(self._encode(segment))
+            else:
+                new_word.extend(self._encode_stats(segment, dropout))
+        return new_word
+
+    def _encode_stats(self, segment, dropout=0):
+        """_encode() for segments that are not cached, timing the vocabulary filter separately"""
+        stats = self.stats
+        clock = time.perf_counter
+        start = clock()
+        if not self.vocab or len(segment) < 2 or (self.glossaries_regex and self.glossaries_regex.match(segment)) or \
+            (self.max_token_length and len(segment) > self.max_token_length):
+            word = self._encode(segment, dropout)
+            stats.time['encode'] += clock() - start
+            return word
+
+        # encode without vocabulary filter (and without touching the cache), then filter
+        if self.is_bytes:
+            word = encode_bytes(segment, self.byte_merges, self.byte_symbols, self.bpe_codes_reverse,
+                                None, self.separator, {}, self.glossaries_regex, dropout, self.rng)
+        else:
+            word = encode(segment, self.bpe_codes, self.bpe_codes_reverse, None, self.separator,
+                          self.version, {}, self.glossaries_regex, self.is_bytes, dropout, self.rng)
+        filter_start = clock()
+        stats.time['encode'] += filter_start - start
+        word = check_vocab_and_split(word, self.bpe_codes_reverse, self.vocab, self.separator)
+        stats.time['vocabulary'] += clock() - filter_start
+        if not dropout:
+            self.cache[segment] = word
+        return word
+
+    def segment_tokens_limits(self, tokens, limits):
+        """segment a sequence of tokens with several merge limits at once.
+
+        The output for each limit N is identical to segment_tokens() with a model
+        that only uses the first N merge operations (-1: all merge operations),
+        but each word is only encoded once (see encode_limits()).
+        Returns one list of segments per limit."""
+        limits = tuple(limits)
+        cache = self.limits_cache.setdefault(limits, {})
+        outputs = [[] for _ in limits]
+        for word in tokens:
+            # eliminate double spaces
+            if not word:
+                continue
+            new_words = [[] for _ in limits]
+            for segment in self._isolate_glossaries(word):
+                for new_word, out in zip(new_words, self._encode_limits(segment, limits, cache)):
+                    new_word.extend(out)
+
+            for output, new_word in zip(outputs, new_words):
+                for item in new_word[:-1]:
+                    output.append(item + self.separator)
+                output.append(new_word[-1])
+
+        if len(cache) > self.max_cache_size:
+            trim_cache(cache, self.max_cache_size)
+        return outputs
+
+    def _encode_limits(self, segment, limits, cache):
+        """encode a single segment with several merge limits (after isolating glossaries)"""
+        if self.max_token_length and len(segment) > self.max_token_length and \
+            not (self.glossaries_regex and self.glossaries_regex.match(segment)):
+            self.long_tokens += 1
+            if self.long_token_policy == 'passthrough':
+                return [(segment,)] * len(limits)
+            n = self.max_token_length
+            new_words = [[] for _ in limits]
+            for i in range(0, len(segment), n):
+                for new_word, out in zip(new_words, self._encode_limits(segment[i:i+n], limits, cache)):
+                    new_word.extend(out)
+            return new_words
+        return encode_limits(segment,
+                             limits,
+                             self.bpe_codes,
+                             self.bpe_codes_reverse,
+                             self.vocab,
+                             self.separator,
+                             self.version,
+                             cache,
+                             self.glossaries_regex,
+                             self.is_bytes)
+
+    def _encode(self, segment, dropout=0):
+        """encode a single segment (after isolating glossaries)"""
+        if self.max_token_length and len(segment) > self.max_token_length and \
+            not (self.glossaries_regex and self.glossaries_regex.match(segment)):
+            return self._encode_long_token(segment, dropout)
+        if self.is_bytes:
+            return encode_bytes(segment,
+                                self.byte_merges,
+                                self.byte_symbols,
+                                self.bpe_codes_reverse,
+                                self.vocab,
+                                self.separator,
+                                self.cache,
+                                self.glossaries_regex,
+                                dropout,
+                                self.rng)
+        return encode(segment,
+                      self.bpe_codes,
+                      self.bpe_codes_reverse,
+                      self.vocab,
+                      self.separator,
+                      self.version,
+                      self.cache,
+                      self.glossaries_regex,
+                      self.is_bytes,
+                      dropout,
+                      self.rng)
+
+    def _encode_long_token(self, segment, dropout=0):
+        """encode segment longer than max_token_length in linear time.
+        With the 'chunk' policy, chunks of max_token_length are encoded independently
+        (like segments between glossaries), with 'passthrough' the segment is left intact."""
+        self.long_tokens += 1
+        if self.long_token_policy == 'passthrough':
+            return (segment,)
+        n = self.max_token_length
+        return [out for i in range(0, len(segment), n)
+                for out in self._encode(segment[i:i+n], dropout)]
 
     def _isolate_glossaries(self, word):
         word_segments = [word]
@@ -181,27 +576,554 @@ class BPE(object):
                                  for out_segments in isolate_glossary(segment, gloss, self.is_bytes)]
         return word_segments
 
-def _process_lines(bpe, filename, outfile, dropout, begin, end):
+class SegmentationStats(object):
+    """runtime statistics of a BPE object (see BPE.enable_stats())"""
+
+    def __init__(self, report_interval=None, report_file=None):
+        self.report_interval = report_interval
+        self.report_file = report_file
+        self.worker = None
+        self.workers = {}
+        self.reset()
+
+    def reset(self):
+        self.lines = 0
+        self.tokens = 0
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.time = {'glossaries': 0, 'encode': 0, 'vocabulary': 0}
+        self.start = self.last_report = time.time()
+
+    def add_line(self, line, bpe):
+        self.lines += 1
+        self.bytes += len(line) if isinstance(line, bytes) else len(line.encode('utf-8'))
+        if self.report_interval and time.time() - self.last_report >= self.report_interval:
+            self.report(bpe.get_stats())
+            self.last_report = time.time()
+
+    def add_words(self, words, misses):
+        """count words segmented with the word caches, of which misses were not cached"""
+        self.tokens += words
+        self.cache_hits += words - misses
+
+    def add_worker(self, worker, stats):
+        """merge statistics returned by a worker of BPE.process_lines()"""
+        self.workers[worker] = stats
+        self.lines += stats['lines']
+        self.tokens += stats['tokens']
+        self.bytes += stats['bytes']
+        self.cache_hits += stats['cache_hits']
+        self.cache_misses += stats['cache_misses']
+        for step in self.time:
+            self.time[step] += stats['time'][step]
+
+    def as_dict(self, cache_sizes):
+        # the hit rate is that of the word caches; in parallel mode, each worker has its own caches
+        cache_size = cache_sizes['words'] + cache_sizes['utf8_words']
+        cache_size += sum(worker['cache_size'] for worker in self.workers.values())
+        segment_cache_size = cache_sizes['segments'] + sum(worker['segment_cache_size'] for worker in self.workers.values())
+        seconds = max(time.time() - self.start, 1e-9)
+        lookups = self.cache_hits + self.cache_misses
+        stats = {'seconds': seconds,
+                 'lines': self.lines,
+                 'tokens': self.tokens,
+                 'bytes': self.bytes,
+                 'lines_per_second': self.lines / seconds,
+                 'tokens_per_second': self.tokens / seconds,
+                 'bytes_per_second': self.bytes / seconds,
+                 'cache_hits': self.cache_hits,
+                 'cache_misses': self.cache_misses,
+                 'cache_hit_rate': self.cache_hits / lookups if lookups else 0,
+                 'cache_size': cache_size,
+                 'segment_cache_size': segment_cache_size,
+                 'time': dict(self.time)}
+        if self.worker is not None:
+            stats['worker'] = self.worker
+        if self.workers:
+            stats['workers'] = [self.workers[i] for i in sorted(self.workers)]
+        return stats
+
+    def report(self, stats):
+        """write statistics to stderr, or as a JSON line to the report file"""
+        if self.report_file:
+            with open(self.report_file, 'a') as f:
+                f.write(json.dumps(stats) + '\n')
+        else:
+            for worker in stats.get('workers', []):
+                self.report(worker)
+            sys.stderr.write('{0}{1} lines, {2} tokens ({3:.0f} lines/s, {4:.0f} tokens/s, {5:.0f} bytes/s); '
+                             'cache hit rate {6:.1%}, cache size {7}; time: glossaries {8:.1f}s, encode {9:.1f}s, vocabulary {10:.1f}s\n'.format(
+                             'worker {0}: '.format(stats['worker']) if 'worker' in stats else '',
+                             stats['lines'], stats['tokens'], stats['lines_per_second'], stats['tokens_per_second'], stats['bytes_per_second'],
+                             stats['cache_hit_rate'], stats['cache_size'],
+                             stats['time']['glossaries'], stats['time']['encode'], stats['time']['vocabulary']))
+
+class LineCache(object):
+    """bounded cache of segmented lines, with least recently used lines evicted first (see BPE.enable_line_cache())"""
+
+    def __init__(self, max_size, lines=None):
+        self.max_size = max_size
+        self.lines = collections.OrderedDict() if lines is None else lines
+        self.hits = 0
+        self.misses = 0
+
+    def shared(self):
+        """return a line cache with its own counters that shares the cached lines with this one (for worker threads)"""
+        return LineCache(self.max_size, self.lines)
+
+    def get(self, line):
+        out = self.lines.get(line)
+        if out is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            self.lines.move_to_end(line)
+        except KeyError:
+            # evicted by another thread
+            pass
+        return out
 
-    write_mode = 'wb' if bpe.is_bytes else 'w'
-    read_mode = 'rb' if bpe.is_bytes else 'r'
+    def add(self, line, out):
+        lines = self.lines
+        lines[line] = out
+        while len(lines) > self.max_size:
+            try:
+                lines.popitem(last=False)
+            except KeyError:
+                break
+
+    def prefill(self, lines):
+        """add segmented lines (a dictionary) without counting them as hits or misses"""
+        for line, out in lines.items():
+            self.add(line, out)
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {'line_cache_hits': self.hits,
+                'line_cache_misses': self.misses,
+                'line_cache_hit_rate': self.hits / lookups if lookups else 0,
+                'line_cache_size': len(self.lines)}
+
+    def report(self):
+        sys.stderr.write('line cache: {0} hits, {1} misses (hit rate {2:.1%}), {3} lines cached\n'.format(
+                         self.hits, self.misses, self.as_dict()['line_cache_hit_rate'], len(self.lines)))
+
+_trim_lock = threading.Lock()
+
+def trim_cache(cache, max_size):
+    """drop the oldest entries of cache (a dictionary, which keeps insertion order) until it holds max_size // 2 entries.
+    Halving the cache, rather than dropping one entry per insertion, keeps the cost per insertion constant,
+    and unlike least-recently-used eviction, lookups need no bookkeeping. Safe with threads that share the cache."""
+    with _trim_lock:
+        if len(cache) <= max_size:
+            return
+        try:
+            keys = list(itertools.islice(cache, len(cache) - max_size // 2))
+        except RuntimeError:
+            # changed by another thread while iterating; the next insertion tries again
+            return
+        for key in keys:
+            cache.pop(key, None)
+
+def _process_lines(bpe, filename, outfile, dropout, begin, end, worker=None, binary=False):
+
+    binary = binary or bpe.is_bytes
+    write_mode = 'wb' if binary else 'w'
+    read_mode = 'rb' if binary else 'r'
+
+    long_tokens = bpe.long_tokens
+    if bpe.line_cache is not None:
+        line_cache_hits, line_cache_misses = bpe.line_cache.hits, bpe.line_cache.misses
+    if bpe.stats is not None and worker is not None:
+        bpe.stats.reset()
+        bpe.stats.worker = worker
 
     if isinstance(outfile, str):
-        fo = open_file(outfile, write_mode)
+        if binary:
+            fo = open(outfile, write_mode)
+        else:
+            fo = open(outfile, write_mode, encoding="utf-8")
     else:
         fo = outfile
     with open_file(filename, read_mode) as f:
         f.seek(begin)
-        line = f.readline()
-        while line:
-            pos = f.tell()
-            assert 0 <= pos < 1e20, "Bad new line separator, e.g. '\\r'"
-            if end > 0 and pos > end:
-                break
-            fo.write(bpe.process_line(line, dropout))
+        if binary:
+            # byte offsets are cheap to track, and output is written in blocks
+            lines = read_chunk(f, end - begin if end > 0 else None)
+            write_blocks(fo, (bpe.process_line(line, dropout) for line in lines))
+        else:
             line = f.readline()
+            while line:
+                pos = f.tell()
+                assert 0 <= pos < 1e20, "Bad new line separator, e.g. '\\r'"
+                if end > 0 and pos > end:
+                    break
+                fo.write(bpe.process_line(line, dropout))
+                line = f.readline()
     if isinstance(outfile, str):
         fo.close()
+    if bpe.line_cache is not None:
+        line_cache = (bpe.line_cache.hits - line_cache_hits, bpe.line_cache.misses - line_cache_misses)
+    else:
+        line_cache = None
+    return bpe.long_tokens - long_tokens, bpe.get_stats(), line_cache
+
+def find_frequent_lines(filename, max_size, mode='r'):
+    """return up to max_size lines of file filename (with their newline) that occur more than once, most frequent first.
+    Counts are kept with the Misra-Gries algorithm, so at most max_size lines are held in memory,
+    and every line that makes up more than 1/max_size of the file is found."""
+    counts = {}
+    with open_file(filename, mode) as f:
+        for line in f:
+            if line in counts:
+                counts[line] += 1
+            elif len(counts) < max_size:
+                counts[line] = 1
+            else:
+                for key in list(counts):
+                    counts[key] -= 1
+                    if not counts[key]:
+                        del counts[key]
+    frequent = sorted((line for line in counts if counts[line] > 1), key=counts.get, reverse=True)
+    return frequent[:max_size]
+
+def read_first_lines(f, num_lines, newline='\n', block_size=1 << 16):
+    """read file f (at least) up to the end of line num_lines, or to the end of the file."""
+    blocks = []
+    count = 0
+    while count < num_lines:
+        block = f.read(block_size)
+        if not block:
+            break
+        blocks.append(block)
+        count += block.count(newline)
+    return newline[:0].join(blocks)
+
+def read_chunk(f, size=None):
+    """yield lines of binary file f from its current position, until size bytes are read (default: until the end)"""
+    if size is None:
+        for line in f:
+            yield line
+        return
+    for line in f:
+        size -= len(line)
+        if size < 0:
+            break
+        yield line
+
+def write_blocks(outfile, lines, block_size=BLOCK_SIZE):
+    """write lines (bytes) to binary file outfile in blocks of about block_size bytes, rather than line by line"""
+    block = []
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= block_size:
+            outfile.write(b''.join(block))
+            block = []
+            size = 0
+    if block:
+        outfile.write(b''.join(block))
+
+def decode_line(line, separator):
+    """undo segmentation of line (str, or bytes with a bytes separator) by joining subword units that end in separator
+    with the following unit. Equivalent to sed -r 's/(@@ )|(@@ ?$)//g' (with separator '@@')."""
+    if isinstance(separator, bytes):
+        space, newline = b' ', b'\r\n'
+    else:
+        space, newline = ' ', '\r\n'
+    body = line.rstrip(newline)
+    out = body.replace(separator + space, space[:0])
+    if separator and out.endswith(separator):
+        out = out[:-len(separator)]
+    return out + line[len(body):]
+
+def get_chunk_offsets(filename, num_chunks, mode):
+    """split file into num_chunks chunks of roughly equal size, at line boundaries.
+    Returns a list of num_chunks+1 byte offsets (the last one is 0, meaning end of file)."""
+    with open_file(filename, mode) as f:
+        size = os.fstat(f.fileno()).st_size
+        chunk_size = int(size / num_chunks)
+        offsets = [0 for _ in range(num_chunks + 1)]
+        for i in range(1, num_chunks):
+            f.seek(chunk_size * i)
+            pos = f.tell()
+            while True:
+                try:
+                    line = f.readline()
+                    break
+                except UnicodeDecodeError:
+                    pos -= 1
+                    f.seek(pos)
+            offsets[i] = f.tell()
+            assert 0 <= offsets[i] < 1e20, "Bad new line separator, e.g. '\\r'"
+    return offsets
+
+# BPE model of a BPEExecutor worker (process or thread)
+_worker = threading.local()
+
+def _init_executor_worker(bpe, threads, token_ids, unk_id):
+    _worker.token_ids = token_ids
+    _worker.unk_id = unk_id
+    if threads:
+        # threads share the model and cache, but have their own counters
+        bpe = copy.copy(bpe)
+        bpe.long_tokens = 0
+        if bpe.stats is not None:
+            bpe.stats = SegmentationStats(bpe.stats.report_interval, bpe.stats.report_file)
+        if bpe.line_cache is not None:
+            bpe.line_cache = bpe.line_cache.shared()
+        # field models have their own random number generator
+        bpe.field_models = dict((field, copy.copy(model)) for (field, model) in bpe.field_models.items())
+    _worker.bpe = bpe
+
+def _set_job_rng(bpe, dropout, job, seed):
+    if dropout:
+        # each job has its own random number generator, so results do not depend on scheduling
+        bpe.rng = random.Random('{0}-{1}'.format(seed, job)) if seed is not None else random.Random()
+
+def _executor_process_lines(filename, outfile, dropout, begin, end, job, seed, binary=False, hot_lines=None):
+    bpe = _worker.bpe
+    if hot_lines:
+        bpe.line_cache.prefill(hot_lines)
+    _set_job_rng(bpe, dropout, job, seed)
+    return _process_lines(bpe, filename, outfile, dropout, begin, end, job, binary)
+
+def _executor_segment_lines(lines, dropout, job, seed, ids):
+    bpe = _worker.bpe
+    _set_job_rng(bpe, dropout, job, seed)
+    out = [bpe.process_line(line, dropout) for line in lines]
+    if ids:
+        token_ids = _worker.token_ids
+        if _worker.unk_id is None:
+            return [[token_ids[token] for token in line.split()] for line in out]
+        return [[token_ids.get(token, _worker.unk_id) for token in line.split()] for line in out]
+    return out
+
+class BPEExecutor(object):
+    """Pool of worker processes (or threads) that segment files with a BPE model.
+
+    Unlike BPE.process_lines(), which starts new workers and ships them a copy of the model on every call,
+    workers are started once and keep the model (and its cache) for all jobs, until close() is called.
+    Jobs are files, segmented by a single worker with submit() or map(), or split between all workers
+    with process_lines(). At most max_pending jobs are queued or running at the same time;
+    submitting more blocks until a job is finished.
+
+        with BPEExecutor(bpe, num_workers=4) as executor:
+            for result in executor.map([('train.L1', 'train.BPE.L1'), ('train.L2', 'train.BPE.L2')]):
+                pass
+
+    With backend='threads', workers are threads that share the model and its cache. This avoids starting processes
+    and copying the model, and scales on free-threaded Python builds; with the GIL, only one thread segments at a time.
+    Sharing the cache is safe because entries always have the same value for the same key (results with dropout
+    are not cached), and lookups tolerate entries that are dropped when a full cache is trimmed (see trim_cache()). Worker processes have their own line cache (see BPE.enable_line_cache());
+    process_lines() fills it with the frequent lines of the file before splitting it, so that the hit rate
+    does not drop as workers are added. For BPE dropout, each job uses its own random number generator,
+    seeded from seed and the job number if seed is given.
+
+    imap() segments a stream of lines in the background. To get lists of integer IDs instead of lines,
+    give a dictionary token_ids that maps subword units to IDs, and the ID for unknown units unk_id
+    (without unk_id, unknown units raise a KeyError).
+    """
+
+    def __init__(self, bpe, num_workers=None, max_pending=None, backend='processes', seed=None, token_ids=None, unk_id=None):
+
+        # imported here to keep start-up fast when no workers are used
+        from multiprocessing import Pool, cpu_count
+        from multiprocessing.pool import ThreadPool
+
+        if num_workers is None or num_workers <= 0:
+            num_workers = cpu_count()
+        if max_pending is None:
+            max_pending = 2 * num_workers
+        self.bpe = bpe
+        self.num_workers = num_workers
+        self.mode = 'rb' if bpe.is_bytes else 'r'
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.jobs = 0
+        self.seed = seed
+        self.backend = backend
+        if backend == 'processes':
+            self.pool = Pool(processes=num_workers, initializer=_init_executor_worker, initargs=(bpe, False, token_ids, unk_id))
+        elif backend == 'threads':
+            self.pool = ThreadPool(processes=num_workers, initializer=_init_executor_worker, initargs=(bpe, True, token_ids, unk_id))
+        else:
+            raise ValueError('`backend` is expected to be "processes" or "threads", but got {}.'.format(backend))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+
+    def close(self):
+        """wait for all jobs to finish, and stop workers"""
+        self.pool.close()
+        self.pool.join()
+
+    def _done(self, result):
+        # runs in the result handler thread of the pool
+        self.pending.release()
+        long_tokens, stats, line_cache = result
+        self.bpe.long_tokens += long_tokens
+        if line_cache is not None and self.bpe.line_cache is not None:
+            self.bpe.line_cache.hits += line_cache[0]
+            self.bpe.line_cache.misses += line_cache[1]
+
+    def _submit(self, filename, outfile, dropout, begin, end, job, binary=False, hot_lines=None):
+        self.pending.acquire()
+        try:
+            return self.pool.apply_async(_executor_process_lines, (filename, outfile, dropout, begin, end, job, self.seed, binary, hot_lines),
+                                         callback=self._done, error_callback=lambda e: self.pending.release())
+        except Exception:
+            self.pending.release()
+            raise
+
+    def submit(self, infile, outfile, dropout=0):
+        """segment the file infile, writing to the file outfile (both paths), in one worker.
+        Blocks while max_pending jobs are unfinished. Returns an AsyncResult; its get() returns
+        the number of long tokens, the statistics of the job (see BPE.get_stats()), and the number of
+        hits and misses of the line cache (see BPE.enable_line_cache())."""
+        self.jobs += 1
+        return self._submit(infile, outfile, dropout, 0, 0, self.jobs - 1)
+
+    def map(self, jobs, dropout=0):
+        """segment (input, output) pairs of paths, and yield the result of each job, in order"""
+        results = collections.deque()
+        for infile, outfile in jobs:
+            # collect finished results first, so that waiting for a free slot does not stall the consumer
+            while results and results[0].ready():
+                yield results.popleft().get()
+            results.append(self.submit(infile, outfile, dropout))
+        while results:
+            yield results.popleft().get()
+
+    def process_lines(self, filename, outfile, dropout=0, binary=False):
+        """segment file filename, split between all workers, and write the result to the file object outfile
+        (a binary file if binary is True, see BPE.process_lines())."""
+        mode = 'rb' if binary else self.mode
+        offsets = get_chunk_offsets(filename, self.num_workers, mode)
+        hot_lines = None
+        if self.backend == 'processes' and self.bpe.line_cache is not None and not dropout:
+            hot_lines = self._segment_frequent_lines(filename, mode)
+        res_files = []
+        results = []
+        for i in range(self.num_workers):
+            tmp = tempfile.NamedTemporaryFile(delete=False)
+            tmp.close()
+            res_files.append(tmp)
+            results.append(self._submit(filename, tmp.name, dropout, offsets[i], offsets[i + 1], i, binary, hot_lines))
+        # collect statistics of each worker
+        for i, result in enumerate(results):
+            long_tokens, stats, line_cache = result.get()
+            if self.bpe.stats is not None:
+                self.bpe.stats.add_worker(i, stats)
+        for i in range(self.num_workers):
+            with open_file(res_files[i].name, mode) as fi:
+                if binary:
+                    shutil.copyfileobj(fi, outfile, BLOCK_SIZE)
+                else:
+                    for line in fi:
+                        outfile.write(line)
+            os.remove(res_files[i].name)
+
+    def _segment_frequent_lines(self, filename, mode):
+        # worker processes cannot share a line cache, so each one starts with the lines that are frequent in the whole file.
+        # They are segmented here once, without counting them in the statistics.
+        bpe = copy.copy(self.bpe)
+        bpe.stats = None
+        bpe.line_cache = None
+        return dict((line, bpe.process_line(line)) for line in find_frequent_lines(filename, self.bpe.line_cache.max_size, mode))
+
+    def imap(self, lines, dropout=0, batch_size=256, prefetch=None, ids=False, seed=None):
+        """segment an iterable of lines in the background, and yield the segmented lines
+        (or lists of IDs if ids is True) in order.
+
+        A feeder thread reads lines, and sends batches of batch_size lines to the workers.
+        At most prefetch batches (default: 2 per worker) are being segmented or waiting to be consumed;
+        the feeder pauses when this limit is reached. With dropout, seed (default: the seed of the executor)
+        determines the random number generator of each batch; use a different seed for each epoch.
+        """
+        if prefetch is None:
+            prefetch = 2 * self.num_workers
+        if seed is None:
+            seed = self.seed
+        results = queue.Queue(maxsize=prefetch)
+        stopped = threading.Event()
+        errors = []
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def feed():
+            try:
+                batch = []
+                job = 0
+                for line in lines:
+                    batch.append(line)
+                    if len(batch) == batch_size:
+                        put(self.pool.apply_async(_executor_segment_lines, (batch, dropout, job, seed, ids)))
+                        batch = []
+                        job += 1
+                    if stopped.is_set():
+                        return
+                if batch:
+                    put(self.pool.apply_async(_executor_segment_lines, (batch, dropout, job, seed, ids)))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(None)
+
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+        finished = False
+        try:
+            while True:
+                result = results.get()
+                if result is None:
+                    finished = True
+                    break
+                for out in result.get():
+                    yield out
+            if errors:
+                raise errors[0]
+        finally:
+            # also stops the feeder if the consumer stops early. The feeder may be blocked reading lines
+            # (e.g. from STDIN or a socket), so it is only joined once it has sent its last item;
+            # otherwise, it ends when its next line arrives (or with the interpreter, as a daemon thread)
+            stopped.set()
+            if finished:
+                feeder.join()
+
+def segment_stream(bpe, lines, num_workers=1, backend='threads', dropout=0, batch_size=256, prefetch=None, seed=None, token_ids=None, unk_id=None):
+    """segment an iterable of lines with bpe in num_workers background workers, and yield segmented lines in order
+    (or lists of IDs if token_ids is given; see BPEExecutor.imap()). Use this to overlap reading and segmentation
+    with other work, e.g. in the data loader of a training loop."""
+    executor = BPEExecutor(bpe, num_workers, backend=backend, seed=seed, token_ids=token_ids, unk_id=unk_id)
+    try:
+        for out in executor.imap(lines, dropout, batch_size, prefetch, ids=token_ids is not None):
+            yield out
+    finally:
+        executor.pool.terminate()
+        executor.pool.join()
+
+def read_lines(filenames, is_bytes=False):
+    """yield the lines of several files (UTF-8, or bytes if is_bytes is True), for segment_stream()"""
+    for filename in filenames:
+        with open_file(filename, 'rb' if is_bytes else 'r') as f:
+            for line in f:
+                yield line
 
 @contextmanager
 def open_file(filename, mode):
@@ -242,13 +1164,22 @@ def create_parser(subparsers=None):
         '--output', '-o', type=argparse.FileType('wb'), default=sys.stdout,
         metavar='PATH',
         help="Output file (default: standard output)")
+    parser.add_argument(
+        '--multi-merges', type=int, nargs='+', default=None,
+        metavar='INT',
+        help="Segment the input with several numbers of BPE operations in a single pass (-1: all operations), "+
+             "writing one output file per number to the paths given with --multi-output. Overrides --merges and --output.")
+    parser.add_argument(
+        '--multi-output', type=str, nargs='+', default=None,
+        metavar='PATH',
+        help="Output files for --multi-merges (one per number of BPE operations, in the same order)")
     parser.add_argument(
         '--separator', '-s', type=bytes, default=b'@@', metavar='STR',
         help="Separator between non-final subword units (default: '%(default)s'))")
     parser.add_argument(
         '--vocabulary', type=argparse.FileType('rb'), default=None,
         metavar="PATH",
-        help="Vocabulary file (built with get_vocab.py). If provided, this script reverts any merge operations that produce an OOV.")
+        help="Vocabulary file (built with get_vocab.py, in text or binary format). If provided, this script reverts any merge operations that produce an OOV.")
     parser.add_argument(
         '--vocabulary-threshold', type=int, default=None,
         metavar="INT",
@@ -270,15 +1201,76 @@ def create_parser(subparsers=None):
     parser.add_argument(
         '--num-workers', type=int, default=1,
         help="Number of processors to process texts, only supported in Python3. If -1, set `multiprocessing.cpu_count()`. (default: %(default)s)")
+    parser.add_argument(
+        '--executor', choices=['processes', 'threads'], default='processes',
+        help="Run --num-workers workers as processes, or as threads that share the model and cache "+
+             "(faster to start, but only scales on free-threaded Python builds) (default: '%(default)s')")
+    parser.add_argument(
+        '--fast-io', action='store_true',
+        help="Segment UTF-8 text as bytes, only decoding words that are not cached yet, and write the output in large blocks. "+
+             "The output is not flushed after each line (do not use this for interactive use). "+
+             "Lines are only split at '\\n', and line endings are copied unchanged; in text mode, lines of input files are also split "+
+             "at other Unicode line boundaries (e.g. '\\x0c', '\\x85', '\\u2028'), and '\\r\\n' read from standard input becomes '\\n'.")
+    parser.add_argument(
+        '--input-format', choices=['text', 'tsv', 'jsonl'], default='text',
+        help="Format of the input: plain text, or records in TSV or JSON lines format, of which only the --fields are segmented (default: '%(default)s')")
+    parser.add_argument(
+        '--fields', type=str, nargs='+', default=None,
+        metavar="FIELD",
+        help="Fields to segment with --input-format tsv (column numbers, starting at 1) or jsonl (keys).")
+    parser.add_argument(
+        '--field-codes', type=str, nargs='+', default=[],
+        metavar="FIELD=PATH",
+        help="Segment FIELD with the BPE codes in PATH, instead of --codes (with all merge operations). "+
+             "--vocabulary, --glossaries and other options apply to all fields.")
+    parser.add_argument(
+        '--manifest', type=str, default=None,
+        metavar="PATH",
+        help="Resumable mode: split the input file into chunks, keep the output of each chunk in PATH.chunks, and record them in PATH. "+
+             "When run again, only chunks that are missing (e.g. after a crash) or changed (in the input or the model) are segmented.")
+    parser.add_argument(
+        '--chunk-lines', type=int, default=100000,
+        metavar="INT",
+        help="Average number of lines per chunk with --manifest (default: %(default)s)")
+    parser.add_argument(
+        '--line-cache', type=int, default=None,
+        metavar="INT",
+        help="Cache up to INT segmented lines, so that duplicate lines are only segmented once, and report the hit rate "+
+             "(not used with --dropout). Worker threads (--executor threads) share one cache; worker processes have their own, "+
+             "which starts with the lines that are frequent in the whole input (found in an extra pass over the file).")
+    parser.add_argument(
+        '--max-token-length', type=int, default=None,
+        metavar="INT",
+        help="Handle tokens longer than INT characters (bytes for byte-level BPE) according to --long-token-policy, "+
+             "to bound the time spent on pathological tokens such as base64 blobs (default: no limit).")
+    parser.add_argument(
+        '--long-token-policy', choices=['chunk', 'passthrough'], default='chunk',
+        help="'chunk': segment long tokens in independent chunks of --max-token-length; "+
+             "'passthrough': do not segment long tokens (default: '%(default)s')")
+    parser.add_argument(
+        '--stats', action='store_true',
+        help="Report throughput, cache hit rate and the time spent on glossaries, encoding and vocabulary filtering to stderr when done.")
+    parser.add_argument(
+        '--stats-interval', type=float, default=None,
+        metavar="SECONDS",
+        help="Also report statistics every SECONDS seconds while processing (per worker in parallel mode). Implies --stats.")
+    parser.add_argument(
+        '--stats-file', type=str, default=None,
+        metavar="PATH",
+        help="Append statistics to PATH as JSON lines, instead of writing them to stderr. Implies --stats.")
 
     return parser
 
-def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache, glossaries_regex=None, is_bytes=False, dropout=0):
-    """Encode word based on list of BPE merge operations, which are applied consecutively
+def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache, glossaries_regex=None, is_bytes=False, dropout=0, rng=None):
+    """Encode word based on list of BPE merge operations, which are applied consecutively.
+    Dropout uses the random number generator rng (default: the random module).
     """
 
-    if not dropout and orig in cache:
-        return cache[orig]
+    if not dropout:
+        # get() rather than a membership test: another thread may drop the entry in between (see trim_cache())
+        cached = cache.get(orig)
+        if cached is not None:
+            return cached
 
     if glossaries_regex and glossaries_regex.match(orig):
         cache[orig] = (orig,)
@@ -298,10 +1290,12 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache,
     else:
         raise NotImplementedError
 
+    rand = rng.random if rng is not None else random.random
+
     while len(word) > 1:
 
         # get list of symbol pairs; optionally apply dropout
-        pairs = [(bpe_codes[pair],i,pair) for (i,pair) in enumerate(zip(word, word[1:])) if (not dropout or random.random() > dropout) and pair in bpe_codes]
+        pairs = [(bpe_codes[pair],i,pair) for (i,pair) in enumerate(zip(word, word[1:])) if (not dropout or rand() > dropout) and pair in bpe_codes]
 
         if not pairs:
             break
@@ -338,7 +1332,196 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache,
     if vocab:
         word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
 
-    cache[orig] = word
+    if not dropout:
+        cache[orig] = word
+    return word
+
+def encode_limits(orig, limits, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache, glossaries_regex=None, is_bytes=False):
+    """Encode word with several merge limits at once, returning one segmentation per limit.
+
+    encode() applies the merge operation with the lowest rank among all symbol pairs in the word.
+    With only the first N merge operations, the same merges are applied until the lowest rank is >= N,
+    at which point no pair is left and encoding stops. The segmentation for each limit is thus
+    a snapshot of a single encoding pass with all merge operations.
+    """
+
+    cached = cache.get(orig)
+    if cached is not None:
+        return cached
+
+    if glossaries_regex and glossaries_regex.match(orig):
+        cache[orig] = [(orig,)] * len(limits)
+        return cache[orig]
+
+    if len(orig) == 1:
+        return [(orig,)] * len(limits)
+
+    # isolating glossaries can leave empty segments
+    if not orig:
+        return [()] * len(limits)
+
+    eow = b'</w>' if is_bytes else '</w>'
+
+    if is_bytes:
+        word = list(map(lambda b: bytes([b]), orig[:-1])) + [orig[-1:] + eow]
+    elif version == (0, 1):
+        word = list(orig) + ['</w>']
+    elif version == (0, 2): # more consistent handling of word-final segments
+        word = list(orig[:-1]) + [orig[-1] + eow]
+    else:
+        raise NotImplementedError
+
+    # take snapshots in order of increasing limit (-1: all merge operations)
+    order = sorted(range(len(limits)), key=lambda k: limits[k] if limits[k] >= 0 else sys.maxsize)
+    snapshots = [None] * len(limits)
+    k = 0
+
+    while len(word) > 1:
+
+        # get list of symbol pairs
+        pairs = [(bpe_codes[pair],i,pair) for (i,pair) in enumerate(zip(word, word[1:])) if pair in bpe_codes]
+
+        if not pairs:
+            break
+
+        #get first merge operation in list of BPE codes
+        rank, _, bigram = min(pairs)
+
+        # this merge is not available with limits <= rank
+        while k < len(order) and 0 <= limits[order[k]] <= rank:
+            snapshots[order[k]] = word
+            k += 1
+
+        # find start position of all pairs that we want to merge
+        positions = [i for (r,i,pair) in pairs if pair == bigram]
+
+        i = 0
+        new_word = []
+        if is_bytes:
+            bigram = b''.join(bigram)
+        else:
+            bigram = ''.join(bigram)
+        for j in positions:
+            # merges are invalid if they start before current position. This can happen if there are overlapping pairs: (x x x -> xx x)
+            if j < i:
+                continue
+            new_word.extend(word[i:j]) # all symbols before merged pair
+            new_word.append(bigram) # merged pair
+            i = j+2 # continue after merged pair
+        new_word.extend(word[i:]) # add all symbols until end of word
+        word = new_word
+
+    for k in order[k:]:
+        snapshots[k] = word
+
+    words = []
+    for word in snapshots:
+        word = list(word)
+        # don't print end-of-word symbols
+        if word[-1] == eow:
+            word = word[:-1]
+        elif word[-1].endswith(eow):
+            word[-1] = word[-1][:-4]
+
+        word = tuple(word)
+        if vocab:
+            word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
+        words.append(word)
+
+    cache[orig] = words
+    return words
+
+def get_byte_codes(bpe_codes):
+    """Map byte-level BPE merge operations to integer symbol IDs.
+
+    IDs 0-255 are single bytes, and IDs 256-511 word-final bytes (with '</w>'),
+    so the initial segmentation of a word is simply its list of byte values.
+    Returns a dictionary from symbol pairs (encoded as first << 32 | second)
+    to (rank, ID of merged symbol), and the list of symbols indexed by ID.
+    """
+
+    symbols = [bytes((b,)) for b in range(256)] + [bytes((b,)) + b'</w>' for b in range(256)]
+    symbol_ids = dict((symbol, i) for (i, symbol) in enumerate(symbols))
+
+    merges = {}
+    for (first, second), rank in bpe_codes.items():
+        for symbol in (first, second, first + second):
+            if symbol not in symbol_ids:
+                symbol_ids[symbol] = len(symbols)
+                symbols.append(symbol)
+        merges[symbol_ids[first] << 32 | symbol_ids[second]] = (rank, symbol_ids[first + second])
+
+    return merges, symbols
+
+def encode_bytes(orig, merges, symbols, bpe_codes_reverse, vocab, separator, cache, glossaries_regex=None, dropout=0, rng=None):
+    """Encode word (bytes) with byte-level BPE. Equivalent to encode() with is_bytes=True,
+    but operates on integer symbol IDs (see get_byte_codes())
+    """
+
+    if not dropout:
+        # get() rather than a membership test: another thread may drop the entry in between (see trim_cache())
+        cached = cache.get(orig)
+        if cached is not None:
+            return cached
+
+    if glossaries_regex and glossaries_regex.match(orig):
+        cache[orig] = (orig,)
+        return (orig,)
+
+    if len(orig) == 1:
+        return (orig,)
+
+    # isolating glossaries can leave empty segments
+    if not orig:
+        return ()
+
+    word = list(orig)
+    word[-1] += 256
+
+    rand = rng.random if rng is not None else random.random
+
+    while len(word) > 1:
+
+        # get list of symbol pairs; optionally apply dropout
+        pairs = []
+        for i in range(len(word)-1):
+            if dropout and rand() <= dropout:
+                continue
+            merge = merges.get(word[i] << 32 | word[i+1])
+            if merge is not None:
+                pairs.append((merge[0], i, merge[1]))
+
+        if not pairs:
+            break
+
+        #get first merge operation in list of BPE codes
+        rank, _, bigram = min(pairs)
+
+        i = 0
+        new_word = []
+        for (other_rank, j, _) in pairs:
+            # merges are invalid if they start before current position. This can happen if there are overlapping pairs: (x x x -> xx x)
+            if other_rank != rank or j < i:
+                continue
+            new_word.extend(word[i:j]) # all symbols before merged pair
+            new_word.append(bigram) # merged pair
+            i = j+2 # continue after merged pair
+        new_word.extend(word[i:]) # add all symbols until end of word
+        word = new_word
+
+    # don't print end-of-word symbols
+    word = [symbols[i] for i in word]
+    if word[-1] == b'</w>':
+        word = word[:-1]
+    elif word[-1].endswith(b'</w>'):
+        word[-1] = word[-1][:-4]
+
+    word = tuple(word)
+    if vocab:
+        word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
+
+    if not dropout:
+        cache[orig] = word
     return word
 
 def recursive_split(segment, bpe_codes, vocab, separator, final=False):
@@ -393,14 +1576,23 @@ def check_vocab_and_split(orig, bpe_codes, vocab, separator):
     return out
 
 
-def read_vocabulary(vocab_file, threshold):
+def read_vocabulary(vocab_file, threshold, is_bytes=False):
     """read vocabulary file produced by get_vocab.py, and filter according to frequency threshold.
+    Binary vocabulary files (get_vocab.py --binary) are detected automatically.
     """
 
+    if is_binary_vocabulary(getattr(vocab_file, 'name', None)):
+        with open(vocab_file.name, 'rb') as f:
+            vocab = read_binary_vocabulary(f, is_bytes)
+        return set(word for word, freq in vocab if threshold == None or freq >= threshold)
+
     vocabulary = set()
 
+    strip_chars = b'\r\n ' if is_bytes else '\r\n '
+    split_char = b' ' if is_bytes else ' '
+
     for line in vocab_file:
-        word, freq = line.strip('\r\n ').split(' ')
+        word, freq = line.strip(strip_chars).split(split_char)
         freq = int(freq)
         if threshold == None or freq >= threshold:
             vocabulary.add(word)
@@ -439,6 +1631,197 @@ def isolate_glossary(word, glossary, is_bytes=False):
             segments = list(filter(None, segments)) # Remove empty strings in regex group.
             return segments + [ending.strip(strip_chars)] if ending != empty_string else segments
 
+def get_content_chunks(filename, chunk_lines=100000):
+    """split file into chunks of complete lines at content-defined boundaries.
+
+    A chunk ends after a line whose checksum is divisible by chunk_lines (and which is at least chunk_lines/4 lines
+    into the chunk), or after 4*chunk_lines lines. Since boundaries depend on the content of lines, not on their position,
+    inserting, deleting or changing lines only changes the chunks around them.
+    Returns a list of (begin, end, hash) tuples, with byte offsets and a hash of the content of each chunk."""
+    chunks = []
+    min_lines = max(chunk_lines // 4, 1)
+    max_lines = 4 * chunk_lines
+    with open(filename, 'rb') as f:
+        begin = end = lines = 0
+        h = hashlib.blake2b(digest_size=16)
+        for line in f:
+            h.update(line)
+            end += len(line)
+            lines += 1
+            if (lines >= min_lines and zlib.crc32(line) % chunk_lines == 0) or lines >= max_lines:
+                chunks.append((begin, end, h.hexdigest()))
+                begin = end
+                lines = 0
+                h = hashlib.blake2b(digest_size=16)
+        if lines:
+            chunks.append((begin, end, h.hexdigest()))
+    return chunks
+
+def write_manifest(manifest, content):
+    tmp = manifest + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmp, manifest)
+
+def apply_with_manifest(bpe, filename, outfile, manifest, chunk_lines=100000, num_workers=1, backend='processes', binary=False):
+    """segment file filename like BPE.process_lines(), but keep the segmented chunks of the file (see get_content_chunks())
+    in the directory manifest + '.chunks', and a record of them in the JSON file manifest.
+
+    The output of each chunk is named after the hash of its content and the hash of the model (see BPE.get_model_hash()),
+    and only stored once it is complete. When the job is run again (e.g. after a crash, or after part of the input has changed),
+    chunks whose output already exists are reused, and only missing or changed chunks are segmented.
+    Outputs of chunks that are no longer part of the input are removed. Returns the number of segmented and reused chunks.
+
+    Chunks are stored as soon as they are finished. The manifest is rewritten at most every MANIFEST_INTERVAL seconds,
+    and at the end; whether a chunk is done is decided by the existence of its output, so a stale manifest loses no work."""
+
+    binary = binary or bpe.is_bytes
+    chunk_dir = manifest + '.chunks'
+    if not os.path.isdir(chunk_dir):
+        os.makedirs(chunk_dir)
+
+    model = bpe.get_model_hash()
+    chunks = [{'begin': begin, 'end': end, 'hash': digest, 'output': '{0}.{1}'.format(digest, model[:16])}
+              for (begin, end, digest) in get_content_chunks(filename, chunk_lines)]
+    for chunk in chunks:
+        chunk['done'] = os.path.exists(os.path.join(chunk_dir, chunk['output']))
+    content = {'input': os.path.abspath(filename), 'model': model, 'chunk_lines': chunk_lines, 'chunks': chunks}
+    write_manifest(manifest, content)
+
+    # identical chunks are segmented once
+    todo = collections.OrderedDict()
+    for chunk in chunks:
+        if not chunk['done']:
+            todo.setdefault(chunk['output'], chunk)
+
+    by_output = collections.defaultdict(list)
+    for chunk in chunks:
+        by_output[chunk['output']].append(chunk)
+    last_written = [time.time()]
+
+    def finish(output):
+        os.replace(os.path.join(chunk_dir, output + '.tmp'), os.path.join(chunk_dir, output))
+        for chunk in by_output[output]:
+            chunk['done'] = True
+        if time.time() - last_written[0] >= MANIFEST_INTERVAL:
+            write_manifest(manifest, content)
+            last_written[0] = time.time()
+
+    if num_workers > 1 and len(todo) > 1:
+        with BPEExecutor(bpe, num_workers, backend=backend) as executor:
+            results = []
+
+            def finish_ready():
+                for item in [item for item in results if item[1].ready()]:
+                    results.remove(item)
+                    item[1].get()
+                    finish(item[0])
+
+            # at most max_pending jobs of the executor are running; finished chunks are stored before the next job is submitted
+            for job, (output, chunk) in enumerate(todo.items()):
+                finish_ready()
+                results.append((output, executor._submit(filename, os.path.join(chunk_dir, output + '.tmp'), 0, chunk['begin'], chunk['end'], job, binary)))
+            while results:
+                results[0][1].wait()
+                finish_ready()
+    else:
+        for output, chunk in todo.items():
+            _process_lines(bpe, filename, os.path.join(chunk_dir, output + '.tmp'), 0, chunk['begin'], chunk['end'], binary=binary)
+            finish(output)
+    write_manifest(manifest, content)
+
+    # stitch output
+    for chunk in chunks:
+        path = os.path.join(chunk_dir, chunk['output'])
+        if binary:
+            f = open(path, 'rb')
+        else:
+            f = open(path, encoding='utf-8', newline='')
+        with f:
+            shutil.copyfileobj(f, outfile, BLOCK_SIZE)
+
+    # remove outputs of old chunks, and of unfinished jobs
+    outputs = set(chunk['output'] for chunk in chunks)
+    for name in os.listdir(chunk_dir):
+        if name not in outputs:
+            os.remove(os.path.join(chunk_dir, name))
+
+    return len(todo), len(chunks) - len(todo)
+
+def check_manifest_args(args):
+    """validate command line arguments for --manifest"""
+    if args.input.name == '<stdin>':
+        sys.stderr.write('Error: --manifest needs an input file (not STDIN)\n')
+        sys.exit(1)
+    if args.dropout:
+        sys.stderr.write('Error: --dropout is not supported with --manifest\n')
+        sys.exit(1)
+    if args.multi_merges:
+        sys.stderr.write('Error: --multi-merges is not supported with --manifest\n')
+        sys.exit(1)
+
+def check_fields_args(args, is_bytes):
+    """validate command line arguments for --input-format and --fields"""
+    if args.input_format == 'text':
+        if args.fields or args.field_codes:
+            sys.stderr.write('Error: --fields and --field-codes need --input-format tsv or jsonl\n')
+            sys.exit(1)
+        return
+    if not args.fields:
+        sys.stderr.write('Error: --input-format {0} needs --fields\n'.format(args.input_format))
+        sys.exit(1)
+    if is_bytes:
+        sys.stderr.write('Error: --input-format {0} is not supported with byte-level BPE\n'.format(args.input_format))
+        sys.exit(1)
+    if args.multi_merges:
+        sys.stderr.write('Error: --multi-merges is not supported with --input-format {0}\n'.format(args.input_format))
+        sys.exit(1)
+    if args.input_format == 'tsv' and not all(field.isdigit() for field in args.fields):
+        sys.stderr.write('Error: TSV fields are column numbers\n')
+        sys.exit(1)
+    for item in args.field_codes:
+        field, _, path = item.partition('=')
+        if not path or field not in args.fields:
+            sys.stderr.write('Error: invalid --field-codes {0} (expected FIELD=PATH, with FIELD in --fields)\n'.format(item))
+            sys.exit(1)
+    # records are decoded
+    args.fast_io = False
+
+def load_field_models(args, vocabulary):
+    """load BPE models given with --field-codes"""
+    models = {}
+    for item in args.field_codes:
+        field, _, path = item.partition('=')
+        if get_byte_mode(path):
+            sys.stderr.write('Error: --input-format {0} is not supported with byte-level BPE\n'.format(args.input_format))
+            sys.exit(1)
+        with codecs.open(path, encoding='utf-8') as codes:
+            models[field] = BPE(codes, -1, args.separator, vocabulary, args.glossaries, False, args.max_token_length, args.long_token_policy)
+    return models
+
+def check_multi_merges_args(args):
+    """validate command line arguments for --multi-merges"""
+    if not args.multi_output or len(args.multi_output) != len(args.multi_merges):
+        sys.stderr.write('Error: --multi-output needs exactly one output file for each value of --multi-merges\n')
+        sys.exit(1)
+    if args.dropout:
+        sys.stderr.write('Error: --dropout is not supported with --multi-merges\n')
+        sys.exit(1)
+    if args.num_workers > 1:
+        warnings.warn("--multi-merges is not supported in parallel mode. Using 1 processor instead.")
+
+def apply_multi_merges(bpe, infile, outfiles, limits):
+    """segment infile with several merge limits in one pass, writing one file per limit"""
+    if bpe.is_bytes:
+        outfiles = [open(path, 'wb') for path in outfiles]
+    else:
+        outfiles = [codecs.open(path, 'w', encoding='utf-8') for path in outfiles]
+    for line in infile:
+        for outfile, out in zip(outfiles, bpe.process_line_limits(line, limits)):
+            outfile.write(out)
+    for outfile in outfiles:
+        outfile.close()
+
 # first line of BPE code file indicates if it is byte-level or UTF-8
 def get_byte_mode(code_file_name):
     firstline = open(code_file_name, mode='rb').readline()
@@ -447,29 +1830,11 @@ def get_byte_mode(code_file_name):
     else:
         return False
 
-if __name__ == '__main__':
-
-    currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-    newdir = os.path.join(currentdir, 'subword_nmt')
-    if os.path.isdir(newdir):
-        warnings.warn(
-            "this script's location has moved to {0}. This symbolic link will be removed in a future version. Please point to the new location, or install the package and use the command 'subword-nmt'".format(newdir),
-            DeprecationWarning
-        )
-
-    # python 2/3 compatibility
-    if sys.version_info < (3, 0):
-        print("Python 2 is deprecated. Use Python 3")
-        sys.exit(1)
-    else:
-        sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
-        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
-        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', write_through=True, line_buffering=True)
-
-    parser = create_parser()
-    args = parser.parse_args()
+def main(args):
 
     if args.num_workers <= 0:
+        # imported here to keep start-up fast when no workers are used
+        from multiprocessing import cpu_count
         args.num_workers = cpu_count()
 
     # check if codes are bytes or UTF-8
@@ -477,6 +1842,12 @@ if __name__ == '__main__':
 
     args.separator = args.separator.decode('UTF-8') if not is_bytes else args.separator
 
+    # --multi-merges segments decoded text
+    if args.multi_merges:
+        args.fast_io = False
+
+    check_fields_args(args, is_bytes)
+
     # read/write files as bytes or UTF-8, depending on mode
 
     if is_bytes:
@@ -486,31 +1857,72 @@ if __name__ == '__main__':
             args.output = sys.stdout.buffer
     else:
         args.codes = codecs.open(args.codes.name, encoding='utf-8')
-        if args.input.name != '<stdin>':
-            args.input = codecs.open(args.input.name, encoding='utf-8')
-        if args.output.name != '<stdout>':
-            args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
+        if args.fast_io:
+            # segment input as UTF-8 bytes
+            if args.input.name == '<stdin>':
+                args.input = sys.stdin.buffer
+            if args.output.name == '<stdout>':
+                args.output = sys.stdout.buffer
+        else:
+            if args.input.name != '<stdin>':
+                args.input = codecs.open(args.input.name, encoding='utf-8')
+            if args.output.name != '<stdout>':
+                args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
         if args.vocabulary:
             args.vocabulary = codecs.open(args.vocabulary.name, encoding='utf-8')
 
 
     if args.vocabulary:
-        vocabulary = read_vocabulary(args.vocabulary, args.vocabulary_threshold)
+        vocabulary = read_vocabulary(args.vocabulary, args.vocabulary_threshold, is_bytes)
     else:
         vocabulary = None
 
     if args.seed is not None:
         random.seed(args.seed)
 
-    bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries, is_bytes)
+    if args.multi_merges:
+        check_multi_merges_args(args)
+        args.merges = -1 if min(args.multi_merges) < 0 else max(args.multi_merges)
+
+    if args.manifest:
+        check_manifest_args(args)
 
-    if args.input.name == '<stdin>' or args.num_workers == 1:
+    bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries, is_bytes, args.max_token_length, args.long_token_policy)
+
+    if args.stats or args.stats_interval or args.stats_file:
+        bpe.enable_stats(args.stats_interval, args.stats_file)
+
+    if args.line_cache:
+        bpe.enable_line_cache(args.line_cache)
+
+    if args.fields:
+        bpe.enable_fields(args.input_format, args.fields, load_field_models(args, vocabulary))
+
+    if args.multi_merges:
+        apply_multi_merges(bpe, args.input, args.multi_output, args.multi_merges)
+    elif args.manifest:
+        segmented, reused = apply_with_manifest(bpe, args.input.name, args.output, args.manifest, args.chunk_lines,
+                                                args.num_workers, args.executor, args.fast_io)
+        sys.stderr.write('{0} chunks segmented, {1} chunks reused\n'.format(segmented, reused))
+    elif args.input.name == '<stdin>' or args.num_workers == 1:
         if args.num_workers > 1:
             warnings.warn("In parallel mode, the input cannot be STDIN. Using 1 processor instead.")
-        for line in args.input:
-            args.output.write(bpe.process_line(line, args.dropout))
+        if args.fast_io:
+            write_blocks(args.output, (bpe.process_line(line, args.dropout) for line in args.input))
+        else:
+            for line in args.input:
+                args.output.write(bpe.process_line(line, args.dropout))
     else:
-        bpe.process_lines(args.input.name, args.output, args.dropout, args.num_workers)
+        bpe.process_lines(args.input.name, args.output, args.dropout, args.num_workers, args.executor, args.seed, args.fast_io)
+
+    if bpe.stats is not None:
+        bpe.stats.report(bpe.get_stats())
+
+    if bpe.line_cache is not None and not args.dropout:
+        bpe.line_cache.report()
+
+    if bpe.long_tokens:
+        sys.stderr.write('{0} tokens longer than {1} were handled with policy "{2}"\n'.format(bpe.long_tokens, args.max_token_length, args.long_token_policy))
 
     # close files
     args.codes.close()
@@ -520,3 +1932,29 @@ if __name__ == '__main__':
         args.output.close()
     if args.vocabulary:
         args.vocabulary.close()
+
+if __name__ == '__main__':
+
+    import inspect
+
+    currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+    newdir = os.path.join(currentdir, 'subword_nmt')
+    if os.path.isdir(newdir):
+        warnings.warn(
+            "this script's location has moved to {0}. This symbolic link will be removed in a future version. Please point to the new location, or install the package and use the command 'subword-nmt'".format(newdir),
+            DeprecationWarning
+        )
+
+    # python 2/3 compatibility
+    if sys.version_info < (3, 0):
+        print("Python 2 is deprecated. Use Python 3")
+        sys.exit(1)
+    else:
+        sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', write_through=True, line_buffering=True)
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reproducible speed benchmarks for learn-bpe, apply-bpe and get-vocab, and start-up time of apply-bpe.
+
+Benchmarks are run on the bundled test corpus, and on synthetic corpora with a Zipfian word distribution
+of the requested sizes (generated deterministically from --seed, and cached in --work-dir).
+Results are written as JSON, so that different builds or machines can be compared.
+
+Example:
+    python -m subword_nmt.benchmark --scales 1000000 10000000 --max-workers 4 -o results.json
+
+Parallel scaling is measured with worker processes and threads; run the benchmarks with a free-threaded
+Python build (e.g. python3.13t) to compare thread scaling with and without the GIL.
+"""
+
+from __future__ import unicode_literals, division
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import codecs
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#hack to get imports working if running this as a script, or within a package
+try:
+    from .learn_bpe import learn_bpe, get_vocabulary, summarize_trace
+    from .apply_bpe import BPE
+except ImportError:
+    from learn_bpe import learn_bpe, get_vocabulary, summarize_trace
+    from apply_bpe import BPE
+
+BUNDLED_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'data', 'corpus.en')
+
+def create_parser():
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        '--scales', type=int, nargs='*', default=[1000000],
+        metavar='TOKENS',
+        help="Sizes of synthetic corpora, in tokens (default: %(default)s)")
+    parser.add_argument(
+        '--no-bundled', action='store_true',
+        help="Do not benchmark the bundled test corpus")
+    parser.add_argument(
+        '--symbols', '-s', type=int, default=10000,
+        help="Number of merge operations to learn (default: %(default)s)")
+    parser.add_argument(
+        '--apply-lines', type=int, default=100000,
+        metavar='INT',
+        help="Number of lines used for apply-bpe throughput benchmarks (default: %(default)s)")
+    parser.add_argument(
+        '--max-workers', type=int, default=1,
+        metavar='INT',
+        help="Measure parallel scaling with 1 to INT workers (in powers of 2) (default: %(default)s)")
+    parser.add_argument(
+        '--seed', type=int, default=1,
+        help="Random seed for generating synthetic corpora (default: %(default)s)")
+    parser.add_argument(
+        '--work-dir', type=str, default=os.path.join(tempfile.gettempdir(), 'subword-nmt-benchmark'),
+        metavar='PATH',
+        help="Directory for generated corpora (default: '%(default)s')")
+    parser.add_argument(
+        '--output', '-o', type=argparse.FileType('w'), default=sys.stdout,
+        metavar='PATH',
+        help="Output file for JSON results (default: standard output)")
+
+    return parser
+
+def generate_corpus(filename, num_tokens, seed=1, num_types=100000, zipf_exponent=1.1, line_length=20):
+    """write synthetic corpus with num_tokens tokens to filename.
+    Words are built from random syllables (so that they share subwords), and follow a Zipfian distribution."""
+
+    rng = random.Random(seed)
+    consonants = 'bcdfghjklmnprstvwz'
+    vowels = 'aeiouy'
+    syllables = [c + v for c in consonants for v in vowels] + [c + v + c2 for c in consonants for v in vowels for c2 in 'nrst']
+
+    words = set()
+    while len(words) < num_types:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(1, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+
+    # cumulative Zipfian weights
+    cum_weights = []
+    total = 0
+    for rank in range(1, num_types + 1):
+        total += 1 / rank**zipf_exponent
+        cum_weights.append(total)
+
+    with codecs.open(filename, 'w', encoding='utf-8') as f:
+        written = 0
+        while written < num_tokens:
+            length = min(rng.randint(1, 2 * line_length - 1), num_tokens - written)
+            tokens = rng.choices(words, cum_weights=cum_weights, k=length)
+            f.write(' '.join(tokens) + '\n')
+            written += length
+
+def max_rss():
+    """peak resident set size of this process in kilobytes (None if unavailable)"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+@contextmanager
+def quiet_stderr():
+    """silence progress bars and messages written to stderr"""
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+
+def timed(function, *args, **kwargs):
+    """call function, and return its result and run time in seconds"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def benchmark_learn(corpus, num_symbols):
+
+    results = {}
+
+    with codecs.open(corpus, encoding='utf-8') as f:
+        vocab, results['get_vocabulary'] = timed(get_vocabulary, f)
+    results['types'] = len(vocab)
+    results['tokens'] = sum(vocab.values())
+
+    # learn from dictionary, so that word counting is not included
+    vocab_list = ['{0} {1}'.format(word, freq) for (word, freq) in vocab.items()]
+    codes = io.StringIO()
+    trace = io.StringIO()
+    with quiet_stderr():
+        _, results['learn_bpe'] = timed(learn_bpe, vocab_list, codes, num_symbols, is_dict=True, trace=trace, trace_every=num_symbols)
+    results['merges'] = codes.getvalue().count('\n') - 1
+
+    # time per phase of learn_bpe()
+    trace.seek(0)
+    summary = summarize_trace(trace)
+    results['phases'] = dict(summary['setup'], **summary['phases'])
+    results['max_stats_size'] = summary['max_stats_size']
+    results['max_rss_kb'] = max_rss()
+
+    return results, codes
+
+def benchmark_apply(codes, lines):
+    """measure throughput of BPE.process_line() in different configurations, with cold and warm cache"""
+
+    num_tokens = sum(len(line.split()) for line in lines)
+    num_bytes = sum(len(line.encode('utf-8')) for line in lines)
+
+    def throughput(bpe, dropout=0, lines=lines, function=None):
+        function = function or bpe.process_line
+        _, seconds = timed(lambda: [function(line, dropout) for line in lines])
+        return {'seconds': seconds,
+                'lines_per_second': len(lines) / seconds,
+                'tokens_per_second': num_tokens / seconds,
+                'bytes_per_second': num_bytes / seconds,
+                'cache_size': sum(bpe.get_cache_sizes().values())}
+
+    def allocated(bpe, dropout=0, lines=lines, function=None):
+        """memory (in kB) allocated for the results of one pass over lines, which are kept alive;
+        results that come from a cache only cost references to cached objects"""
+        function = function or bpe.process_line
+        tracemalloc.start()
+        results = [function(line, dropout) for line in lines]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / 1024
+
+    # vocabulary filter: all subword units that occur at least twice in the segmented text
+    codes.seek(0)
+    bpe = BPE(codes)
+    counts = {}
+    for line in lines:
+        for unit in bpe.process_line(line).split():
+            counts[unit] = counts.get(unit, 0) + 1
+    vocab = set(unit for unit, count in counts.items() if count >= 2)
+
+    configurations = [('plain', {}, 0),
+                      ('dropout', {}, 0.1),
+                      ('vocabulary', {'vocab': vocab}, 0),
+                      ('glossaries', {'glossaries': ['[0-9]+', 'ba', 'ko']}, 0)]
+
+    results = {'lines': len(lines), 'tokens': num_tokens, 'bytes': num_bytes}
+    for name, options, dropout in configurations:
+        codes.seek(0)
+        bpe = BPE(codes, **options)
+        results[name] = {'cold': throughput(bpe, dropout),
+                         'warm': throughput(bpe, dropout),
+                         'allocated_kb': allocated(bpe, dropout)}
+
+    # lists of subword units (BPE.segment_tokens())
+    segment_tokens = lambda line, dropout: bpe.segment_tokens(line.split(), dropout)
+    codes.seek(0)
+    bpe = BPE(codes)
+    results['segment_tokens'] = {'cold': throughput(bpe, function=segment_tokens),
+                                 'warm': throughput(bpe, function=segment_tokens),
+                                 'allocated_kb': allocated(bpe, function=segment_tokens)}
+
+    # UTF-8 encoded lines (apply-bpe --fast-io)
+    utf8_lines = [line.encode('utf-8') for line in lines]
+    codes.seek(0)
+    bpe = BPE(codes)
+    results['utf8'] = {'cold': throughput(bpe, lines=utf8_lines),
+                       'warm': throughput(bpe, lines=utf8_lines),
+                       'allocated_kb': allocated(bpe, lines=utf8_lines)}
+    results['max_rss_kb'] = max_rss()
+
+    return results
+
+def benchmark_parallel(corpus, codes, max_workers):
+    """measure run time of parallel get_vocabulary() and BPE.process_lines() on full corpus,
+    with worker processes and threads"""
+
+    results = {'get_vocabulary': {}, 'process_lines': {}, 'process_lines_threads': {}}
+    num_workers = 1
+    while num_workers <= max_workers:
+        with codecs.open(corpus, encoding='utf-8') as f:
+            _, results['get_vocabulary'][num_workers] = timed(get_vocabulary, f, num_workers=num_workers)
+
+        for backend, name in [('processes', 'process_lines'), ('threads', 'process_lines_threads')]:
+            codes.seek(0)
+            bpe = BPE(codes)
+            with codecs.open(os.devnull, 'w', encoding='utf-8') as out:
+                _, results[name][num_workers] = timed(bpe.process_lines, corpus, out, num_workers=num_workers, backend=backend)
+        num_workers *= 2
+
+    return results
+
+def benchmark_startup(codes, merges, repeats=5):
+    """measure start-up time of the apply-bpe command (interpreter start, imports, and loading the codes)
+    on empty input, and the time to load the codes in-process, with different numbers of merge operations.
+    Times are the minimum over repeats."""
+
+    with tempfile.NamedTemporaryFile('w', suffix='.codes', delete=False) as codes_file:
+        codes.seek(0)
+        codes_file.write(codes.read())
+
+    # run the package that is benchmarked, not an installed version. 'python -c' puts the working directory first
+    # on the module search path, where a subword_nmt.py module (e.g. in the package directory) would shadow the package,
+    # so commands run in the parent directory of the package
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+
+    def run(command):
+        return min(timed(subprocess.run, command, cwd=root, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, check=True)[1] for _ in range(repeats))
+
+    apply_bpe = [sys.executable, '-c', 'from subword_nmt.subword_nmt import main; main()', 'apply-bpe', '-c', codes_file.name]
+    results = {'interpreter': run([sys.executable, '-c', 'pass']), 'apply_bpe': {}, 'load_codes': {}}
+    for limit in merges:
+        name = 'all' if limit == -1 else str(limit)
+        results['apply_bpe'][name] = run(apply_bpe + ['--merges', str(limit)])
+        with codecs.open(codes_file.name, encoding='utf-8') as f:
+            results['load_codes'][name] = min(timed(BPE, f, limit)[1] for _ in range(repeats))
+    os.remove(codes_file.name)
+
+    return results
+
+def run_benchmarks(corpora, num_symbols, apply_lines, max_workers):
+
+    results = {'python': platform.python_version(),
+               'implementation': platform.python_implementation(),
+               'platform': platform.platform(),
+               # free-threaded builds can run without the GIL
+               'gil': getattr(sys, '_is_gil_enabled', lambda: True)(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'symbols': num_symbols,
+               'corpora': {}}
+
+    for name, corpus in corpora:
+        sys.stderr.write('benchmarking {0}\n'.format(name))
+        corpus_results = {}
+        corpus_results['learn'], codes = benchmark_learn(corpus, num_symbols)
+
+        with codecs.open(corpus, encoding='utf-8') as f:
+            lines = [line for (i, line) in zip(range(apply_lines), f)]
+        corpus_results['apply'] = benchmark_apply(codes, lines)
+
+        corpus_results['parallel'] = benchmark_parallel(corpus, codes, max_workers)
+        corpus_results['startup'] = benchmark_startup(codes, [1000, -1])
+        results['corpora'][name] = corpus_results
+
+    return results
+
+if __name__ == '__main__':
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    corpora = []
+    if not args.no_bundled:
+        corpora.append(('bundled', BUNDLED_CORPUS))
+
+    if not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+    for num_tokens in args.scales:
+        filename = os.path.join(args.work_dir, 'zipf.{0}.{1}.txt'.format(num_tokens, args.seed))
+        if not os.path.exists(filename):
+            sys.stderr.write('generating corpus with {0} tokens\n'.format(num_tokens))
+            generate_corpus(filename + '.tmp', num_tokens, args.seed)
+            os.rename(filename + '.tmp', filename)
+        corpora.append(('zipf-{0}'.format(num_tokens), filename))
+
+    results = run_benchmarks(corpora, args.symbols, args.apply_lines, args.max_workers)
+
+    json.dump(results, args.output, indent=2, sort_keys=True)
+    args.output.write('\n')
@@ -4,6 +4,13 @@
 
 """Compute chrF3 for machine translation evaluation
 
+Reference n-grams are extracted once (and can be cached on disk with --ref-cache),
+and several hypothesis files can be scored against them in parallel.
+Per-sentence statistics (--sentence-stats) and paired bootstrap resampling (--bootstrap) require NumPy.
+
+For use as a library (e.g. for validation during training), ChrF accumulates statistics
+over batches of hypothesis and reference strings.
+
 Reference:
 Maja Popović (2015). chrF: character n-gram F-score for automatic MT evaluation. In Proceedings of the Tenth Workshop on Statistical Machine Translationn, pages 392–395, Lisbon, Portugal.
 """
@@ -11,20 +18,30 @@ Maja Popović (2015). chrF: character n-gram F-score for automatic MT evaluation
 from __future__ import print_function, unicode_literals, division
 
 import sys
+import os
 import codecs
 import io
 import argparse
+import hashlib
+import json
+from multiprocessing import Pool, cpu_count
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 
 # hack for python2/3 compatibility
 from io import open
 argparse.open = open
 
-def create_parser():
-    parser = argparse.ArgumentParser(
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        description="learn BPE-based word segmentation")
+def create_parser(subparsers=None):
+
+    if subparsers:
+        parser = subparsers.add_parser('chrf',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="compute chrF score")
+    else:
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="compute chrF score")
 
     parser.add_argument(
         '--ref', '-r', type=argparse.FileType('r'), required=True,
@@ -32,8 +49,8 @@ def create_parser():
         help="Reference file")
     parser.add_argument(
         '--hyp', type=argparse.FileType('r'), metavar='PATH',
-        default=sys.stdin,
-        help="Hypothesis file (default: stdin).")
+        default=[sys.stdin], nargs='+',
+        help="Hypothesis file(s) (default: stdin). If several files are given, each is scored against the reference.")
     parser.add_argument(
         '--beta', '-b', type=float, default=3,
         metavar='FLOAT',
@@ -51,6 +68,25 @@ def create_parser():
     parser.add_argument(
         '--recall', action='store_true',
         help="report recall (default: '%(default)s')")
+    parser.add_argument(
+        '--ref-cache', type=str, metavar='PATH', default=None,
+        help="cache reference n-grams in this file (JSON), and re-use them if reference and options are unchanged. "+
+             "Counts in the cache are trusted, so only use cache files you wrote")
+    parser.add_argument(
+        '--num-workers', type=int, default=1,
+        help="Number of processes to score several hypothesis files in parallel. If -1, set `multiprocessing.cpu_count()`. (default: %(default)s)")
+    parser.add_argument(
+        '--sentence-stats', type=str, metavar='PATH', default=None,
+        help="save per-sentence statistics (correct, hypothesis and reference n-grams of each order) as NumPy array "+
+             "of shape (sentences, ngram, 3), or (hypotheses, sentences, ngram, 3) if several hypotheses are given")
+    parser.add_argument(
+        '--bootstrap', type=int, metavar='INT', default=0,
+        help="report 95%% confidence intervals estimated with INT bootstrap samples. If several hypotheses are given, "+
+             "also report p-values of paired bootstrap resampling against the first hypothesis (default: no bootstrap)")
+    parser.add_argument(
+        '--seed', type=int, default=None,
+        metavar="S",
+        help="Random seed for bootstrap resampling.")
 
     return parser
 
@@ -61,26 +97,163 @@ def extract_ngrams(words, max_length=4, spaces=False):
     else:
         words = words.strip()
 
-    results = defaultdict(lambda: defaultdict(int))
-    for length in range(max_length):
-        for start_pos in range(len(words)):
-            end_pos = start_pos + length + 1
-            if end_pos <= len(words):
-                results[length][tuple(words[start_pos: end_pos])] += 1
+    # n-grams are represented as string slices
+    results = defaultdict(Counter)
+    for length in range(min(max_length, len(words))):
+        results[length] = Counter([words[start_pos:start_pos+length+1] for start_pos in range(len(words)-length)])
     return results
 
 
 def get_correct(ngrams_ref, ngrams_test, correct, total):
 
     for rank in ngrams_test:
-        for chain in ngrams_test[rank]:
-            total[rank] += ngrams_test[rank][chain]
-            if chain in ngrams_ref[rank]:
-                correct[rank] += min(ngrams_test[rank][chain], ngrams_ref[rank][chain])
+        test = ngrams_test[rank]
+        ref = ngrams_ref.get(rank, {})
+        total[rank] += sum(test.values())
+        correct[rank] += sum([min(count, ref[chain]) for chain, count in test.items() if chain in ref])
+
+    return correct, total
+
+
+def get_reference_ngrams(ref_lines, max_length, spaces=False, cache=None):
+    """extract n-grams of each reference line, and the total number of reference n-grams of each order.
+    If cache is given, results are stored in this file (as JSON), and loaded from it if the hash of the reference
+    and the options match. The cache holds plain data, but its counts are trusted: only use cache files you wrote."""
+
+    ref_lines = list(ref_lines)
+    key = [hashlib.sha1(''.join(ref_lines).encode('utf-8')).hexdigest(), max_length, spaces]
+
+    if cache and os.path.exists(cache):
+        with open(cache, encoding='utf-8') as f:
+            content = json.load(f)
+        if content.get('key') == key:
+            # n-grams of each line are stored as a list of counters, one per n-gram order
+            ngrams_ref = [defaultdict(Counter, ((rank, Counter(ngrams)) for (rank, ngrams) in enumerate(line)))
+                          for line in content['ngrams']]
+            return ngrams_ref, content['total']
+
+    ngrams_ref = [extract_ngrams(line, max_length=max_length, spaces=spaces) for line in ref_lines]
+    total_ref = [0]*max_length
+    for ngrams in ngrams_ref:
+        for rank in ngrams:
+            total_ref[rank] += sum(ngrams[rank].values())
+
+    if cache:
+        with open(cache, 'w', encoding='utf-8') as f:
+            json.dump({'key': key,
+                       'ngrams': [[ngrams[rank] for rank in range(len(ngrams))] for ngrams in ngrams_ref],
+                       'total': total_ref}, f, ensure_ascii=False)
+
+    return ngrams_ref, total_ref
+
+
+def get_statistics(hyp, ngrams_ref, max_length, spaces=False):
+    """count correct and total hypothesis n-grams of each order over all lines of a hypothesis file.
+    Missing hypothesis lines are treated as empty."""
+
+    correct = [0]*max_length
+    total = [0]*max_length
+    for ngrams in ngrams_ref:
+        line = hyp.readline()
+        ngrams_test = extract_ngrams(line, max_length=max_length, spaces=spaces)
+        get_correct(ngrams, ngrams_test, correct, total)
 
     return correct, total
 
 
+def get_sentence_statistics(hyp, ngrams_ref, max_length, spaces=False):
+    """compute sufficient statistics of each line of a hypothesis file, and return them as NumPy array
+    of shape (sentences, max_length, 3): number of correct hypothesis n-grams, total hypothesis n-grams,
+    and total reference n-grams of each order. Missing hypothesis lines are treated as empty."""
+
+    import numpy as np
+
+    stats = []
+    for ngrams in ngrams_ref:
+        line = hyp.readline()
+        ngrams_test = extract_ngrams(line, max_length=max_length, spaces=spaces)
+        correct = [0]*max_length
+        total = [0]*max_length
+        get_correct(ngrams, ngrams_test, correct, total)
+        total_ref = [sum(ngrams[rank].values()) if rank in ngrams else 0 for rank in range(max_length)]
+        stats.append(list(zip(correct, total, total_ref)))
+
+    return np.array(stats, dtype=np.int64).reshape(len(stats), max_length, 3)
+
+
+def f1_array(stats, beta=3):
+    """vectorised f1() for statistics arrays of shape (..., max_length, 3), summed over sentences.
+    Returns arrays of chrF, precision and recall."""
+
+    import numpy as np
+
+    correct, total_hyp, total_ref = stats[..., 0], stats[..., 1], stats[..., 2]
+    max_length = stats.shape[-2]
+    valid = (total_hyp > 0) & (total_ref > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(valid, correct / total_hyp, 0).sum(axis=-1) / max_length
+        recall = np.where(valid, correct / total_ref, 0).sum(axis=-1) / max_length
+        chrf = (1 + beta**2) * (precision*recall) / ((beta**2 * precision) + recall)
+
+    return np.nan_to_num(chrf), precision, recall
+
+
+def paired_bootstrap(stats, num_samples=1000, beta=3, seed=None, batch_size=None):
+    """resample sentences with replacement, and compute chrF of each sample.
+
+    stats has shape (systems, sentences, max_length, 3) (see get_sentence_statistics());
+    all systems are evaluated on the same samples. Returns array of shape (systems, num_samples).
+    Samples are drawn in batches of batch_size; by default, batches are as large as memory for
+    about 4M sentence weights allows, so that memory does not grow with the number of sentences.
+    """
+
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    num_systems, num_sents, max_length, _ = stats.shape
+    flat_stats = stats.reshape(num_systems, num_sents, max_length * 3).astype(np.float64)
+    if batch_size is None:
+        batch_size = max(1, (1 << 22) // num_sents)
+    pvals = np.full(num_sents, 1.0 / num_sents)
+
+    scores = []
+    for start in range(0, num_samples, batch_size):
+        # each row holds how often each sentence is drawn in one sample
+        weights = rng.multinomial(num_sents, pvals, size=min(batch_size, num_samples - start))
+        sample_stats = np.matmul(weights.astype(np.float64), flat_stats)
+        scores.append(f1_array(sample_stats.reshape(num_systems, -1, max_length, 3), beta)[0])
+
+    return np.concatenate(scores, axis=1)
+
+
+def paired_p_value(samples, baseline_samples, observed):
+    """p-value of paired bootstrap resampling: the fraction of samples in which the difference between a system
+    and the baseline does not have the sign of the observed difference (with add-one smoothing).
+    If the observed difference is 0, there is no evidence of a difference, and the p-value is 1."""
+
+    import numpy as np
+
+    if observed == 0:
+        return 1.0
+    delta = samples - baseline_samples
+    return (np.sum(delta * observed <= 0) + 1) / (len(delta) + 1)
+
+
+# reference n-grams shared by worker processes (set by _init_worker)
+_worker_ngrams_ref = None
+
+def _init_worker(ngrams_ref):
+    global _worker_ngrams_ref
+    _worker_ngrams_ref = ngrams_ref
+
+def _get_statistics(filename, max_length, spaces, sentence_level=False):
+    with open(filename, encoding='utf-8') as hyp:
+        if sentence_level:
+            return get_sentence_statistics(hyp, _worker_ngrams_ref, max_length, spaces)
+        return get_statistics(hyp, _worker_ngrams_ref, max_length, spaces)
+
+
 def f1(correct, total_hyp, total_ref, max_length, beta=3, smooth=0):
 
     precision = 0
@@ -94,32 +267,105 @@ def f1(correct, total_hyp, total_ref, max_length, beta=3, smooth=0):
     precision /= max_length
     recall /= max_length
 
+    if not precision and not recall:
+        return 0, precision, recall
+
     return (1 + beta**2) * (precision*recall) / ((beta**2 * precision) + recall), precision, recall
 
-def main(args):
+class ChrF(object):
+    """Incremental chrF scorer. Statistics are accumulated over batches of hypothesis and reference strings,
+    and scores are identical to those of main() on the same lines."""
 
-    correct = [0]*args.ngram
-    total = [0]*args.ngram
-    total_ref = [0]*args.ngram
-    for line in args.ref:
-      line2 = args.hyp.readline()
+    def __init__(self, ngram=6, beta=3, space=False):
 
-      ngrams_ref = extract_ngrams(line, max_length=args.ngram, spaces=args.space)
-      ngrams_test = extract_ngrams(line2, max_length=args.ngram, spaces=args.space)
+        self.ngram = ngram
+        self.beta = beta
+        self.space = space
+        self.reset()
 
-      get_correct(ngrams_ref, ngrams_test, correct, total)
+    def reset(self):
+        """discard all accumulated statistics"""
+        self.correct = [0]*self.ngram
+        self.total = [0]*self.ngram
+        self.total_ref = [0]*self.ngram
 
-      for rank in ngrams_ref:
-          for chain in ngrams_ref[rank]:
-              total_ref[rank] += ngrams_ref[rank][chain]
+    def add(self, hypotheses, references):
+        """accumulate statistics of a batch of hypotheses and their references (sequences of strings)"""
 
-    chrf, precision, recall = f1(correct, total, total_ref, args.ngram, args.beta)
+        if len(hypotheses) != len(references):
+            raise ValueError('got {0} hypotheses, but {1} references'.format(len(hypotheses), len(references)))
 
-    print('chrF3: {0:.4f}'.format(chrf))
-    if args.precision:
-        print('chrPrec: {0:.4f}'.format(precision))
-    if args.recall:
-        print('chrRec: {0:.4f}'.format(recall))
+        for hyp, ref in zip(hypotheses, references):
+            ngrams_ref = extract_ngrams(ref, max_length=self.ngram, spaces=self.space)
+            ngrams_test = extract_ngrams(hyp, max_length=self.ngram, spaces=self.space)
+
+            get_correct(ngrams_ref, ngrams_test, self.correct, self.total)
+
+            for rank in ngrams_ref:
+                self.total_ref[rank] += sum(ngrams_ref[rank].values())
+
+    def score(self, beta=None):
+        """return chrF, precision and recall over all statistics accumulated so far"""
+        return f1(self.correct, self.total, self.total_ref, self.ngram, self.beta if beta is None else beta)
+
+def main(args):
+
+    sentence_level = getattr(args, 'sentence_stats', None) or getattr(args, 'bootstrap', 0)
+    if sentence_level:
+        try:
+            import numpy as np
+        except ImportError:
+            sys.stderr.write('Error: --sentence-stats and --bootstrap require NumPy\n')
+            sys.exit(1)
+
+    # a single hypothesis file may be given without a list
+    hyps = args.hyp if isinstance(args.hyp, (list, tuple)) else [args.hyp]
+
+    ngrams_ref, total_ref = get_reference_ngrams(args.ref, args.ngram, args.space, getattr(args, 'ref_cache', None))
+
+    num_workers = getattr(args, 'num_workers', 1)
+    if num_workers <= 0:
+        num_workers = cpu_count()
+    num_workers = min(num_workers, len(hyps))
+
+    if num_workers > 1:
+        pool = Pool(processes=num_workers, initializer=_init_worker, initargs=(ngrams_ref,))
+        results = [pool.apply_async(_get_statistics, (hyp.name, args.ngram, args.space, sentence_level)) for hyp in hyps]
+        pool.close()
+        pool.join()
+        results = [result.get() for result in results]
+    elif sentence_level:
+        results = [get_sentence_statistics(hyp, ngrams_ref, args.ngram, args.space) for hyp in hyps]
+    else:
+        results = [get_statistics(hyp, ngrams_ref, args.ngram, args.space) for hyp in hyps]
+
+    if sentence_level:
+        stats = np.stack(results)
+        if args.sentence_stats:
+            np.save(args.sentence_stats, stats if len(hyps) > 1 else stats[0])
+        if args.bootstrap:
+            samples = paired_bootstrap(stats, args.bootstrap, args.beta, args.seed)
+        # corpus-level statistics are the sum over sentences
+        results = [([int(x) for x in s[:, 0]], [int(x) for x in s[:, 1]]) for s in stats.sum(axis=1)]
+
+    scores = [f1(correct, total, total_ref, args.ngram, args.beta) for (correct, total) in results]
+
+    for i, (hyp, (chrf, precision, recall)) in enumerate(zip(hyps, scores)):
+
+        # prefix scores with file name if several hypotheses are scored
+        prefix = hyp.name + '\t' if len(hyps) > 1 else ''
+
+        print(prefix + 'chrF3: {0:.4f}'.format(chrf))
+        if args.precision:
+            print(prefix + 'chrPrec: {0:.4f}'.format(precision))
+        if args.recall:
+            print(prefix + 'chrRec: {0:.4f}'.format(recall))
+        if getattr(args, 'bootstrap', 0):
+            low, high = np.percentile(samples[i], [2.5, 97.5])
+            print(prefix + 'chrF3 95% CI: {0:.4f}-{1:.4f}'.format(low, high))
+            if i:
+                p = paired_p_value(samples[i], samples[0], chrf - scores[0][0])
+                print(prefix + 'p-value (vs. {0}): {1:.4f}'.format(hyps[0].name, p))
 
 if __name__ == '__main__':
 
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Undo BPE segmentation, by joining subword units that end in the separator with the following unit.
+
+This is equivalent to sed -r 's/(@@ )|(@@ ?$)//g', but works with any separator, and on text segmented
+with character-level or byte-level BPE. Input is processed as bytes in large blocks, without decoding
+UTF-8, and output is written as soon as a block is read, so that decode-bpe can be used in a pipe.
+
+Alternatively, the input can consist of integer IDs of subword units; each line of the --vocabulary file
+holds one subword unit (optionally followed by its frequency, as written by get-vocab), and its ID is the line number,
+starting at 0.
+"""
+
+from __future__ import unicode_literals
+
+import sys
+import os
+import io
+import argparse
+import tempfile
+import warnings
+from multiprocessing import Pool, cpu_count
+
+#hack to get imports working if running this as a script, or within a package
+try:
+    from .apply_bpe import decode_line, get_chunk_offsets
+except ImportError:
+    from apply_bpe import decode_line, get_chunk_offsets
+
+# block size for reading input
+BLOCK_SIZE = 1 << 20
+
+def create_parser(subparsers=None):
+
+    if subparsers:
+        parser = subparsers.add_parser('decode-bpe',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="undo BPE segmentation")
+    else:
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="undo BPE segmentation")
+
+    parser.add_argument(
+        '--input', '-i', type=argparse.FileType('rb'), default=sys.stdin,
+        metavar='PATH',
+        help="Input file (default: standard input).")
+    parser.add_argument(
+        '--output', '-o', type=argparse.FileType('wb'), default=sys.stdout,
+        metavar='PATH',
+        help="Output file (default: standard output)")
+    parser.add_argument(
+        '--separator', '-s', type=str, default='@@', metavar='STR',
+        help="Separator between non-final subword units (default: '%(default)s'))")
+    parser.add_argument(
+        '--ids', action='store_true',
+        help="Input consists of integer IDs of subword units, which are mapped to subword units with --vocabulary.")
+    parser.add_argument(
+        '--vocabulary', type=argparse.FileType('rb'), default=None,
+        metavar='PATH',
+        help="Vocabulary for --ids, with one subword unit per line (the ID of a subword unit is its line number, starting at 0).")
+    parser.add_argument(
+        '--num-workers', type=int, default=1,
+        help="Number of processors to process texts, only supported in Python3. If -1, set `multiprocessing.cpu_count()`. (default: %(default)s)")
+
+    return parser
+
+def decode_block(block, separator):
+    """undo segmentation of a block of complete lines (bytes)"""
+    block = block.replace(separator + b' ', b'')
+    block = block.replace(separator + b'\n', b'\n')
+    return block.replace(separator + b'\r\n', b'\r\n')
+
+def decode_stream(infile, outfile, separator, block_size=BLOCK_SIZE, limit=None):
+    """undo segmentation of binary stream infile (or its next limit bytes), and write to binary stream outfile.
+    Blocks are written (and flushed) as soon as they are read."""
+
+    read = getattr(infile, 'read1', infile.read)
+    remainder = b''
+    while limit is None or limit > 0:
+        block = read(block_size if limit is None else min(block_size, limit))
+        if not block:
+            break
+        if limit is not None:
+            limit -= len(block)
+        block = remainder + block
+        end = block.rfind(b'\n') + 1
+        block, remainder = block[:end], block[end:]
+        if block:
+            outfile.write(decode_block(block, separator))
+            outfile.flush()
+    # last line without newline
+    if remainder:
+        outfile.write(decode_line(remainder, separator))
+        outfile.flush()
+
+def read_id_vocabulary(vocab_file):
+    """read subword units (bytes) of vocabulary file; the ID of each unit is its position"""
+    return [line.split()[0] if line.strip() else b'' for line in vocab_file]
+
+def decode_ids(infile, outfile, separator, id_vocab):
+    """map lines of integer IDs to subword units, and undo segmentation"""
+    for line in infile:
+        try:
+            units = [id_vocab[int(i)] for i in line.split()]
+        except (ValueError, IndexError) as e:
+            sys.stderr.write('Error: invalid ID in line {0!r}: {1}\n'.format(line, e))
+            sys.exit(1)
+        outfile.write(decode_line(b' '.join(units) + b'\n', separator))
+
+def _decode_chunk(infile, outfile, separator, begin, end):
+    with open(infile, 'rb') as fi, open(outfile, 'wb') as fo:
+        fi.seek(begin)
+        decode_stream(fi, fo, separator, limit=end - begin if end > 0 else None)
+
+def decode_bpe(infile, outfile, separator, id_vocab=None, num_workers=1):
+    """undo segmentation of binary file infile, and write to binary file outfile.
+    If id_vocab is given, input lines are sequences of IDs of the subword units in id_vocab.
+    With num_workers > 1 (and input and output files with a name), the input is split between several processes."""
+
+    if isinstance(separator, str):
+        separator = separator.encode('utf-8')
+
+    if id_vocab is not None:
+        decode_ids(infile, outfile, separator, id_vocab)
+        return
+
+    if num_workers > 1 and getattr(infile, 'name', '<stdin>') == '<stdin>':
+        warnings.warn("In parallel mode, the input cannot be STDIN. Using 1 processor instead.")
+        num_workers = 1
+
+    if num_workers == 1:
+        decode_stream(infile, outfile, separator)
+        return
+
+    offsets = get_chunk_offsets(infile.name, num_workers, 'rb')
+    res_files = []
+    results = []
+    pool = Pool(processes=num_workers)
+    for i in range(num_workers):
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        tmp.close()
+        res_files.append(tmp)
+        results.append(pool.apply_async(_decode_chunk, (infile.name, tmp.name, separator, offsets[i], offsets[i + 1])))
+    pool.close()
+    pool.join()
+    for result in results:
+        result.get()
+    for i in range(num_workers):
+        with open(res_files[i].name, 'rb') as fi:
+            while True:
+                block = fi.read(BLOCK_SIZE)
+                if not block:
+                    break
+                outfile.write(block)
+        os.remove(res_files[i].name)
+
+def main(args):
+
+    if args.num_workers <= 0:
+        args.num_workers = cpu_count()
+
+    if args.ids and not args.vocabulary:
+        sys.stderr.write('Error: --ids requires --vocabulary\n')
+        sys.exit(1)
+
+    if args.input.name == '<stdin>':
+        args.input = sys.stdin.buffer
+    if args.output.name == '<stdout>':
+        args.output = sys.stdout.buffer
+
+    id_vocab = read_id_vocabulary(args.vocabulary) if args.ids else None
+
+    decode_bpe(args.input, args.output, args.separator, id_vocab, args.num_workers)
+
+    if args.input is not sys.stdin.buffer:
+        args.input.close()
+    if args.output is not sys.stdout.buffer:
+        args.output.close()
+    if args.vocabulary:
+        args.vocabulary.close()
+
+if __name__ == '__main__':
+
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    main(args)
@@ -3,10 +3,11 @@ from __future__ import print_function
 
 import os
 import sys
-import inspect
 import warnings
 import argparse
 import codecs
+import struct
+from array import array
 
 from collections import Counter
 
@@ -35,22 +36,109 @@ def create_parser(subparsers=None):
         metavar='PATH',
         help="Output file (default: standard output)")
 
-    return parser
+    parser.add_argument(
+        '--num-workers', type=int, default=1,
+        help="Number of processors to process texts, only supported in Python3. If -1, set `multiprocessing.cpu_count()`. (default: %(default)s)")
+
+    parser.add_argument(
+        '--min-count', type=int, default=None,
+        metavar='INT',
+        help="Only write words with frequency >= INT (default: all words)")
 
-def get_vocab(train_file, vocab_file):
+    parser.add_argument(
+        '--top-k', type=int, default=None,
+        metavar='INT',
+        help="Only write the INT most frequent words (default: all words)")
+
+    parser.add_argument(
+        '--sort-by-word', action='store_true',
+        help="Sort vocabulary by word instead of frequency, as required by merge-vocab")
 
-    c = Counter()
+    parser.add_argument(
+        '--binary', action='store_true',
+        help="Write vocabulary in binary format, which can be read by learn-bpe --dict-input and apply-bpe --vocabulary without text parsing")
 
-    for line in train_file:
-        for word in line.strip('\r\n ').split(' '):
-            if word:
-                c[word] += 1
+    return parser
 
-    for key,f in sorted(c.items(), key=lambda x: x[1], reverse=True):
-        vocab_file.write(key+" "+ str(f) + "\n")
+# binary vocabulary format: magic line, number of words and size of word block (two little-endian uint64),
+# word frequencies (little-endian int64), and UTF-8 encoded words separated by newlines
+BINARY_VOCAB_MAGIC = b'#vocab: binary\n'
+
+def write_binary_vocabulary(vocab, vocab_file):
+    """write list of (word, frequency) pairs to vocab_file (opened in binary mode)"""
+
+    words = [word if isinstance(word, bytes) else word.encode('utf-8') for word, freq in vocab]
+    words = b'\n'.join(words)
+    counts = array('q', [freq for word, freq in vocab])
+    if sys.byteorder == 'big':
+        counts.byteswap()
+
+    vocab_file.write(BINARY_VOCAB_MAGIC)
+    vocab_file.write(struct.pack('<QQ', len(counts), len(words)))
+    vocab_file.write(counts.tobytes())
+    vocab_file.write(words)
+
+def read_binary_vocabulary(vocab_file, is_bytes=False):
+    """read vocabulary written by write_binary_vocabulary() from vocab_file (opened in binary mode),
+    and return list of (word, frequency) pairs"""
+
+    if vocab_file.read(len(BINARY_VOCAB_MAGIC)) != BINARY_VOCAB_MAGIC:
+        raise ValueError('{0} is not a binary vocabulary file'.format(getattr(vocab_file, 'name', vocab_file)))
+    num_words, words_size = struct.unpack('<QQ', vocab_file.read(16))
+    counts = array('q')
+    counts.frombytes(vocab_file.read(8 * num_words))
+    if sys.byteorder == 'big':
+        counts.byteswap()
+    if not num_words:
+        return []
+    words = vocab_file.read(words_size)
+    if is_bytes:
+        words = words.split(b'\n')
+    else:
+        words = words.decode('utf-8').split('\n')
+
+    return list(zip(words, counts))
+
+def is_binary_vocabulary(filename):
+    """check if file is a binary vocabulary (written with get-vocab --binary)"""
+    if not filename or filename.startswith('<'):
+        return False
+    with open(filename, 'rb') as f:
+        return f.read(len(BINARY_VOCAB_MAGIC)) == BINARY_VOCAB_MAGIC
+
+def get_vocab(train_file, vocab_file, num_workers=1, min_count=None, top_k=None, binary=False, sort_by_word=False):
+    """count words in train_file, and write them with their frequency to vocab_file, sorted by frequency
+    (or by word, for merging with merge_vocab.py).
+    Words are counted in parallel (with num_workers > 1), and optionally pruned to those with frequency >= min_count,
+    and/or the top_k most frequent words.
+    """
+
+    #hack to get imports working if running this as a script, or within a package
+    try:
+        from .learn_bpe import get_vocabulary
+    except ImportError:
+        from learn_bpe import get_vocabulary
+
+    c = get_vocabulary(train_file, num_workers=num_workers)
+
+    if min_count:
+        c = Counter(dict((key, f) for key, f in c.items() if f >= min_count))
+
+    # Counter.most_common() sorts by frequency, with ties in order of first occurrence
+    vocab = c.most_common(top_k)
+    if sort_by_word:
+        vocab.sort()
+
+    if binary:
+        write_binary_vocabulary(vocab, vocab_file)
+    else:
+        vocab_file.write(''.join([key+" "+ str(f) + "\n" for key,f in vocab]))
 
 if __name__ == "__main__":
 
+    import inspect
+    from multiprocessing import cpu_count
+
     currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     newdir = os.path.join(currentdir, 'subword_nmt')
     if os.path.isdir(newdir):
@@ -72,13 +160,21 @@ if __name__ == "__main__":
     parser = create_parser()
     args = parser.parse_args()
 
+    if args.num_workers <= 0:
+        args.num_workers = cpu_count()
+
     # read/write files as UTF-8
     if args.input.name != '<stdin>':
         args.input = codecs.open(args.input.name, encoding='utf-8')
-    if args.output.name != '<stdout>':
+    if args.binary:
+        if args.output.name == '<stdout>':
+            args.output = sys.__stdout__.buffer
+        else:
+            args.output = open(args.output.name, 'wb')
+    elif args.output.name != '<stdout>':
         args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
 
-    get_vocab(args.input, args.output)
+    get_vocab(args.input, args.output, args.num_workers, args.min_count, args.top_k, args.binary, args.sort_by_word)
 
     # close files
     if args.input.name != '<stdin>':
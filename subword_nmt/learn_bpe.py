@@ -14,6 +14,7 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 from __future__ import unicode_literals
 
 import os
+import io
 import sys
 import inspect
 import codecs
@@ -22,9 +23,17 @@ import copy
 import argparse
 import warnings
 import tempfile
-from multiprocessing import Pool, cpu_count
+import time
+import json
+import random
 from collections import defaultdict, Counter
-from contextlib import contextmanager
+from contextlib import contextmanager, redirect_stderr
+
+#hack to get imports working if running this as a script, or within a package
+try:
+    from .get_vocab import read_binary_vocabulary, is_binary_vocabulary
+except ImportError:
+    from get_vocab import read_binary_vocabulary, is_binary_vocabulary
 
 try:
     from tqdm import tqdm
@@ -32,6 +41,13 @@ except ImportError:
     def tqdm(iterator, *args, **kwargs):
         return iterator
 
+def positive_int(value):
+    """argparse type for integers >= 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('expected an integer >= 1, but got {0}'.format(value))
+    return number
+
 def create_parser(subparsers=None):
 
     if subparsers:
@@ -61,13 +77,52 @@ def create_parser(subparsers=None):
         '--byte', '-b', action="store_true",
         help="byte-level BPE.")
     parser.add_argument('--dict-input', action="store_true",
-        help="If set, input file is interpreted as a dictionary where each line contains a word-count pair")
+        help="If set, input file is interpreted as a dictionary where each line contains a word-count pair "+
+             "(or a binary vocabulary written with get-vocab --binary)")
     parser.add_argument(
         '--total-symbols', '-t', action="store_true",
         help="subtract number of characters from the symbols to be generated (so that '--symbols' becomes an estimate for the total number of symbols needed to encode text).")
     parser.add_argument(
         '--num-workers', type=int, default=1,
         help="Number of processors to process texts, only supported in Python3. If -1, set `multiprocessing.cpu_count()`. (default: %(default)s)")
+    parser.add_argument(
+        '--max-token-length', type=int, default=None,
+        metavar="INT",
+        help="Handle word types longer than INT characters (bytes for byte-level BPE) according to --long-token-policy, "+
+             "to bound the time spent on pathological tokens such as base64 blobs (default: no limit).")
+    parser.add_argument(
+        '--long-token-policy', choices=['chunk', 'passthrough'], default='chunk',
+        help="'chunk': learn from independent chunks of --max-token-length; "+
+             "'passthrough': ignore long word types (default: '%(default)s')")
+    parser.add_argument(
+        '--min-count', type=int, default=None,
+        metavar="FREQ",
+        help="Approximate learning: ignore word types with frequency < FREQ (default: use all word types).")
+    parser.add_argument(
+        '--sample-rate', type=float, default=None,
+        metavar="FLOAT",
+        help="Approximate learning: learn on a frequency-weighted sample of about FLOAT * (number of word types) word types, "+
+             "whose frequencies are scaled so that pair frequencies are estimated without bias (default: use all word types).")
+    parser.add_argument(
+        '--seed', type=int, default=None,
+        help="Random seed for --sample-rate (default: random)")
+    parser.add_argument(
+        '--check-input', type=argparse.FileType('rb'), default=None,
+        metavar='PATH',
+        help="Held-out text (small enough for exact learning): learn BPE on it with and without --min-count/--sample-rate, "+
+             "and report how much the merge sequences overlap. --min-count is scaled to the number of tokens of the held-out text.")
+    parser.add_argument(
+        '--trace', type=argparse.FileType('w'), default=None,
+        metavar='PATH',
+        help="Write JSON-lines telemetry (time per phase, changed words, size of statistics, memory) to PATH.")
+    parser.add_argument(
+        '--trace-every', type=positive_int, default=100,
+        metavar='INT',
+        help="Write one telemetry record every INT merge operations, aggregating the merges in between (default: %(default)s)")
+    parser.add_argument(
+        '--summarize-trace', type=argparse.FileType('r'), default=None,
+        metavar='PATH',
+        help="Do not learn BPE, but summarize telemetry written with --trace, and print where time and memory went.")
     parser.add_argument(
         '--verbose', '-v', action="store_true",
         help="verbose mode.")
@@ -82,7 +137,11 @@ def get_vocabulary(fobj, is_dict=False, is_bytes=False, num_workers=1):
     strip_chars = b'\r\n ' if is_bytes else '\r\n '
     split_char = b' ' if is_bytes else ' '
 
-    if is_dict:
+    if is_dict and is_binary_vocabulary(getattr(fobj, 'name', None)):
+        with open(fobj.name, 'rb') as f:
+            for word, count in read_binary_vocabulary(f, is_bytes):
+                vocab[word] += count
+    elif is_dict:
         for i, line in enumerate(fobj):
             try:
                 word, count = line.strip(strip_chars).split(split_char)
@@ -117,6 +176,9 @@ def get_vocabulary(fobj, is_dict=False, is_bytes=False, num_workers=1):
                 offsets[i] = f.tell()
                 assert 0 <= offsets[i] < 1e20, "Bad new line separator, e.g. '\\r'"
 
+        # imported here to keep start-up fast when no workers are used
+        from multiprocessing import Pool
+
         vocab_files = []
         pool = Pool(processes=num_workers)
         for i in range(num_workers):
@@ -156,16 +218,18 @@ def _get_vocabulary(infile, outfile, is_bytes, begin, end):
     with open(outfile, 'wb') as f:
         pickle.dump(vocab, f)
 
-def update_pair_statistics(pair, changed, stats, indices):
+def update_pair_statistics(pair, changed, stats, indices, new_pair=None):
     """Minimally update the indices and frequency of symbol pairs
 
     if we merge a pair of symbols, only pairs that overlap with occurrences
     of this pair are affected, and need to be updated.
+    new_pair is the merged symbol (default: concatenation of the pair)
     """
     stats[pair] = 0
     indices[pair] = defaultdict(int)
     first, second = pair
-    new_pair = first+second
+    if new_pair is None:
+        new_pair = first+second
     for j, word, old_word, freq in changed:
 
         # find all instances of pair, and update frequency/indices around it
@@ -268,6 +332,33 @@ def replace_pair(pair, vocab, indices, is_bytes=False):
 
     return changes
 
+def replace_pair_ids(pair, new_id, vocab, indices):
+    """Replace all occurrences of a symbol pair (A, B) with a new symbol AB,
+    where symbols are integer IDs (used for byte-level BPE)"""
+
+    first, second = pair
+    changes = []
+    for j, freq in indices[pair].items():
+        if freq < 1:
+            continue
+        word, freq = vocab[j]
+        new_word = []
+        i = 0
+        last = len(word) - 1
+        while i <= last:
+            if i < last and word[i] == first and word[i+1] == second:
+                new_word.append(new_id)
+                i += 2
+            else:
+                new_word.append(word[i])
+                i += 1
+        new_word = tuple(new_word)
+
+        vocab[j] = (new_word, freq)
+        changes.append((j, new_word, word, freq))
+
+    return changes
+
 def prune_stats(stats, big_stats, threshold):
     """Prune statistics dict for efficiency of max()
 
@@ -283,6 +374,202 @@ def prune_stats(stats, big_stats, threshold):
             else:
                 big_stats[item] = freq
 
+def guard_long_tokens(vocab, max_token_length, long_token_policy='chunk'):
+    """Handle word types longer than max_token_length, whose cost in replace_pair()
+    and update_pair_statistics() grows with their length.
+
+    With the 'chunk' policy, long words are split into chunks of max_token_length
+    which are counted as separate words (as done by apply_bpe.py);
+    with 'passthrough', they are removed since apply_bpe.py will not segment them.
+    Returns the new vocabulary and the number of long word types.
+    """
+    new_vocab = Counter()
+    long_tokens = 0
+    for word, freq in vocab.items():
+        if len(word) <= max_token_length:
+            new_vocab[word] += freq
+            continue
+        long_tokens += 1
+        if long_token_policy == 'chunk':
+            for i in range(0, len(word), max_token_length):
+                new_vocab[word[i:i+max_token_length]] += freq
+    return new_vocab, long_tokens
+
+def prune_vocabulary(vocab, min_count):
+    """Remove word types with frequency < min_count. Rare word types barely affect the most frequent
+    merge operations, but dominate the size of the pair statistics and indices.
+    Returns the new vocabulary and the number of pruned word types.
+    """
+    new_vocab = Counter(dict((word, freq) for (word, freq) in vocab.items() if freq >= min_count))
+    return new_vocab, len(vocab) - len(new_vocab)
+
+def sample_vocabulary(vocab, sample_rate, seed=None):
+    """Return a frequency-weighted sample of about sample_rate * len(vocab) word types.
+
+    A word type with frequency f is kept with probability min(1, f / tau), and its frequency
+    is set to max(f, tau), so that the expected frequency of each symbol pair is unchanged.
+    The threshold tau is chosen so that the expected number of kept word types matches the sample size;
+    word types that are more frequent than tau are always kept (threshold sampling).
+    """
+    if not 0 < sample_rate <= 1:
+        raise ValueError('`sample_rate` is expected to be in (0, 1], but got {}.'.format(sample_rate))
+    num_types = sample_rate * len(vocab)
+    freqs = sorted(vocab.values(), reverse=True)
+    rest = sum(freqs)
+    tau = None
+    for k, freq in enumerate(freqs):
+        # the k most frequent types are kept; find the threshold for sampling the others
+        if num_types - k <= 0:
+            break
+        if freq * (num_types - k) <= rest:
+            tau = rest / (num_types - k)
+            break
+        rest -= freq
+    if tau is None:
+        return vocab
+
+    rng = random.Random(seed)
+    sample = Counter()
+    # frequencies are integers; round tau up or down at random, so that its expected value is unchanged
+    floor = int(tau)
+    for word, freq in vocab.items():
+        if freq >= tau:
+            sample[word] = freq
+        elif rng.random() * tau < freq:
+            sample[word] = floor + (rng.random() < tau - floor)
+    return sample
+
+def compare_merges(merges, reference, prefixes=(100, 1000, 10000)):
+    """Compare a sequence of merge operations with a reference sequence (e.g. learned without approximation).
+
+    Returns the number of merges before the sequences first differ, and the overlap (fraction of shared merges)
+    of the first N merges of both sequences, for each N in prefixes, and for all merges.
+    """
+    common = 0
+    for merge, ref in zip(merges, reference):
+        if merge != ref:
+            break
+        common += 1
+    length = min(len(merges), len(reference))
+    overlap = {}
+    for n in sorted(set([n for n in prefixes if n < length] + [length])):
+        overlap[n] = len(set(merges[:n]) & set(reference[:n])) / n if n else 1.0
+    return {'merges': length, 'common_prefix': common, 'overlap': overlap}
+
+def check_approximation(fobj, num_symbols, min_count=None, sample_rate=None, seed=None, is_bytes=False, num_tokens=None, **kwargs):
+    """Learn BPE on held-out text fobj without and with approximation (see prune_vocabulary() and sample_vocabulary()),
+    and compare the merge sequences with compare_merges(). Other keyword arguments are passed to learn_bpe().
+
+    If num_tokens is the number of tokens of the training text, min_count is scaled to the size of the held-out text,
+    so that the same relative frequencies are pruned. The result also holds the number of merges learned
+    with ('approximate_merges') and without approximation ('exact_merges'), and the min_count that was applied.
+    If approximation leaves no word types, 'error' holds the reason, and no merges are compared.
+    """
+    vocab = get_vocabulary(fobj, is_bytes=is_bytes)
+    if is_bytes:
+        vocab_list = [key + b' ' + str(freq).encode('UTF-8') for (key, freq) in vocab.items()]
+    else:
+        vocab_list = ['{0} {1}'.format(key, freq) for (key, freq) in vocab.items()]
+    if min_count and num_tokens:
+        min_count = min_count * sum(vocab.values()) / num_tokens
+
+    merges = []
+    for options in ({}, {'min_count': min_count, 'sample_rate': sample_rate, 'seed': seed}):
+        codes = io.BytesIO() if is_bytes else io.StringIO()
+        try:
+            # progress and messages of the nested runs would be confused with the main run
+            with redirect_stderr(io.StringIO()):
+                learn_bpe(vocab_list, codes, num_symbols, is_dict=True, is_bytes=is_bytes, **dict(kwargs, **options))
+        except ValueError as e:
+            return {'error': str(e), 'min_count': min_count, 'exact_merges': len(merges[0]) if merges else 0}
+        # skip version header
+        merges.append(codes.getvalue().splitlines()[1:])
+    result = compare_merges(merges[1], merges[0])
+    result.update({'min_count': min_count, 'approximate_merges': len(merges[1]), 'exact_merges': len(merges[0])})
+    return result
+
+def print_approximation_check(result, outfile):
+
+    if result.get('min_count'):
+        outfile.write('approximation check: word types with frequency < {0:.4g} in the check data are pruned\n'.format(result['min_count']))
+    if 'error' in result:
+        outfile.write('approximation check failed: {0}\n'.format(result['error']))
+        return
+    overlap = ', '.join('first {0}: {1:.1%}'.format(n, fraction) for (n, fraction) in sorted(result['overlap'].items()))
+    outfile.write('merge overlap with exact learning on check data: {0}; identical up to merge {1} of {2}\n'.format(
+        overlap, result['common_prefix'], result['merges']))
+    outfile.write('{0} merges were learned with approximation, {1} without\n'.format(result['approximate_merges'], result['exact_merges']))
+
+def get_rss():
+    """resident set size of this process in kilobytes (peak size if the current size is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def write_trace_record(trace, i, merges, phase_time, changed_words, stats, big_stats, pair=None, frequency=None):
+    """write telemetry for the merges up to (and including) merge i"""
+    trace.write(json.dumps({'type': 'merge',
+                            'merge': i,
+                            'merges': merges,
+                            'pair': pair and list(pair),
+                            'frequency': frequency,
+                            'time': phase_time,
+                            'changed_words': changed_words,
+                            'stats_size': len(stats),
+                            'big_stats_size': len(big_stats),
+                            'rss_kb': get_rss()}) + '\n')
+
+def summarize_trace(trace):
+    """Summarize a telemetry trace written by learn_bpe(trace=...).
+
+    Returns a dictionary with the total time per phase, the number of merges and changed words,
+    the peak size of the statistics and the peak memory use, and the slowest records.
+    """
+    setup = {}
+    phases = Counter()
+    merges = changed_words = 0
+    max_stats = max_rss = 0
+    records = []
+    for line in trace:
+        record = json.loads(line)
+        if record['type'] == 'setup':
+            setup = record['time']
+            continue
+        phases.update(record['time'])
+        merges += record['merges']
+        changed_words += record['changed_words']
+        max_stats = max(max_stats, record['big_stats_size'])
+        max_rss = max(max_rss, record['rss_kb'] or 0)
+        records.append(record)
+
+    slowest = sorted(records, key=lambda record: sum(record['time'].values()), reverse=True)[:5]
+    return {'setup': setup,
+            'phases': dict(phases),
+            'merges': merges,
+            'changed_words': changed_words,
+            'max_stats_size': max_stats,
+            'max_rss_kb': max_rss,
+            'slowest': [(record['merge'], sum(record['time'].values())) for record in slowest]}
+
+def print_trace_summary(summary, outfile):
+
+    total = sum(summary['setup'].values()) + sum(summary['phases'].values())
+    outfile.write('{0} merges in {1:.2f}s, {2} changed words ({3:.1f} per merge)\n'.format(
+        summary['merges'], total, summary['changed_words'], summary['changed_words'] / max(summary['merges'], 1)))
+    outfile.write('peak size of statistics: {0} pairs; peak memory: {1} kB\n'.format(summary['max_stats_size'], summary['max_rss_kb']))
+    for name, seconds in sorted(list(summary['setup'].items()) + list(summary['phases'].items()), key=lambda x: x[1], reverse=True):
+        outfile.write('{0:<24} {1:10.3f}s {2:6.1%}\n'.format(name, seconds, seconds / total if total else 0))
+    for merge, seconds in summary['slowest']:
+        outfile.write('slow window ending at merge {0}: {1:.3f}s\n'.format(merge, seconds))
+
 @contextmanager
 def open_file(filename, mode):
     if mode in ('r', 'w'):
@@ -295,8 +582,19 @@ def open_file(filename, mode):
         f.close()
 
 
-def learn_bpe(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False, is_bytes=False, total_symbols=False, num_workers=1):
+def learn_bpe(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False, is_bytes=False, total_symbols=False, num_workers=1, max_token_length=None, long_token_policy='chunk',
+              trace=None, trace_every=100, min_count=None, sample_rate=None, seed=None, check=None):
     """Learn num_symbols BPE operations from vocabulary, and write to outfile.
+
+    For approximate learning on large vocabularies, word types with frequency < min_count are ignored,
+    and/or BPE is learned on a frequency-weighted sample of word types (see sample_vocabulary()).
+    If check is a file object with held-out text, BPE is also learned on it with and without approximation,
+    and the overlap of the merge sequences is reported (see check_approximation()).
+    Raises ValueError if approximation leaves no word types.
+
+    If trace is a file object, JSON-lines telemetry is written to it: one record with the time for setting up
+    the statistics, then one record every trace_every merges with the time per phase, the number of changed words
+    and the size of the statistics (aggregated since the last record), and the current memory use.
     """
 
     # version 0.2 changes the handling of the end-of-word token ('</w>');
@@ -306,15 +604,49 @@ def learn_bpe(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_d
     else:
         outfile.write('#version: 0.2\n')
 
+    # timer for telemetry; a no-op unless we write a trace
+    clock = time.perf_counter if trace else lambda: 0
+    setup_time = {}
+    phase_time = Counter()
+    changed_words = 0
+
+    start = clock()
     vocab = get_vocabulary(infile, is_dict, is_bytes, num_workers)
+    setup_time['get_vocabulary'] = clock() - start
+    num_tokens = sum(vocab.values())
+    if max_token_length:
+        vocab, long_tokens = guard_long_tokens(vocab, max_token_length, long_token_policy)
+        if long_tokens:
+            sys.stderr.write('{0} word types longer than {1} were handled with policy "{2}"\n'.format(long_tokens, max_token_length, long_token_policy))
+    if min_count:
+        vocab, pruned = prune_vocabulary(vocab, min_count)
+        sys.stderr.write('{0} word types with frequency < {1} were pruned\n'.format(pruned, min_count))
+    if sample_rate:
+        num_types = len(vocab)
+        vocab = sample_vocabulary(vocab, sample_rate, seed)
+        sys.stderr.write('learning on a sample of {0} of {1} word types\n'.format(len(vocab), num_types))
+    if (min_count or sample_rate) and not vocab:
+        raise ValueError('no word types are left after pruning and sampling; lower `min_count` or raise `sample_rate`')
     if is_bytes:
-        vocab = dict([(tuple(map(lambda b: bytes([b]), x[:-1]))+(x[-1:]+b'</w>',) ,y) for (x,y) in vocab.items()])
+        # byte-level BPE works on integer symbol IDs: 0-255 are single bytes,
+        # 256-511 word-final bytes (with '</w>'), and merged symbols are added as they are learned
+        symbols = [bytes((b,)) for b in range(256)] + [bytes((b,)) + b'</w>' for b in range(256)]
+        symbol_ids = dict((symbol, i) for (i, symbol) in enumerate(symbols))
+        vocab = dict([(tuple(x[:-1])+(x[-1]+256,) ,y) for (x,y) in vocab.items()])
+        # break ties between equally frequent pairs by their byte strings, like text-mode BPE
+        pair_key = lambda x: (stats[x], symbols[x[0]], symbols[x[1]])
     else:
         vocab = dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
+        pair_key = lambda x: (stats[x], x)
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
 
+    start = clock()
     stats, indices = get_pair_statistics(sorted_vocab)
     big_stats = copy.deepcopy(stats)
+    setup_time['get_pair_statistics'] = clock() - start
+    if trace:
+        trace.write(json.dumps({'type': 'setup', 'time': setup_time, 'types': len(sorted_vocab),
+                                'stats_size': len(stats), 'rss_kb': get_rss()}) + '\n')
 
     if total_symbols:
         uniq_char_internal = set()
@@ -328,40 +660,83 @@ def learn_bpe(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_d
         sys.stderr.write('Reducing number of merge operations by {0}\n'.format(len(uniq_char_internal) + len(uniq_char_final)))
         num_symbols -= len(uniq_char_internal) + len(uniq_char_final)
 
+    if check is not None and (min_count or sample_rate):
+        result = check_approximation(check, num_symbols, min_count, sample_rate, seed, is_bytes, num_tokens, min_frequency=min_frequency,
+                                     max_token_length=max_token_length, long_token_policy=long_token_policy)
+        print_approximation_check(result, sys.stderr)
+
     # threshold is inspired by Zipfian assumption, but should only affect speed
     threshold = max(stats.values()) / 10
+    last_traced = 0
     for i in tqdm(range(num_symbols)):
+        start = clock()
         if stats:
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
+            most_frequent = max(stats, key=pair_key)
+        phase_time['max'] += clock() - start
 
         # we probably missed the best pair because of pruning; go back to full statistics
         if not stats or (i and stats[most_frequent] < threshold):
+            start = clock()
             prune_stats(stats, big_stats, threshold)
             stats = copy.deepcopy(big_stats)
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
+            most_frequent = max(stats, key=pair_key)
             # threshold is inspired by Zipfian assumption, but should only affect speed
             threshold = stats[most_frequent] * i/(i+10000.0)
             prune_stats(stats, big_stats, threshold)
+            phase_time['rebuild_stats'] += clock() - start
 
         if stats[most_frequent] < min_frequency:
             sys.stderr.write('no pair has frequency >= {0}. Stopping\n'.format(min_frequency))
+            if trace and i > last_traced:
+                write_trace_record(trace, i - 1, i - last_traced, phase_time, changed_words, stats, big_stats)
             break
+        frequency = stats[most_frequent]
 
-        if verbose:
-            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], stats[most_frequent]))
         if is_bytes:
-            outfile.write(most_frequent[0] + b' ' + most_frequent[1] + b'\n')
+            first, second = symbols[most_frequent[0]], symbols[most_frequent[1]]
+            if verbose:
+                sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, first, second, stats[most_frequent]))
+            outfile.write(first + b' ' + second + b'\n')
+            if first + second not in symbol_ids:
+                symbol_ids[first + second] = len(symbols)
+                symbols.append(first + second)
+            new_id = symbol_ids[first + second]
+            start = clock()
+            changes = replace_pair_ids(most_frequent, new_id, sorted_vocab, indices)
+            phase_time['replace_pair'] += clock() - start
+            start = clock()
+            update_pair_statistics(most_frequent, changes, stats, indices, new_id)
+            phase_time['update_pair_statistics'] += clock() - start
         else:
+            if verbose:
+                sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], stats[most_frequent]))
             outfile.write('{0} {1}\n'.format(*most_frequent))
-        changes = replace_pair(most_frequent, sorted_vocab, indices, is_bytes)
-        update_pair_statistics(most_frequent, changes, stats, indices)
+            start = clock()
+            changes = replace_pair(most_frequent, sorted_vocab, indices, is_bytes)
+            phase_time['replace_pair'] += clock() - start
+            start = clock()
+            update_pair_statistics(most_frequent, changes, stats, indices)
+            phase_time['update_pair_statistics'] += clock() - start
         stats[most_frequent] = 0
         if not i % 100:
+            start = clock()
             prune_stats(stats, big_stats, threshold)
+            phase_time['prune_stats'] += clock() - start
+
+        if trace:
+            changed_words += len(changes)
+            if not (i + 1) % trace_every or i + 1 == num_symbols:
+                pair = (first.decode('utf-8', 'backslashreplace'), second.decode('utf-8', 'backslashreplace')) if is_bytes else most_frequent
+                write_trace_record(trace, i, i + 1 - last_traced, phase_time, changed_words, stats, big_stats, pair, frequency)
+                last_traced = i + 1
+                phase_time = Counter()
+                changed_words = 0
 
 
 if __name__ == '__main__':
 
+    from multiprocessing import cpu_count
+
     currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     newdir = os.path.join(currentdir, 'subword_nmt')
     if os.path.isdir(newdir):
@@ -381,6 +756,10 @@ if __name__ == '__main__':
     if args.num_workers <= 0:
         args.num_workers = cpu_count()
 
+    if args.summarize_trace:
+        print_trace_summary(summarize_trace(args.summarize_trace), sys.stdout)
+        sys.exit(0)
+
     if sys.version_info < (3, 0):
         print("Python 2 is deprecated. Use Python 3")
         sys.exit(1)
@@ -391,16 +770,34 @@ if __name__ == '__main__':
     if args.output.name != '<stdout>' and not args.byte:
         args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
 
+    if args.check_input and not args.byte:
+        args.check_input = codecs.open(args.check_input.name, encoding='utf-8')
+
+    if args.check_input and not (args.min_count or args.sample_rate):
+        sys.stderr.write('Error: --check-input requires --min-count or --sample-rate\n')
+        sys.exit(1)
+
     if args.byte:
         if args.input.name == '<stdin>':
             args.input = sys.stdin.buffer
         if args.output.name == '<stdout>':
             args.output = sys.stdout.buffer
 
-    learn_bpe(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input, is_bytes=args.byte, total_symbols=args.total_symbols, num_workers=args.num_workers)
+    try:
+        learn_bpe(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input, is_bytes=args.byte, total_symbols=args.total_symbols, num_workers=args.num_workers,
+                  max_token_length=args.max_token_length, long_token_policy=args.long_token_policy,
+                  trace=args.trace, trace_every=args.trace_every,
+                  min_count=args.min_count, sample_rate=args.sample_rate, seed=args.seed, check=args.check_input)
+    except ValueError as e:
+        sys.stderr.write('Error: {0}\n'.format(e))
+        sys.exit(1)
 
     # close files
     if args.input.name != '<stdin>':
         args.input.close()
     if args.output.name != '<stdout>':
         args.output.close()
+    if args.trace:
+        args.trace.close()
+    if args.check_input:
+        args.check_input.close()
@@ -122,7 +122,13 @@ def learn_joint_bpe_and_vocab(args):
         with codecs.open(args.output.name, encoding='UTF-8') as codes:
             bpe = apply_bpe.BPE(codes, separator=args.separator, is_bytes=args.byte)
 
-    # apply BPE to each training corpus and get vocabulary
+    # apply BPE to each training corpus and get vocabulary.
+    # in parallel mode, workers (and their cache) are shared between corpora
+    if args.num_workers > 1:
+        executor = apply_bpe.BPEExecutor(bpe, args.num_workers)
+    else:
+        executor = None
+
     for train_file, vocab_file in zip(args.input, args.vocab):
 
         # read/write files as UTF-8
@@ -139,7 +145,10 @@ def learn_joint_bpe_and_vocab(args):
             tmpout = codecs.open(tmp.name, 'w', encoding='UTF-8')
 
         train_file.seek(0)
-        bpe.process_lines(train_file.name, tmpout, num_workers=args.num_workers)
+        if executor:
+            executor.process_lines(train_file.name, tmpout)
+        else:
+            bpe.process_lines(train_file.name, tmpout)
 
         tmpout.close()
 
@@ -160,6 +169,9 @@ def learn_joint_bpe_and_vocab(args):
         train_file.close()
         vocab_file.close()
 
+    if executor:
+        executor.close()
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Merge vocabulary files that were extracted from different parts of a corpus
+(for instance, on different machines) into a single vocabulary.
+
+Input files need to be sorted by word (get_vocab.py --sort-by-word), and are merged
+with a streaming k-way merge, so memory consumption does not depend on the size of the vocabulary.
+The output is again sorted by word, so that it can be merged further.
+"""
+
+from __future__ import unicode_literals
+
+import sys
+import codecs
+import argparse
+import heapq
+
+from itertools import groupby
+from operator import itemgetter
+
+# hack for python2/3 compatibility
+from io import open
+argparse.open = open
+
+def create_parser(subparsers=None):
+
+    if subparsers:
+        parser = subparsers.add_parser('merge-vocab',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="merge vocabularies sorted by word")
+    else:
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="merge vocabularies sorted by word")
+
+    parser.add_argument(
+        '--input', '-i', type=argparse.FileType('r'), required=True, nargs='+',
+        metavar='PATH',
+        help="Vocabulary files sorted by word (created with get-vocab --sort-by-word, or merge-vocab).")
+
+    parser.add_argument(
+        '--output', '-o', type=argparse.FileType('w'), default=sys.stdout,
+        metavar='PATH',
+        help="Output file (default: standard output)")
+
+    parser.add_argument(
+        '--min-count', type=int, default=None,
+        metavar='INT',
+        help="Only write words with total frequency >= INT (default: all words). "+
+             "Only use this in the final merge step, since words pruned in partial merges are lost.")
+
+    return parser
+
+def read_sorted_vocabulary(vocab_file):
+    """iterate over (word, frequency) pairs in vocab_file, and check that it is sorted by word"""
+
+    prev_word = None
+    for i, line in enumerate(vocab_file):
+        try:
+            word, count = line.strip('\r\n ').split(' ')
+            count = int(count)
+        except ValueError:
+            sys.stderr.write('Failed reading vocabulary file {0} at line {1}: {2}\n'.format(vocab_file.name, i, line))
+            sys.exit(1)
+        if prev_word is not None and word < prev_word:
+            sys.stderr.write('Error: vocabulary file {0} is not sorted by word (line {1}: {2}). Use get-vocab --sort-by-word\n'.format(vocab_file.name, i, word))
+            sys.exit(1)
+        prev_word = word
+        yield word, count
+
+def merge_vocab(vocab_files, outfile, min_count=None):
+    """merge vocabulary files sorted by word, summing up the frequency of each word, and write result to outfile"""
+
+    merged = heapq.merge(*[read_sorted_vocabulary(f) for f in vocab_files])
+    for word, items in groupby(merged, key=itemgetter(0)):
+        count = sum(c for (w, c) in items)
+        if min_count is None or count >= min_count:
+            outfile.write(word + ' ' + str(count) + '\n')
+
+if __name__ == '__main__':
+
+    # python 2/3 compatibility
+    if sys.version_info < (3, 0):
+        sys.stderr = codecs.getwriter('UTF-8')(sys.stderr)
+        sys.stdout = codecs.getwriter('UTF-8')(sys.stdout)
+        sys.stdin = codecs.getreader('UTF-8')(sys.stdin)
+    else:
+        sys.stderr = codecs.getwriter('UTF-8')(sys.stderr.buffer)
+        sys.stdout = codecs.getwriter('UTF-8')(sys.stdout.buffer)
+        sys.stdin = codecs.getreader('UTF-8')(sys.stdin.buffer)
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    # read/write files as UTF-8
+    args.input = [codecs.open(f.name, encoding='utf-8') for f in args.input]
+    if args.output.name != '<stdout>':
+        args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
+
+    merge_vocab(args.input, args.output, args.min_count)
+
+    # close files
+    for f in args.input:
+        f.close()
+    if args.output.name != '<stdout>':
+        args.output.close()
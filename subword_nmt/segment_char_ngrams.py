@@ -4,9 +4,13 @@
 
 from __future__ import unicode_literals, division
 
+import os
 import sys
 import codecs
 import argparse
+import tempfile
+import warnings
+from multiprocessing import Pool, cpu_count
 
 # hack for python2/3 compatibility
 from io import open
@@ -44,27 +48,109 @@ def create_parser(subparsers=None):
     parser.add_argument(
         '--separator', '-s', type=str, default='@@', metavar='STR',
         help="Separator between non-final subword units (default: '%(default)s'))")
+    parser.add_argument(
+        '--num-workers', type=int, default=1,
+        help="Number of processors to process texts, only supported in Python3. If -1, set `multiprocessing.cpu_count()`. (default: %(default)s)")
 
     return parser
 
+def segment_word(word, n, separator):
+    """segment word into character n-grams of size n, and join them with separator and spaces"""
+    return (separator + ' ').join([word[i:i+n] for i in range(0, len(word), n)])
+
+def segment_lines(lines, outfile, vocab, n, shortlist, separator, cache=None, batch_size=1000):
+    """segment lines, writing output to outfile in batches of batch_size lines.
+    Output of each word is cached."""
+
+    if cache is None:
+        cache = {}
+
+    batch = []
+    for line in lines:
+        out = []
+        for word in line.split():
+            try:
+                out.append(cache[word])
+            except KeyError:
+                if word not in vocab or vocab[word] > shortlist:
+                    cache[word] = segment_word(word, n, separator)
+                else:
+                    cache[word] = word
+                out.append(cache[word])
+        # every word is followed by a space
+        out.append('\n')
+        batch.append(' '.join(out))
+        if len(batch) >= batch_size:
+            outfile.write(''.join(batch))
+            batch = []
+    outfile.write(''.join(batch))
+
+def _read_chunk(infile, begin, end):
+    """iterate over lines of infile between byte offsets begin and end"""
+    with open(infile, encoding='utf-8') as f:
+        f.seek(begin)
+        line = f.readline()
+        while line:
+            pos = f.tell()
+            assert 0 <= pos < 1e20, "Bad new line separator, e.g. '\\r'"
+            if end > 0 and pos > end:
+                break
+            yield line
+            line = f.readline()
+
+def _segment_chunk(infile, outfile, vocab, n, shortlist, separator, begin, end):
+    with open(outfile, 'w', encoding='utf-8') as fo:
+        segment_lines(_read_chunk(infile, begin, end), fo, vocab, n, shortlist, separator)
+
 def segment_char_ngrams(args):
 
     vocab = [line.split()[0] for line in args.vocab if len(line.split()) == 2]
     vocab = dict((y,x) for (x,y) in enumerate(vocab))
 
-    for line in args.input:
-      for word in line.split():
-        if word not in vocab or vocab[word] > args.shortlist:
-          i = 0
-          while i*args.n < len(word):
-            args.output.write(word[i*args.n:i*args.n+args.n])
-            i += 1
-            if i*args.n < len(word):
-              args.output.write(args.separator)
-            args.output.write(' ')
-        else:
-          args.output.write(word + ' ')
-      args.output.write('\n')
+    num_workers = getattr(args, 'num_workers', 1)
+
+    if num_workers > 1 and args.input.name == '<stdin>':
+        warnings.warn("In parallel mode, the input cannot be STDIN. Using 1 processor instead.")
+        num_workers = 1
+
+    if num_workers == 1:
+        segment_lines(args.input, args.output, vocab, args.n, args.shortlist, args.separator)
+        return
+
+    with open(args.input.name, encoding='utf-8') as f:
+        size = os.fstat(f.fileno()).st_size
+        chunk_size = int(size / num_workers)
+        offsets = [0 for _ in range(num_workers + 1)]
+        for i in range(1, num_workers):
+            f.seek(chunk_size * i)
+            pos = f.tell()
+            while True:
+                try:
+                    line = f.readline()
+                    break
+                except UnicodeDecodeError:
+                    pos -= 1
+                    f.seek(pos)
+            offsets[i] = f.tell()
+            assert 0 <= offsets[i] < 1e20, "Bad new line separator, e.g. '\\r'"
+
+    res_files = []
+    results = []
+    pool = Pool(processes=num_workers)
+    for i in range(num_workers):
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        tmp.close()
+        res_files.append(tmp)
+        results.append(pool.apply_async(_segment_chunk, (args.input.name, tmp.name, vocab, args.n, args.shortlist, args.separator, offsets[i], offsets[i + 1])))
+    pool.close()
+    pool.join()
+    for result in results:
+        result.get()
+    for i in range(num_workers):
+        with open(res_files[i].name, encoding='utf-8') as fi:
+            for line in fi:
+                args.output.write(line)
+        os.remove(res_files[i].name)
 
 
 if __name__ == '__main__':
@@ -82,6 +168,9 @@ if __name__ == '__main__':
     parser = create_parser()
     args = parser.parse_args()
 
+    if args.num_workers <= 0:
+        args.num_workers = cpu_count()
+
     if sys.version_info < (3, 0):
         args.separator = args.separator.decode('UTF-8')
 
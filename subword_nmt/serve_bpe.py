@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Serve BPE segmentation over a Unix socket or local TCP port.
+
+One model is loaded, and shared (with its cache) by all clients. The protocol is line-based:
+clients send one sentence per line, and receive one segmented line per request, in the same order.
+Requests may be pipelined; concurrent requests (from one or several clients) are segmented in batches.
+
+Example:
+    subword-nmt serve-bpe -c {codes_file} --socket /tmp/bpe.sock
+    echo "iron cement" | nc -U /tmp/bpe.sock
+"""
+
+from __future__ import unicode_literals, division
+
+import sys
+import os
+import io
+import codecs
+import argparse
+import asyncio
+import collections
+import time
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+#hack to get imports working if running this as a script, or within a package
+try:
+    from .apply_bpe import BPE, read_vocabulary, get_byte_mode
+except ImportError:
+    from apply_bpe import BPE, read_vocabulary, get_byte_mode
+
+def create_parser(subparsers=None):
+
+    if subparsers:
+        parser = subparsers.add_parser('serve-bpe',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="serve BPE segmentation over a Unix socket or local TCP port")
+    else:
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="serve BPE segmentation over a Unix socket or local TCP port")
+
+    parser.add_argument(
+        '--codes', '-c', type=argparse.FileType('rb'), metavar='PATH',
+        required=True,
+        help="File with BPE codes (created by learn_bpe.py).")
+    parser.add_argument(
+        '--merges', '-m', type=int, default=-1,
+        metavar='INT',
+        help="Use this many BPE operations (<= number of learned symbols)"+
+             "default: Apply all the learned merge operations")
+    parser.add_argument(
+        '--separator', '-s', type=str, default='@@', metavar='STR',
+        help="Separator between non-final subword units (default: '%(default)s'))")
+    parser.add_argument(
+        '--vocabulary', type=argparse.FileType('rb'), default=None,
+        metavar="PATH",
+        help="Vocabulary file (built with get_vocab.py, in text or binary format). If provided, this script reverts any merge operations that produce an OOV.")
+    parser.add_argument(
+        '--vocabulary-threshold', type=int, default=None,
+        metavar="INT",
+        help="Vocabulary threshold. If vocabulary is provided, any word with frequency < threshold will be treated as OOV")
+    parser.add_argument(
+        '--glossaries', type=str, nargs='+', default=None,
+        metavar="STR",
+        help="Glossaries. Words matching any of the words/regex provided in glossaries will not be affected by the BPE.")
+    parser.add_argument(
+        '--dropout', type=float, default=0,
+        metavar="P",
+        help="Dropout BPE merge operations with probability P (Provilkov et al., 2019).")
+    parser.add_argument(
+        '--socket', type=str, default=None,
+        metavar="PATH",
+        help="Listen on this Unix socket.")
+    parser.add_argument(
+        '--host', type=str, default='127.0.0.1',
+        help="Listen on this address if --port is given (default: '%(default)s')")
+    parser.add_argument(
+        '--port', type=int, default=None,
+        help="Listen on this TCP port.")
+    parser.add_argument(
+        '--max-batch-size', type=int, default=256,
+        metavar="INT",
+        help="Segment at most INT requests at once (default: %(default)s)")
+    parser.add_argument(
+        '--max-delay', type=float, default=1,
+        metavar="MS",
+        help="Wait up to MS milliseconds for more requests before segmenting a batch (default: %(default)s)")
+    parser.add_argument(
+        '--stats-interval', type=float, default=None,
+        metavar="SECONDS",
+        help="Report requests, batch size and latency percentiles to stderr every SECONDS seconds (and on shutdown).")
+
+    return parser
+
+class BPEServer(object):
+    """asyncio server around a BPE model.
+
+    Requests are queued, and a single batcher task collects up to max_batch_size requests
+    (waiting up to max_delay seconds after the first one), and segments them in a background thread,
+    so that the event loop keeps accepting connections. All requests share one model and cache.
+    """
+
+    def __init__(self, bpe, dropout=0, max_batch_size=256, max_delay=0.001, latency_window=10000):
+        self.bpe = bpe
+        self.dropout = dropout
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.encoding = None if bpe.is_bytes else 'utf-8'
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.requests = 0
+        self.batches = 0
+        self.queue = None
+        self.server = None
+        self.batcher = None
+        # one thread, so the model and its cache are never used concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self, socket_path=None, host='127.0.0.1', port=None):
+        """listen on the Unix socket socket_path, or on host:port"""
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self._run_batcher())
+        if socket_path:
+            self.server = await asyncio.start_unix_server(self._handle, path=socket_path)
+        elif port is not None:
+            self.server = await asyncio.start_server(self._handle, host=host, port=port)
+        else:
+            raise ValueError('either `socket_path` or `port` is required')
+        return self.server
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.executor.shutdown()
+
+    def segment(self, line):
+        """queue line for segmentation; returns a future for the segmented line"""
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((line, future, time.perf_counter()))
+        return future
+
+    def _segment_batch(self, lines):
+        return [self.bpe.process_line(line, self.dropout) for line in lines]
+
+    async def _run_batcher(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.max_delay and self.queue.qsize() < self.max_batch_size:
+                await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                outputs = await loop.run_in_executor(self.executor, self._segment_batch, [line for (line, _, _) in batch])
+            except Exception as e:
+                for (_, future, _) in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            end = time.perf_counter()
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, future, start), out in zip(batch, outputs):
+                self.latencies.append(end - start)
+                if not future.done():
+                    future.set_result(out)
+
+    async def _handle(self, reader, writer):
+        """segment each line sent by the client; responses are written in order of requests.
+        If a line is too long (see asyncio.StreamReader) or cannot be segmented, the error is reported to stderr,
+        and the connection is closed after the responses to earlier requests."""
+        responses = asyncio.Queue(maxsize=self.max_batch_size)
+
+        async def read_requests():
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError as e:
+                    # line longer than the limit of the stream reader; earlier requests are still answered
+                    sys.stderr.write('Error: {0}; closing connection\n'.format(e))
+                    break
+                if not line:
+                    break
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                if self.encoding:
+                    line = line.decode(self.encoding, 'replace')
+                await responses.put(self.segment(line))
+            await responses.put(None)
+
+        async def write_responses():
+            while True:
+                future = await responses.get()
+                if future is None:
+                    break
+                out = await future
+                writer.write(out.encode(self.encoding) if self.encoding else out)
+                await writer.drain()
+
+        # if one task fails, the other one is cancelled, so that the reader does not wait for a full queue forever
+        tasks = [asyncio.ensure_future(read_requests()), asyncio.ensure_future(write_responses())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            sys.stderr.write('Error: {0}; closing connection\n'.format(e))
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    def get_stats(self):
+        """number of requests and batches, mean batch size, latency percentiles (in milliseconds)
+        over the last latency_window requests, and the total number of entries of the caches of the model"""
+        latencies = sorted(self.latencies)
+        percentiles = {}
+        for p in (50, 90, 99):
+            percentiles['p{0}'.format(p)] = latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000 if latencies else 0
+        return {'requests': self.requests,
+                'batches': self.batches,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0,
+                'latency_ms': percentiles,
+                'cache_size': sum(self.bpe.get_cache_sizes().values())}
+
+def report_stats(stats):
+    sys.stderr.write('{0} requests in {1} batches (mean batch size {2:.1f}); latency p50 {3:.2f}ms, p90 {4:.2f}ms, p99 {5:.2f}ms; cache size {6}\n'.format(
+        stats['requests'], stats['batches'], stats['mean_batch_size'],
+        stats['latency_ms']['p50'], stats['latency_ms']['p90'], stats['latency_ms']['p99'], stats['cache_size']))
+
+async def serve(server, socket_path=None, host='127.0.0.1', port=None, stats_interval=None):
+    """run server until interrupted"""
+    await server.start(socket_path, host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    sys.stderr.write('listening on {0}\n'.format(socket_path or '{0}:{1}'.format(host, port)))
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), stats_interval)
+        except asyncio.TimeoutError:
+            report_stats(server.get_stats())
+    await server.close()
+    if stats_interval:
+        report_stats(server.get_stats())
+
+def main(args):
+
+    if not args.socket and args.port is None:
+        sys.stderr.write('Error: either --socket or --port is required\n')
+        sys.exit(1)
+
+    is_bytes = get_byte_mode(args.codes.name)
+    if is_bytes:
+        separator = args.separator.encode('utf-8')
+    else:
+        separator = args.separator
+        args.codes = codecs.open(args.codes.name, encoding='utf-8')
+        if args.vocabulary:
+            args.vocabulary = codecs.open(args.vocabulary.name, encoding='utf-8')
+
+    if args.vocabulary:
+        vocabulary = read_vocabulary(args.vocabulary, args.vocabulary_threshold, is_bytes)
+        args.vocabulary.close()
+    else:
+        vocabulary = None
+
+    bpe = BPE(args.codes, args.merges, separator, vocabulary, args.glossaries, is_bytes)
+    args.codes.close()
+
+    server = BPEServer(bpe, args.dropout, args.max_batch_size, args.max_delay / 1000)
+    try:
+        asyncio.run(serve(server, args.socket, args.host, args.port, args.stats_interval))
+    finally:
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == '__main__':
+
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    main(args)
@@ -5,16 +5,22 @@ import io
 import sys
 import codecs
 import argparse
+import importlib
+from collections import OrderedDict
 
-from .learn_bpe import learn_bpe
-from .apply_bpe import BPE, read_vocabulary, get_byte_mode
-from .get_vocab import get_vocab
-from .learn_joint_bpe_and_vocab import learn_joint_bpe_and_vocab
-
-from .learn_bpe import create_parser as create_learn_bpe_parser
-from .apply_bpe import create_parser as create_apply_bpe_parser
-from .get_vocab import create_parser as create_get_vocab_parser
-from .learn_joint_bpe_and_vocab import create_parser as create_learn_joint_bpe_and_vocab_parser
+# modules of the subcommands; only the module of the command that is run is imported (see main())
+COMMANDS = OrderedDict([
+    ('learn-bpe', 'learn_bpe'),
+    ('apply-bpe', 'apply_bpe'),
+    ('get-vocab', 'get_vocab'),
+    ('merge-vocab', 'merge_vocab'),
+    ('learn-joint-bpe-and-vocab', 'learn_joint_bpe_and_vocab'),
+    ('segment-char-ngrams', 'segment_char_ngrams'),
+    ('chrf', 'chrF'),
+    ('serve-bpe', 'serve_bpe'),
+    ('decode-bpe', 'decode_bpe'),
+    ('update-bpe', 'update_bpe'),
+])
 
 def main():
     parser = argparse.ArgumentParser(
@@ -26,16 +32,34 @@ def main():
 learn-bpe: learn BPE merge operations on input text.
 apply-bpe: apply given BPE operations to input text.
 get-vocab: extract vocabulary and word frequencies from input text.
-learn-joint-bpe-and-vocab: executes recommended workflow for joint BPE.""")
+merge-vocab: merge vocabularies (sorted by word) extracted from different parts of a corpus.
+learn-joint-bpe-and-vocab: executes recommended workflow for joint BPE.
+segment-char-ngrams: segment rare words into character n-grams.
+chrf: compute chrF score of hypotheses against a reference.
+serve-bpe: serve BPE segmentation over a Unix socket or local TCP port.
+decode-bpe: undo BPE segmentation.
+update-bpe: update segmented text after merge operations were added to the BPE codes.""")
 
-    learn_bpe_parser = create_learn_bpe_parser(subparsers)
-    apply_bpe_parser = create_apply_bpe_parser(subparsers)
-    get_vocab_parser = create_get_vocab_parser(subparsers)
-    learn_joint_bpe_and_vocab_parser = create_learn_joint_bpe_and_vocab_parser(subparsers)
+    # only the command that is run needs its full parser; other commands are listed in the help
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    for name, module in COMMANDS.items():
+        if name == command:
+            importlib.import_module('.' + module, __package__).create_parser(subparsers)
+        else:
+            subparsers.add_parser(name)
 
     args = parser.parse_args()
 
     if args.command == 'learn-bpe':
+        from .learn_bpe import learn_bpe, summarize_trace, print_trace_summary
+        if args.summarize_trace:
+            print_trace_summary(summarize_trace(args.summarize_trace), sys.stdout)
+            return
+        if args.check_input and not (args.min_count or args.sample_rate):
+            sys.stderr.write('Error: --check-input requires --min-count or --sample-rate\n')
+            sys.exit(1)
+        if args.check_input and not args.byte:
+            args.check_input = codecs.open(args.check_input.name, encoding='utf-8')
         if args.byte:
             if args.input.name == '<stdin>':
                 args.input = sys.stdin.buffer
@@ -48,43 +72,68 @@ learn-joint-bpe-and-vocab: executes recommended workflow for joint BPE.""")
             if args.output.name != '<stdout>':
                 args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
 
-        learn_bpe(args.input, args.output, args.symbols, args.min_frequency, args.verbose, 
-                  is_dict=args.dict_input, is_bytes=args.byte, total_symbols=args.total_symbols)
+        try:
+            learn_bpe(args.input, args.output, args.symbols, args.min_frequency, args.verbose, 
+                      is_dict=args.dict_input, is_bytes=args.byte, total_symbols=args.total_symbols,
+                      max_token_length=args.max_token_length, long_token_policy=args.long_token_policy,
+                      trace=args.trace, trace_every=args.trace_every,
+                      min_count=args.min_count, sample_rate=args.sample_rate, seed=args.seed, check=args.check_input)
+        except ValueError as e:
+            sys.stderr.write('Error: {0}\n'.format(e))
+            sys.exit(1)
     elif args.command == 'apply-bpe':
-        is_bytes = get_byte_mode(args.codes.name)
-
-        if is_bytes:
-            if args.input.name == '<stdin>':
-                args.input = sys.stdin.buffer
-            if args.output.name == '<stdout>':
-                args.output = sys.stdout.buffer
-        else:
-            # read/write files as UTF-8
-            args.codes = codecs.open(args.codes.name, encoding='utf-8')
-            if args.input.name != '<stdin>':
-                args.input = codecs.open(args.input.name, encoding='utf-8')
-            if args.output.name != '<stdout>':
-                args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
-            if args.vocabulary:
-                args.vocabulary = codecs.open(args.vocabulary.name, encoding='utf-8')
-
-        if args.vocabulary:
-            vocabulary = read_vocabulary(args.vocabulary, args.vocabulary_threshold)
-        else:
-            vocabulary = None
-
-        bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries, is_bytes)
-
-        for line in args.input:
-            args.output.write(bpe.process_line(line, args.dropout))
-
+        from .apply_bpe import main as apply_bpe
+        apply_bpe(args)
     elif args.command == 'get-vocab':
+        from .get_vocab import get_vocab
+        if args.num_workers <= 0:
+            from multiprocessing import cpu_count
+            args.num_workers = cpu_count()
         if args.input.name != '<stdin>':
             args.input = codecs.open(args.input.name, encoding='utf-8')
+        if args.binary:
+            if args.output.name == '<stdout>':
+                args.output = sys.stdout.buffer
+            else:
+                args.output = open(args.output.name, 'wb')
+        elif args.output.name != '<stdout>':
+            args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
+        get_vocab(args.input, args.output, args.num_workers, args.min_count, args.top_k, args.binary, args.sort_by_word)
+    elif args.command == 'merge-vocab':
+        from .merge_vocab import merge_vocab
+        args.input = [codecs.open(f.name, encoding='utf-8') for f in args.input]
         if args.output.name != '<stdout>':
             args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
-        get_vocab(args.input, args.output)
+        merge_vocab(args.input, args.output, args.min_count)
     elif args.command == 'learn-joint-bpe-and-vocab':
+        from .learn_joint_bpe_and_vocab import learn_joint_bpe_and_vocab
         learn_joint_bpe_and_vocab(args)
+    elif args.command == 'segment-char-ngrams':
+        from .segment_char_ngrams import segment_char_ngrams
+        if args.num_workers <= 0:
+            from multiprocessing import cpu_count
+            args.num_workers = cpu_count()
+        # read/write files as UTF-8
+        args.vocab = codecs.open(args.vocab.name, encoding='utf-8')
+        if args.input.name != '<stdin>':
+            args.input = codecs.open(args.input.name, encoding='utf-8')
+        if args.output.name != '<stdout>':
+            args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
+        segment_char_ngrams(args)
+    elif args.command == 'chrf':
+        from .chrF import main as chrF
+        # read files as UTF-8
+        args.ref = codecs.open(args.ref.name, encoding='utf-8')
+        args.hyp = [codecs.open(f.name, encoding='utf-8') if f.name != '<stdin>' else f for f in args.hyp]
+        chrF(args)
+    elif args.command == 'serve-bpe':
+        from .serve_bpe import main as serve_bpe
+        serve_bpe(args)
+    elif args.command == 'decode-bpe':
+        from .decode_bpe import main as decode_bpe
+        decode_bpe(args)
+    elif args.command == 'update-bpe':
+        from .update_bpe import main as update_bpe
+        update_bpe(args)
     else:
         raise Exception('Invalid command provided')
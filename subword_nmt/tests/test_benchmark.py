@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import unittest
+import json
+import subprocess
+import tempfile
+import shutil
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def test_smoke(self):
+        """the benchmark suite runs at a tiny scale, and writes valid JSON"""
+
+        outfile = os.path.join(self.tmpdir, 'out.json')
+        subprocess.check_call([sys.executable, os.path.join(parentdir, 'benchmark.py'),
+                               '--no-bundled', '--scales', '5000', '--symbols', '100', '--apply-lines', '100',
+                               '--max-workers', '1', '--work-dir', self.tmpdir, '-o', outfile],
+                              stderr=subprocess.DEVNULL)
+
+        with open(outfile) as f:
+            results = json.load(f)
+        corpus = results['corpora']['zipf-5000']
+        self.assertEqual(corpus['learn']['merges'], 100)
+        self.assertEqual(sorted(corpus['startup']['apply_bpe']), ['1000', 'all'])
+
+
+if __name__ == '__main__':
+    unittest.main()
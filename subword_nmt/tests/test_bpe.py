@@ -4,14 +4,23 @@
 from __future__ import unicode_literals
 import unittest
 import codecs
+import io
+import tempfile
+import shutil
+import collections
+import json
+import subprocess
+import threading
+import mock
 
 import os,sys,inspect
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 
-from learn_bpe import learn_bpe
-from apply_bpe import BPE
+from learn_bpe import learn_bpe, summarize_trace, get_vocabulary, sample_vocabulary, compare_merges, check_approximation
+import apply_bpe
+from apply_bpe import BPE, BPEExecutor, segment_stream, read_lines, apply_with_manifest, find_frequent_lines
 
 
 class TestBPELearnMethod(unittest.TestCase):
@@ -32,6 +41,80 @@ class TestBPELearnMethod(unittest.TestCase):
         outlines.close()
         reflines.close()
 
+    def test_trace(self):
+        """telemetry does not change the learned codes, and accounts for all merges"""
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            outfile = io.StringIO()
+            trace = io.StringIO()
+            learn_bpe(infile, outfile, 1000, trace=trace, trace_every=300)
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as reffile:
+            self.assertEqual(outfile.getvalue(), reffile.read())
+
+        trace.seek(0)
+        self.assertEqual(len(trace.readlines()), 5)
+
+        trace.seek(0)
+        summary = summarize_trace(trace)
+        self.assertEqual(summary['merges'], 1000)
+        self.assertIn('get_pair_statistics', summary['setup'])
+        self.assertIn('replace_pair', summary['phases'])
+
+        # at least one merge per record
+        proc = subprocess.Popen([sys.executable, os.path.join(parentdir, 'learn_bpe.py'), '-s', '10', '--trace-every', '0',
+                                 '-i', os.path.join(currentdir,'data','corpus.en'), '-o', os.devnull],
+                                stderr=subprocess.PIPE)
+        stderr = proc.communicate()[1].decode('utf-8')
+        self.assertEqual(proc.returncode, 2)
+        self.assertIn('--trace-every: expected an integer >= 1', stderr)
+
+    def test_sample_vocabulary(self):
+        """frequent word types are always kept; the sample has the requested size, and about the same number of tokens"""
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            vocab = get_vocabulary(infile)
+        sample = sample_vocabulary(vocab, 0.2, seed=1)
+
+        self.assertAlmostEqual(len(sample) / len(vocab), 0.2, delta=0.02)
+        self.assertAlmostEqual(sum(sample.values()) / sum(vocab.values()), 1, delta=0.05)
+        for word, freq in vocab.most_common(100):
+            self.assertEqual(sample[word], freq)
+        self.assertEqual(sample_vocabulary(vocab, 1), vocab)
+
+    def test_approximation_check(self):
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            result = check_approximation(infile, 500, min_count=2)
+        self.assertEqual(result['merges'], 500)
+        self.assertGreater(result['overlap'][100], 0.8)
+        self.assertLess(result['overlap'][500], 1)
+
+        merges = ['a b', 'c d', 'e f']
+        self.assertEqual(compare_merges(merges, ['a b', 'e f', 'c d']), {'merges': 3, 'common_prefix': 1, 'overlap': {3: 1.0}})
+
+        # min_count is scaled to the size of the check data; a check that prunes everything is reported, not fatal
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            result = check_approximation(infile, 100, min_count=100, num_tokens=10000)
+        self.assertEqual(result['exact_merges'], 100)
+        self.assertGreater(result['min_count'], 100)
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            result = check_approximation(infile, 100, min_count=100000)
+        self.assertIn('no word types are left', result['error'])
+
+    def test_empty_vocabulary(self):
+        """pruning every word type is an error, not a crash"""
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            with self.assertRaises(ValueError):
+                learn_bpe(infile, io.StringIO(), 100, min_count=100000)
+
+        proc = subprocess.Popen([sys.executable, os.path.join(parentdir, 'learn_bpe.py'), '-s', '100', '--min-count', '100000',
+                                 '-i', os.path.join(currentdir,'data','corpus.en'), '-o', os.devnull],
+                                stderr=subprocess.PIPE)
+        stderr = proc.communicate()[1].decode('utf-8')
+        self.assertEqual(proc.returncode, 1)
+        self.assertIn('Error: no word types are left', stderr)
+
 class TestBPESegmentMethod(unittest.TestCase):
 
     def setUp(self):
@@ -79,5 +162,509 @@ class TestBPESegmentMethod(unittest.TestCase):
         out = self.bpe.process_line(orig)
         self.assertEqual(out, exp)
 
+    def test_stats(self):
+        """runtime statistics do not change the segmentation"""
+
+        vocab = set(unit for line in self.reffile for unit in line.split())
+        vocab.discard('ir@@')
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            bpe = BPE(bpefile, vocab=vocab, glossaries=['[0-9]+'])
+            bpe_stats = BPE(bpefile, vocab=vocab, glossaries=['[0-9]+'])
+        bpe_stats.enable_stats()
+
+        for line in self.infile:
+            self.assertEqual(bpe_stats.process_line(line), bpe.process_line(line))
+        # statistics are collected on the same code path, with the same caches
+        self.assertEqual(bpe_stats.cache, bpe.cache)
+        self.assertEqual(bpe_stats.word_cache, bpe.word_cache)
+
+        stats = bpe_stats.get_stats()
+        self.assertEqual(stats['lines'], 1015)
+        self.assertEqual(stats['tokens'], 25683)
+        self.assertEqual(stats['cache_size'], len(bpe.word_cache))
+        self.assertEqual(stats['segment_cache_size'], len(bpe.cache))
+        # one lookup in the word cache per token
+        self.assertEqual(stats['cache_hits'] + stats['cache_misses'], 25683)
+        self.assertEqual(stats['cache_misses'], len(bpe.word_cache))
+        self.assertGreater(stats['time']['vocabulary'], 0)
+
+        # UTF-8 encoded lines use their own word cache
+        bpe_stats.enable_stats()
+        self.infile.seek(0)
+        for line in self.infile:
+            self.assertEqual(bpe_stats.process_line(line.encode('utf-8')), bpe.process_line(line).encode('utf-8'))
+        stats = bpe_stats.get_stats()
+        self.assertEqual((stats['lines'], stats['tokens']), (1015, 25683))
+        self.assertEqual(stats['cache_misses'], len(bpe_stats.utf8_cache))
+
+    def test_utf8_bytes(self):
+        """UTF-8 encoded lines are segmented like decoded lines, without splitting multi-byte characters"""
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            bpe = BPE(bpefile, glossaries=['[0-9]+'])
+
+        for line in list(self.infile) + ['  ir\xf6n\xa0c\u20acment 1934 \U0001d11e\r\n']:
+            out = bpe.process_line(line.encode('utf-8'))
+            self.assertEqual(out, bpe.process_line(line).encode('utf-8'))
+
+    def test_process_lines_binary(self):
+
+        out = io.BytesIO()
+        self.bpe.process_lines(os.path.join(currentdir,'data','corpus.en'), out, binary=True)
+        self.assertEqual(out.getvalue().decode('utf-8'), self.reffile.read())
+
+    def test_line_cache(self):
+        """duplicate lines are segmented once; the cache is bounded"""
+
+        lines = list(collections.OrderedDict.fromkeys(self.infile.readlines()))[:20]
+        ref = [self.bpe.process_line(line) for line in lines]
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            bpe = BPE(bpefile)
+        bpe.enable_line_cache(50)
+        for _ in range(3):
+            self.assertEqual([bpe.process_line(line) for line in lines], ref)
+        self.assertEqual((bpe.line_cache.hits, bpe.line_cache.misses), (40, 20))
+
+        # least recently used lines are evicted first
+        bpe.enable_line_cache(10)
+        for _ in range(3):
+            self.assertEqual([bpe.process_line(line) for line in lines], ref)
+        self.assertEqual((bpe.line_cache.hits, bpe.line_cache.misses), (0, 60))
+        self.assertEqual(list(bpe.line_cache.lines), lines[10:])
+
+    def test_partial_codes(self):
+        """with a limited number of merge operations, only the start of the codes file is read"""
+
+        codes = io.StringIO('#version: 0.2\n' + ''.join('a{0} b{0}\n'.format(i) for i in range(100000)))
+        for merges in (0, 1, 5000):
+            bpe = BPE(codes, merges=merges)
+            self.assertEqual(bpe.bpe_codes, dict((('a{0}'.format(i), 'b{0}'.format(i)), i) for i in range(merges)))
+            self.assertLess(codes.tell(), len(codes.getvalue()))
+
+class TestWordCache(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            self.lines = infile.readlines()[:300] + ['ironcementironcement 1934 iron1934cement  iron\n']
+        with codecs.open(os.path.join(currentdir,'data','corpus.bpe.ref.en'), encoding='utf-8') as reffile:
+            self.vocab = set(unit for line in reffile for unit in line.split() if unit != 'ir@@')
+
+    def uncached(self, bpe, tokens):
+        """segmentation of each word, without word-level caches"""
+        output = []
+        for word in tokens:
+            if word:
+                units = [out for segment in bpe._isolate_glossaries(word) for out in bpe._encode(segment)]
+                output.extend([unit + bpe.separator for unit in units[:-1]] + units[-1:])
+        return output
+
+    def test_equivalence(self):
+        """rendered words and subword units from the word caches are identical to the uncached segmentation"""
+
+        configurations = [{},
+                          {'glossaries': ['[0-9]+', 'cement'], 'max_token_length': 6},
+                          {'glossaries': ['[0-9]+'], 'max_token_length': 6, 'long_token_policy': 'passthrough'},
+                          {'vocab': self.vocab, 'max_token_length': 10}]
+        for options in configurations:
+            bpes = []
+            for _ in range(2):
+                with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+                    bpes.append(BPE(bpefile, **options))
+            bpe, ref_bpe = bpes
+            for _ in range(2):
+                for line in self.lines:
+                    tokens = line.strip().split(' ')
+                    expected = self.uncached(ref_bpe, tokens)
+                    self.assertEqual(bpe.segment_tokens(tokens), expected)
+                    self.assertEqual(bpe.segment(line), ' '.join(expected))
+                    self.assertEqual(bpe.process_line(line.encode('utf-8')), (' '.join(expected) + '\n').encode('utf-8'))
+            # long tokens are counted for each occurrence
+            if 'max_token_length' in options:
+                self.assertGreater(ref_bpe.long_tokens, 0)
+            self.assertEqual(bpe.long_tokens, 3 * ref_bpe.long_tokens)
+
+    def test_bounded(self):
+        """caches are bounded by max_cache_size, without changing the segmentation"""
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            bpe = BPE(bpefile, glossaries=['[0-9]+'])
+            ref_bpe = BPE(bpefile, glossaries=['[0-9]+'])
+        bpe.max_cache_size = 100
+        for line in self.lines:
+            tokens = line.strip().split(' ')
+            self.assertEqual(bpe.segment_tokens(tokens), self.uncached(ref_bpe, tokens))
+            self.assertEqual(bpe.process_line(line.encode('utf-8')), ref_bpe.process_line(line).encode('utf-8'))
+            self.assertEqual(bpe.segment_tokens_limits(tokens, [10, -1])[1], self.uncached(ref_bpe, tokens))
+        for size in bpe.get_cache_sizes().values():
+            self.assertLessEqual(size, 100)
+        self.assertGreater(len(ref_bpe.cache), 1000)
+
+class TestLongTokens(unittest.TestCase):
+
+    def setUp(self):
+
+        self.bpefile = codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8')
+
+    def tearDown(self):
+
+        self.bpefile.close()
+
+    def test_chunk(self):
+        """tokens longer than max_token_length are segmented in independent chunks"""
+
+        bpe = BPE(self.bpefile, max_token_length=6)
+
+        orig = 'iron cementcement\n'
+        exp = 'ir@@ on c@@ ement@@ c@@ ement\n'
+
+        out = bpe.process_line(orig)
+        self.assertEqual(out, exp)
+        self.assertEqual(bpe.long_tokens, 1)
+
+    def test_passthrough(self):
+        """tokens longer than max_token_length are not segmented"""
+
+        bpe = BPE(self.bpefile, max_token_length=6, long_token_policy='passthrough')
+
+        orig = 'iron cementcement\n'
+        exp = 'ir@@ on cementcement\n'
+
+        out = bpe.process_line(orig)
+        self.assertEqual(out, exp)
+        self.assertEqual(bpe.long_tokens, 1)
+
+class TestMultiMerges(unittest.TestCase):
+
+    def test_process_line_limits(self):
+        """segmenting with several merge limits at once matches separate models"""
+
+        limits = [10, 200, -1]
+        bpes = []
+        for limit in limits:
+            with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+                bpes.append(BPE(bpefile, merges=limit))
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            for line in infile:
+                outs = bpes[-1].process_line_limits(line, limits)
+                for bpe, out in zip(bpes, outs):
+                    self.assertEqual(out, bpe.process_line(line))
+
+class TestBPEExecutor(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            self.bpe = BPE(bpefile)
+        with codecs.open(os.path.join(currentdir,'data','corpus.bpe.ref.en'), encoding='utf-8') as reffile:
+            self.ref = reffile.read()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def test_map(self):
+        """workers are reused for several jobs"""
+
+        infile = os.path.join(currentdir,'data','corpus.en')
+        outfiles = [os.path.join(self.tmpdir, 'out{0}'.format(i)) for i in range(5)]
+        with BPEExecutor(self.bpe, num_workers=2, max_pending=2) as executor:
+            results = list(executor.map([(infile, outfile) for outfile in outfiles]))
+
+        self.assertEqual(len(results), 5)
+        for outfile in outfiles:
+            with codecs.open(outfile, encoding='utf-8') as f:
+                self.assertEqual(f.read(), self.ref)
+
+    def test_process_lines(self):
+
+        out = io.StringIO()
+        with BPEExecutor(self.bpe, num_workers=3) as executor:
+            executor.process_lines(os.path.join(currentdir,'data','corpus.en'), out)
+            out2 = io.StringIO()
+            executor.process_lines(os.path.join(currentdir,'data','corpus.en'), out2)
+
+        self.assertEqual(out.getvalue(), self.ref)
+        self.assertEqual(out2.getvalue(), self.ref)
+
+    def test_line_cache_processes(self):
+        """worker processes start with the frequent lines of the whole file, so they are segmented only once"""
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as f:
+            lines = f.readlines()[:5]
+        infile = os.path.join(self.tmpdir, 'in')
+        with codecs.open(infile, 'w', encoding='utf-8') as f:
+            f.write(''.join(lines * 40) + 'once\n')
+        self.assertEqual(find_frequent_lines(infile, 10), lines)
+        ref = ''.join(self.bpe.process_line(line) for line in lines * 40 + ['once\n'])
+
+        self.bpe.enable_line_cache(10)
+        out = io.StringIO()
+        with BPEExecutor(self.bpe, num_workers=4) as executor:
+            executor.process_lines(infile, out)
+        self.assertEqual(out.getvalue(), ref)
+        self.assertEqual((self.bpe.line_cache.hits, self.bpe.line_cache.misses), (200, 1))
+
+    def test_threads(self):
+
+        out = io.StringIO()
+        with BPEExecutor(self.bpe, num_workers=3, backend='threads') as executor:
+            executor.process_lines(os.path.join(currentdir,'data','corpus.en'), out)
+
+        self.assertEqual(out.getvalue(), self.ref)
+
+    def test_dropout_seed(self):
+        """with a seed, dropout results do not depend on the type of workers"""
+
+        outs = []
+        for backend in ('processes', 'threads'):
+            out = io.StringIO()
+            self.bpe.process_lines(os.path.join(currentdir,'data','corpus.en'), out, dropout=0.1, num_workers=2, backend=backend, seed=1)
+            outs.append(out.getvalue())
+
+        self.assertEqual(outs[0], outs[1])
+        self.assertNotEqual(outs[0], self.ref)
+        # results with dropout are not cached
+        self.assertEqual(self.bpe.cache, {})
+
+    def test_segment_stream(self):
+
+        lines = read_lines([os.path.join(currentdir,'data','corpus.en')])
+        out = list(segment_stream(self.bpe, lines, num_workers=2, backend='processes', batch_size=100, prefetch=2))
+        self.assertEqual(''.join(out), self.ref)
+
+        # consumer stops early
+        lines = read_lines([os.path.join(currentdir,'data','corpus.en')])
+        for i, line in enumerate(segment_stream(self.bpe, lines, num_workers=2, batch_size=10, prefetch=1)):
+            if i == 20:
+                break
+        self.assertEqual(line, self.ref.splitlines(True)[20])
+
+    def test_segment_stream_blocking_input(self):
+        """a consumer that stops early does not wait for input that never arrives"""
+
+        unblock = threading.Event()
+
+        def lines():
+            for line in self.ref.splitlines(True)[:6]:
+                yield line
+            # like STDIN or a socket without new data
+            unblock.wait()
+
+        def consume():
+            for i, line in enumerate(segment_stream(self.bpe, lines(), num_workers=1, batch_size=1)):
+                if i == 5:
+                    break
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        consumer.join(10)
+        stopped = not consumer.is_alive()
+        unblock.set()
+        consumer.join()
+        self.assertTrue(stopped)
+
+    def test_segment_stream_ids(self):
+
+        token_ids = {'ir@@': 0, 'on': 1}
+        out = list(segment_stream(self.bpe, ['iron cement\n', 'iron\n'], token_ids=token_ids, unk_id=2))
+        self.assertEqual(out, [[0, 1, 2, 2], [0, 1]])
+
+class TestFastIO(unittest.TestCase):
+    """compare output of apply_bpe.py with and without --fast-io, byte for byte"""
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.codes = os.path.join(currentdir,'data','bpe.ref')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def apply(self, data, options, stdin=False):
+        infile = os.path.join(self.tmpdir, 'in')
+        with open(infile, 'wb') as f:
+            f.write(data)
+        command = [sys.executable, os.path.join(parentdir, 'apply_bpe.py'), '-c', self.codes] + options
+        if stdin:
+            with open(infile, 'rb') as f:
+                return subprocess.check_output(command, stdin=f)
+        return subprocess.check_output(command + ['-i', infile])
+
+    def test_identical(self):
+        """output is identical for text that ends lines with '\\n'"""
+
+        with open(os.path.join(currentdir,'data','corpus.en'), 'rb') as f:
+            data = f.read() + '  ir\xf6n\xa0c\u20acment  \n'.encode('utf-8')
+        for stdin in (False, True):
+            for options in ([], ['--glossaries', '[0-9]+'], ['--num-workers', '2']):
+                if stdin and options:
+                    continue
+                self.assertEqual(self.apply(data, options + ['--fast-io'], stdin), self.apply(data, options, stdin))
+
+    def test_line_boundaries(self):
+        """with --fast-io, lines are only split at '\\n', and line endings are copied unchanged"""
+
+        data = 'iron\x0ccement\n\u2028iron\x85 cement\r\niron\rcement\n'.encode('utf-8')
+        expected = 'ir@@ on@@ \x0c@@ c@@ ement\n\u2028@@ ir@@ on@@ \x85 c@@ ement\r\nir@@ on@@ \r@@ c@@ ement\n'.encode('utf-8')
+        self.assertEqual(self.apply(data, ['--fast-io']), expected)
+        self.assertEqual(self.apply(data, ['--fast-io'], stdin=True), expected)
+
+        # text mode splits lines of files at other line boundaries too, and translates '\\r\\n' on standard input
+        self.assertNotEqual(self.apply(data, []), expected)
+        self.assertNotIn(b'\r', self.apply(data, [], stdin=True))
+
+class TestFields(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            self.bpe = BPE(bpefile)
+            bpefile.seek(0)
+            self.bpe2 = BPE(bpefile, merges=50)
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            self.lines = [line.rstrip('\n') for line in infile]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def apply(self, records, num_workers):
+        infile = os.path.join(self.tmpdir, 'in')
+        with codecs.open(infile, 'w', encoding='utf-8') as f:
+            f.write(records)
+        out = io.StringIO()
+        self.bpe.process_lines(infile, out, num_workers=num_workers)
+        return out.getvalue()
+
+    def test_tsv(self):
+        """selected columns are segmented with their own model; other columns are copied"""
+
+        self.bpe.enable_fields('tsv', ['1', '2'], {'2': self.bpe2})
+        records = ''.join('{0}\t{0}\t{1}\n'.format(line, i) for i, line in enumerate(self.lines))
+        ref = ''.join('{0}\t{1}\t{2}\n'.format(self.bpe.segment(line), self.bpe2.segment(line), i) for i, line in enumerate(self.lines))
+        for num_workers in (1, 3):
+            self.assertEqual(self.apply(records, num_workers), ref)
+        self.assertEqual(self.bpe.process_line('iron\r\n'), 'ir@@ on\r\n')
+
+    def test_jsonl(self):
+
+        self.bpe.enable_fields('jsonl', ['src', 'tgt'], {'tgt': self.bpe2})
+        records = ''.join(json.dumps({'src': line, 'tgt': line, 'id': i}) + '\n' for i, line in enumerate(self.lines))
+        ref = ''.join(json.dumps({'src': self.bpe.segment(line), 'tgt': self.bpe2.segment(line), 'id': i}, ensure_ascii=False) + '\n'
+                      for i, line in enumerate(self.lines))
+        for num_workers in (1, 3):
+            self.assertEqual(self.apply(records, num_workers), ref)
+        # records without a field are left unchanged
+        self.assertEqual(self.bpe.process_line('{"id": 1}\n'), '{"id": 1}\n')
+
+    def test_jsonl_types(self):
+        """only string values of JSON objects are segmented; other lines are copied verbatim"""
+
+        self.bpe.enable_fields('jsonl', ['src', 'id'])
+        for line in ['{"src": null}\n', '{"id": 5, "src": ["iron"]}\n', '[1,2]\n', '"iron"\n', '5\n', '\n']:
+            self.assertEqual(self.bpe.process_line(line), line)
+        self.assertEqual(self.bpe.process_line('{"id": 5, "src": "iron"}\n'), '{"id": 5, "src": "ir@@ on"}\n')
+        self.assertEqual(self.bpe.process_line('{"src": "iron"}\r\n'.encode('utf-8')), '{"src": "ir@@ on"}\r\n'.encode('utf-8'))
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            self.bpe = BPE(bpefile)
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            self.lines = infile.readlines()
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.tmpdir, 'manifest.json')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def apply(self, lines, bpe, num_workers=1):
+        infile = os.path.join(self.tmpdir, 'input')
+        with codecs.open(infile, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        out = io.StringIO()
+        counts = apply_with_manifest(bpe, infile, out, self.manifest, chunk_lines=20, num_workers=num_workers)
+        self.assertEqual(out.getvalue(), ''.join(bpe.process_line(line) for line in lines))
+        return counts
+
+    def test_resume(self):
+
+        segmented, reused = self.apply(self.lines, self.bpe)
+        self.assertEqual(reused, 0)
+        self.assertEqual(self.apply(self.lines, self.bpe, num_workers=2), (0, segmented))
+
+        # only chunks around changed lines are segmented again
+        lines = self.lines[:]
+        lines[500] = 'a changed line\n'
+        lines.insert(100, 'an inserted line\n')
+        changed, reused = self.apply(lines, self.bpe, num_workers=2)
+        self.assertLessEqual(changed, 4)
+        self.assertGreater(reused, segmented - 4)
+
+        # all chunks are segmented again with a different model
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            bpe = BPE(bpefile, merges=100)
+        self.assertEqual(self.apply(lines, bpe)[1], 0)
+        # outputs of the old model are removed
+        self.assertEqual(len(os.listdir(self.manifest + '.chunks')), changed + reused)
+
+    def test_commit_as_finished(self):
+        """chunks are stored while later chunks are segmented, and the manifest is not rewritten after every chunk"""
+
+        chunk_dir = self.manifest + '.chunks'
+        unfinished = []
+        submit = BPEExecutor._submit
+
+        def count_unfinished(executor, *args, **kwargs):
+            unfinished.append(len([name for name in os.listdir(chunk_dir) if name.endswith('.tmp')]))
+            return submit(executor, *args, **kwargs)
+
+        with mock.patch.object(BPEExecutor, '_submit', count_unfinished):
+            with mock.patch('apply_bpe.write_manifest', wraps=apply_bpe.write_manifest) as write_manifest:
+                segmented, reused = self.apply(self.lines, self.bpe, num_workers=2)
+        self.assertEqual(len(unfinished), segmented)
+        # the executor runs at most 4 jobs at a time
+        self.assertLessEqual(max(unfinished), 8)
+        self.assertLessEqual(write_manifest.call_count, 3)
+        with open(self.manifest) as f:
+            self.assertTrue(all(chunk['done'] for chunk in json.load(f)['chunks']))
+
+class TestByteBPE(unittest.TestCase):
+
+    def test_learn_bpe(self):
+        infile = open(os.path.join(currentdir,'data','corpus.en'), 'rb')
+        outfile = open(os.path.join(currentdir,'data','bpe.byte.out'), 'wb')
+        learn_bpe(infile, outfile, 1000, is_bytes=True)
+        infile.close()
+        outfile.close()
+
+        outlines = open(os.path.join(currentdir,'data','bpe.byte.out'), 'rb')
+        reflines = open(os.path.join(currentdir,'data','bpe.byte.ref'), 'rb')
+
+        for line, line2 in zip(outlines, reflines):
+            self.assertEqual(line, line2)
+
+        outlines.close()
+        reflines.close()
+
+    def test_apply_bpe(self):
+        with open(os.path.join(currentdir,'data','bpe.byte.ref'), 'rb') as bpefile:
+            bpe = BPE(bpefile, separator=b'@@', is_bytes=True)
+
+        with open(os.path.join(currentdir,'data','corpus.en'), 'rb') as infile:
+            with open(os.path.join(currentdir,'data','corpus.bpe.byte.ref.en'), 'rb') as reffile:
+                for line, ref in zip(infile, reffile):
+                    out = bpe.process_line(line)
+                    self.assertEqual(out, ref)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import unittest
+import codecs
+import io
+import mock
+import tempfile
+import shutil
+import json
+import argparse
+from collections import defaultdict
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from chrF import f1, get_reference_ngrams, get_statistics, get_sentence_statistics, f1_array, paired_bootstrap, paired_p_value, ChrF, create_parser, main
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the test corpus, with every second line truncated
+def make_hypothesis(lines):
+    return io.StringIO(''.join([line if i % 2 else line[:len(line)//2] + '\n' for i, line in enumerate(lines)]))
+
+class TestChrFScorer(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as reffile:
+            self.ref_lines = reffile.readlines()[:200]
+
+    def test_batches(self):
+        """incremental scorer gives same results as scoring the whole file"""
+
+        ngrams_ref, total_ref = get_reference_ngrams(self.ref_lines, 6)
+        correct, total = get_statistics(make_hypothesis(self.ref_lines), ngrams_ref, 6)
+        expected = f1(correct, total, total_ref, 6, beta=2)
+
+        hyp_lines = make_hypothesis(self.ref_lines).readlines()
+        scorer = ChrF(ngram=6, beta=2)
+        for i in range(0, len(hyp_lines), 32):
+            scorer.add(hyp_lines[i:i+32], self.ref_lines[i:i+32])
+
+        self.assertEqual(scorer.score(), expected)
+
+    def test_reset(self):
+
+        scorer = ChrF()
+        scorer.add(['iron cement'], ['iron cement'])
+        self.assertEqual(scorer.score(), (1, 1, 1))
+
+        scorer.reset()
+        scorer.add(['xyz'], ['iron cement'])
+        self.assertEqual(scorer.score()[0], 0)
+
+    def test_mismatch(self):
+
+        scorer = ChrF()
+        self.assertRaises(ValueError, scorer.add, ['iron cement'], [])
+
+def reference_chrf(ref_lines, hyp_lines, max_length, beta=3, spaces=False):
+    """per-sentence chrF implementation that predates reference n-gram caching and multi-system scoring"""
+
+    def extract_ngrams(words):
+        words = words.strip() if spaces else ''.join(words.split())
+        results = defaultdict(lambda: defaultdict(int))
+        for length in range(max_length):
+            for start_pos in range(len(words)):
+                end_pos = start_pos + length + 1
+                if end_pos <= len(words):
+                    results[length][tuple(words[start_pos: end_pos])] += 1
+        return results
+
+    correct = [0]*max_length
+    total = [0]*max_length
+    total_ref = [0]*max_length
+    for line, line2 in zip(ref_lines, hyp_lines):
+        ngrams_ref = extract_ngrams(line)
+        ngrams_test = extract_ngrams(line2)
+        for rank in ngrams_test:
+            for chain in ngrams_test[rank]:
+                total[rank] += ngrams_test[rank][chain]
+                if chain in ngrams_ref[rank]:
+                    correct[rank] += min(ngrams_test[rank][chain], ngrams_ref[rank][chain])
+        for rank in ngrams_ref:
+            for chain in ngrams_ref[rank]:
+                total_ref[rank] += ngrams_ref[rank][chain]
+
+    return f1(correct, total, total_ref, max_length, beta)
+
+class TestChrFEngine(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as reffile:
+            self.ref_lines = reffile.readlines()[:200]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def score(self, ref_lines, hyp, max_length=6, beta=3, spaces=False, cache=None):
+        ngrams_ref, total_ref = get_reference_ngrams(ref_lines, max_length, spaces, cache)
+        correct, total = get_statistics(hyp, ngrams_ref, max_length, spaces)
+        return f1(correct, total, total_ref, max_length, beta)
+
+    def run_main(self, options):
+        args = create_parser().parse_args(options)
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            main(args)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_reference_implementation(self):
+        """scores are identical to the per-sentence implementation"""
+
+        hyp_lines = make_hypothesis(self.ref_lines).readlines()
+        for max_length, beta, spaces in [(6, 3, False), (4, 2, False), (6, 3, True)]:
+            self.assertEqual(self.score(self.ref_lines, make_hypothesis(self.ref_lines), max_length, beta, spaces),
+                             reference_chrf(self.ref_lines, hyp_lines, max_length, beta, spaces))
+
+    def test_reference_cache(self):
+        """cached reference n-grams give the same scores, and are not used if the reference or options change"""
+
+        cache = os.path.join(self.tmpdir, 'ref.cache')
+        expected = self.score(self.ref_lines, make_hypothesis(self.ref_lines))
+        self.assertEqual(self.score(self.ref_lines, make_hypothesis(self.ref_lines), cache=cache), expected)
+        # the cache is plain JSON, tied to a hash of the reference
+        with open(cache, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)['ngrams']), len(self.ref_lines))
+
+        # the second call loads the cache, without extracting n-grams
+        with mock.patch('chrF.extract_ngrams', side_effect=AssertionError('cache not used')):
+            ngrams_ref, total_ref = get_reference_ngrams(self.ref_lines, 6, cache=cache)
+        correct, total = get_statistics(make_hypothesis(self.ref_lines), ngrams_ref, 6)
+        self.assertEqual(f1(correct, total, total_ref, 6), expected)
+
+        # stale cache: reference has changed
+        new_ref_lines = self.ref_lines[1:] + self.ref_lines[:1]
+        self.assertEqual(self.score(new_ref_lines, make_hypothesis(self.ref_lines), cache=cache),
+                         reference_chrf(new_ref_lines, make_hypothesis(self.ref_lines).readlines(), 6))
+        # stale cache: different n-gram order
+        self.assertEqual(self.score(new_ref_lines, make_hypothesis(self.ref_lines), max_length=4, cache=cache),
+                         reference_chrf(new_ref_lines, make_hypothesis(self.ref_lines).readlines(), 4))
+
+    def test_multiple_hypotheses(self):
+        """scoring several hypothesis files in parallel gives the same scores as scoring each file separately"""
+
+        reffile = os.path.join(self.tmpdir, 'ref')
+        with codecs.open(reffile, 'w', encoding='utf-8') as f:
+            f.write(''.join(self.ref_lines))
+        hypfiles = []
+        for i in range(3):
+            hypfiles.append(os.path.join(self.tmpdir, 'hyp{0}'.format(i)))
+            with codecs.open(hypfiles[-1], 'w', encoding='utf-8') as f:
+                f.write(''.join(line[:len(line) * (i + 1) // 4] + '\n' for line in self.ref_lines))
+
+        output = self.run_main(['--ref', reffile, '--hyp'] + hypfiles + ['--num-workers', '2', '--precision'])
+        expected = ''.join(hypfile + '\t' + line + '\n'
+                           for hypfile in hypfiles
+                           for line in self.run_main(['--ref', reffile, '--hyp', hypfile, '--precision']).splitlines())
+        self.assertEqual(output, expected)
+
+    def test_single_hypothesis(self):
+        """library callers may pass a single hypothesis file instead of a list"""
+
+        args = argparse.Namespace(ref=io.StringIO(''.join(self.ref_lines)), hyp=make_hypothesis(self.ref_lines),
+                                  ngram=6, space=False, beta=3, precision=False, recall=False)
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            main(args)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(output, 'chrF3: {0:.4f}\n'.format(self.score(self.ref_lines, make_hypothesis(self.ref_lines))[0]))
+
+@unittest.skipIf(numpy is None, "requires NumPy")
+class TestSentenceStatistics(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as reffile:
+            self.ref_lines = reffile.readlines()[:200]
+        self.ngrams_ref, self.total_ref = get_reference_ngrams(self.ref_lines, 6)
+
+    def test_corpus_statistics(self):
+        """per-sentence statistics sum up to corpus-level statistics"""
+
+        correct, total = get_statistics(make_hypothesis(self.ref_lines), self.ngrams_ref, 6)
+        stats = get_sentence_statistics(make_hypothesis(self.ref_lines), self.ngrams_ref, 6)
+
+        self.assertEqual(stats.shape, (200, 6, 3))
+        self.assertEqual(list(stats.sum(axis=0)[:, 0]), correct)
+        self.assertEqual(list(stats.sum(axis=0)[:, 1]), total)
+        self.assertEqual(list(stats.sum(axis=0)[:, 2]), self.total_ref)
+
+        chrf, precision, recall = f1(correct, total, self.total_ref, 6)
+        chrf2, precision2, recall2 = f1_array(stats.sum(axis=0))
+        self.assertAlmostEqual(chrf, chrf2)
+        self.assertAlmostEqual(precision, precision2)
+        self.assertAlmostEqual(recall, recall2)
+
+    def test_paired_bootstrap(self):
+
+        stats = get_sentence_statistics(make_hypothesis(self.ref_lines), self.ngrams_ref, 6)
+        perfect = get_sentence_statistics(io.StringIO(''.join(self.ref_lines)), self.ngrams_ref, 6)
+
+        samples = paired_bootstrap(numpy.stack([stats, perfect]), num_samples=100, seed=1)
+
+        self.assertEqual(samples.shape, (2, 100))
+        self.assertTrue((samples[1] == 1).all())
+        self.assertTrue((samples[0] < 1).all())
+        self.assertAlmostEqual(paired_p_value(samples[1], samples[0], 1), 1 / 101)
+
+        # the batch size (bounded by the number of sentences) does not change the samples
+        numpy.testing.assert_array_equal(paired_bootstrap(numpy.stack([stats, perfect]), num_samples=100, seed=1, batch_size=7), samples)
+
+    def test_p_value_identical(self):
+        """identical systems are not significantly different"""
+
+        stats = get_sentence_statistics(make_hypothesis(self.ref_lines), self.ngrams_ref, 6)
+        samples = paired_bootstrap(numpy.stack([stats, stats]), num_samples=200, seed=1)
+        self.assertEqual(paired_p_value(samples[1], samples[0], 0), 1)
+
+        # scoring a file against itself
+        reffile = os.path.join(currentdir,'data','corpus.en')
+        args = create_parser().parse_args(['--ref', reffile, '--hyp', reffile, reffile, '--bootstrap', '200', '--seed', '1'])
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            main(args)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertIn('p-value (vs. {0}): 1.0000'.format(reffile), output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import unittest
+import io
+import tempfile
+import shutil
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from decode_bpe import decode_bpe, decode_stream, read_id_vocabulary
+
+
+class TestDecodeBPE(unittest.TestCase):
+
+    def setUp(self):
+
+        with open(os.path.join(currentdir,'data','corpus.en'), 'rb') as f:
+            self.ref = f.read()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def test_decode(self):
+
+        for segmented in ['corpus.bpe.ref.en', 'corpus.bpe.byte.ref.en']:
+            with open(os.path.join(currentdir,'data',segmented), 'rb') as infile:
+                out = io.BytesIO()
+                decode_bpe(infile, out, '@@')
+            self.assertEqual(out.getvalue(), self.ref)
+
+    def test_small_blocks(self):
+        """lines may span several blocks; last line may lack a newline"""
+
+        infile = io.BytesIO('ab@@ c d@@\r\ne@@ f@@ g h@@ i@@'.encode('utf-8'))
+        out = io.BytesIO()
+        decode_stream(infile, out, b'@@', block_size=3)
+        self.assertEqual(out.getvalue(), b'abc d\r\nefg hi')
+
+    def test_parallel(self):
+
+        outfile = os.path.join(self.tmpdir, 'out')
+        with open(os.path.join(currentdir,'data','corpus.bpe.ref.en'), 'rb') as infile:
+            with open(outfile, 'wb') as out:
+                decode_bpe(infile, out, '@@', num_workers=3)
+        with open(outfile, 'rb') as f:
+            self.assertEqual(f.read(), self.ref)
+
+    def test_ids(self):
+
+        id_vocab = read_id_vocabulary(io.BytesIO('a@@ 5\nb 3\nc@@ 2\nd 1\n'.encode('utf-8')))
+        out = io.BytesIO()
+        decode_bpe(io.BytesIO(b'0 1 2 3\n2 3\n'), out, '@@', id_vocab)
+        self.assertEqual(out.getvalue(), b'ab cd\ncd\n')
+
+if __name__ == '__main__':
+    unittest.main()
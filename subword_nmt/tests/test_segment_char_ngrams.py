@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import unittest
+import io
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from segment_char_ngrams import segment_lines
+
+
+class TestSegmentCharNgrams(unittest.TestCase):
+
+    def test_segment_lines(self):
+
+        vocab = {'the': 0, 'iron': 1, 'cement': 2}
+        out = io.StringIO()
+        segment_lines(['the iron cement\n', '\n', 'the cement\n'], out, vocab, 2, 1, '@@')
+
+        self.assertEqual(out.getvalue(), 'the iron ce@@ me@@ nt \n\nthe ce@@ me@@ nt \n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import unittest
+import codecs
+import asyncio
+import tempfile
+import shutil
+import mock
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from apply_bpe import BPE
+from serve_bpe import BPEServer
+
+
+class TestBPEServer(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            self.bpe = BPE(bpefile)
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            self.lines = infile.readlines()[:200]
+        with codecs.open(os.path.join(currentdir,'data','corpus.bpe.ref.en'), encoding='utf-8') as reffile:
+            self.ref = reffile.readlines()[:200]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def test_clients(self):
+        """concurrent clients with pipelined requests get their own results, in order"""
+
+        socket_path = os.path.join(self.tmpdir, 'bpe.sock')
+        server = BPEServer(self.bpe, max_batch_size=32)
+
+        async def client():
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            writer.write(''.join(self.lines).encode('utf-8'))
+            writer.write_eof()
+            out = await reader.read()
+            writer.close()
+            return out.decode('utf-8').splitlines(True)
+
+        async def run():
+            await server.start(socket_path)
+            results = await asyncio.gather(*[client() for _ in range(3)])
+            await server.close()
+            return results
+
+        for result in asyncio.run(run()):
+            self.assertEqual(result, self.ref)
+
+        stats = server.get_stats()
+        self.assertEqual(stats['requests'], 600)
+        self.assertLessEqual(stats['batches'], 600)
+        self.assertGreater(stats['latency_ms']['p99'], 0)
+
+    def request(self, server, requests):
+        """send requests (bytes) from one client, and then from another one; return the responses of the first client"""
+
+        socket_path = os.path.join(self.tmpdir, 'bpe.sock')
+
+        async def client(data):
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            writer.write(data)
+            writer.write_eof()
+            out = await reader.read()
+            writer.close()
+            return out
+
+        async def run():
+            await server.start(socket_path)
+            out = await asyncio.wait_for(client(requests), 10)
+            # the server keeps serving other connections
+            self.assertEqual(await client(self.lines[0].encode('utf-8')), self.ref[0].encode('utf-8'))
+            await server.close()
+            return out
+
+        with mock.patch('sys.stderr'):
+            return asyncio.run(run())
+
+    def test_long_line(self):
+        """a line that is too long closes the connection, after the responses to earlier lines"""
+
+        out = self.request(BPEServer(self.bpe), (self.lines[0] + 'a ' * 40000 + '\n' + self.lines[1]).encode('utf-8'))
+        self.assertEqual(out, self.ref[0].encode('utf-8'))
+
+    def test_segmentation_error(self):
+        """a segmentation error closes the connection instead of leaving the client waiting"""
+
+        process_line = self.bpe.process_line
+
+        def fail(line, dropout=0):
+            if line.startswith('fail'):
+                raise RuntimeError('segmentation failed')
+            return process_line(line, dropout)
+
+        server = BPEServer(self.bpe, max_batch_size=1)
+        with mock.patch.object(self.bpe, 'process_line', side_effect=fail):
+            # more requests than the response queue holds
+            out = self.request(server, (self.lines[0] + 'fail\n' + ''.join(self.lines)).encode('utf-8'))
+        self.assertEqual(out, self.ref[0].encode('utf-8'))
+
+if __name__ == '__main__':
+    unittest.main()
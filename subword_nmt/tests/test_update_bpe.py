@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import unittest
+import codecs
+import io
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from apply_bpe import BPE
+from update_bpe import update_segmentation
+
+
+class TestUpdateBPE(unittest.TestCase):
+
+    def setUp(self):
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            self.lines = infile.readlines()
+
+    def load(self, merges=-1, glossaries=None):
+        with codecs.open(os.path.join(currentdir,'data','bpe.ref'), encoding='utf-8') as bpefile:
+            return BPE(bpefile, merges, glossaries=glossaries)
+
+    def test_update(self):
+        """result is identical to applying the new codes, and only some lines are re-segmented"""
+
+        for old_merges, glossaries in [(500, None), (950, None), (950, ['[0-9]+', 'ing'])]:
+            old_bpe = self.load(old_merges, glossaries)
+            new_bpe = self.load(-1, glossaries)
+            old = io.StringIO(''.join(old_bpe.process_line(line) for line in self.lines))
+            out = io.StringIO()
+            lines, changed = update_segmentation(old_bpe, new_bpe, old, out)
+            self.assertEqual(out.getvalue(), ''.join(new_bpe.process_line(line) for line in self.lines))
+            self.assertEqual(lines, len(self.lines))
+            self.assertLess(changed, lines)
+
+    def test_not_extended(self):
+
+        with self.assertRaises(ValueError):
+            update_segmentation(self.load(500), self.load(100), io.StringIO(), io.StringIO())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import unittest
+import codecs
+import io
+
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from get_vocab import get_vocab, read_binary_vocabulary, write_binary_vocabulary
+from merge_vocab import merge_vocab
+
+
+class TestGetVocab(unittest.TestCase):
+
+    def setUp(self):
+
+        self.infile = codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8')
+
+    def tearDown(self):
+
+        self.infile.close()
+
+    def test_get_vocab(self):
+
+        out = io.StringIO()
+        get_vocab(self.infile, out)
+        lines = out.getvalue().splitlines()
+
+        self.assertEqual(lines[:3], ['the 1357', ', 1306', '. 959'])
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines), 25683)
+
+    def test_pruning(self):
+
+        out = io.StringIO()
+        get_vocab(self.infile, out, min_count=100)
+        self.assertTrue(all(int(line.rsplit(' ', 1)[1]) >= 100 for line in out.getvalue().splitlines()))
+
+        self.infile.seek(0)
+        out2 = io.StringIO()
+        get_vocab(self.infile, out2, top_k=5)
+        self.assertEqual(out2.getvalue().splitlines(), out.getvalue().splitlines()[:5])
+
+    def test_binary(self):
+
+        out = io.StringIO()
+        get_vocab(self.infile, out)
+        vocab = [(word, int(freq)) for word, freq in (line.rsplit(' ', 1) for line in out.getvalue().splitlines())]
+
+        self.infile.seek(0)
+        out = io.BytesIO()
+        get_vocab(self.infile, out, binary=True)
+        out.seek(0)
+        self.assertEqual(read_binary_vocabulary(out), vocab)
+
+    def test_binary_roundtrip(self):
+
+        vocab = [('Über', 3), ('a\xa0b', 2), ('x', 1)]
+        out = io.BytesIO()
+        write_binary_vocabulary(vocab, out)
+
+        out.seek(0)
+        self.assertEqual(read_binary_vocabulary(out), vocab)
+
+        out.seek(0)
+        self.assertEqual(read_binary_vocabulary(out, is_bytes=True), [(word.encode('utf-8'), freq) for word, freq in vocab])
+
+class TestMergeVocab(unittest.TestCase):
+
+    def test_merge_vocab(self):
+        """merging vocabularies of parts of a corpus gives the vocabulary of the full corpus"""
+
+        with codecs.open(os.path.join(currentdir,'data','corpus.en'), encoding='utf-8') as infile:
+            lines = infile.readlines()
+
+        parts = []
+        for part in (lines[:300], lines[300:]):
+            out = io.StringIO()
+            get_vocab(part, out, sort_by_word=True)
+            out.seek(0)
+            out.name = 'part'
+            parts.append(out)
+
+        merged = io.StringIO()
+        merge_vocab(parts, merged)
+
+        full = io.StringIO()
+        get_vocab(lines, full, sort_by_word=True)
+
+        self.assertEqual(merged.getvalue(), full.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Update a segmented text after merge operations were added to the BPE codes.
+
+When the new codes consist of the old codes followed by new merge operations, encoding a word with the new codes
+applies the same merges as the old codes, and then continues from the old segmentation. A word is only segmented
+differently if two neighbouring subword units in its old segmentation form a new merge operation.
+This script reads the old segmented text, and only re-segments lines that contain subword units which are part of
+a new merge operation; all other lines are copied unchanged. The result is identical to applying the new codes to
+the original text (the original text is restored from the old segmentation, see apply_bpe.decode_line()).
+
+Example:
+    subword-nmt update-bpe --old-codes {old_codes_file} -c {new_codes_file} < {old_out_file} > {new_out_file}
+"""
+
+from __future__ import unicode_literals
+
+import sys
+import io
+import re
+import codecs
+import argparse
+
+#hack to get imports working if running this as a script, or within a package
+try:
+    from .apply_bpe import BPE, get_byte_mode, decode_line
+except ImportError:
+    from apply_bpe import BPE, get_byte_mode, decode_line
+
+def create_parser(subparsers=None):
+
+    if subparsers:
+        parser = subparsers.add_parser('update-bpe',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="update segmented text after merge operations were added to the BPE codes")
+    else:
+        parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="update segmented text after merge operations were added to the BPE codes")
+
+    parser.add_argument(
+        '--input', '-i', type=argparse.FileType('rb'), default=sys.stdin,
+        metavar='PATH',
+        help="Text segmented with the old codes (default: standard input).")
+    parser.add_argument(
+        '--output', '-o', type=argparse.FileType('wb'), default=sys.stdout,
+        metavar='PATH',
+        help="Output file (default: standard output)")
+    parser.add_argument(
+        '--old-codes', type=argparse.FileType('rb'), metavar='PATH',
+        required=True,
+        help="File with the BPE codes that the input was segmented with.")
+    parser.add_argument(
+        '--old-merges', type=int, default=-1,
+        metavar='INT',
+        help="Number of BPE operations of the old codes that were used (default: all)")
+    parser.add_argument(
+        '--codes', '-c', type=argparse.FileType('rb'), metavar='PATH',
+        required=True,
+        help="File with the new BPE codes, which start with the merge operations of the old codes.")
+    parser.add_argument(
+        '--merges', '-m', type=int, default=-1,
+        metavar='INT',
+        help="Use this many BPE operations of the new codes (default: all)")
+    parser.add_argument(
+        '--separator', '-s', type=str, default='@@', metavar='STR',
+        help="Separator between non-final subword units (default: '%(default)s'))")
+    parser.add_argument(
+        '--glossaries', type=str, nargs='+', default=None,
+        metavar="STR",
+        help="Glossaries that were used for the old segmentation (see apply-bpe).")
+
+    return parser
+
+def get_affected_units(old_bpe, new_bpe):
+    """return the set of subword units (as they appear in segmented text, with separator if not word-final)
+    that are part of a merge operation of new_bpe which old_bpe does not have.
+    Raises ValueError if new_bpe does not start with the merge operations of old_bpe."""
+
+    if old_bpe.is_bytes != new_bpe.is_bytes or old_bpe.version != new_bpe.version:
+        raise ValueError('old and new codes have a different format')
+    for pair, rank in old_bpe.bpe_codes.items():
+        if new_bpe.bpe_codes.get(pair) != rank:
+            raise ValueError('new codes do not start with the merge operations of the old codes')
+
+    separator = new_bpe.separator
+    eow = b'</w>' if new_bpe.is_bytes else '</w>'
+    units = set()
+    for (first, second) in new_bpe.bpe_codes:
+        if (first, second) in old_bpe.bpe_codes:
+            continue
+        if second == eow:
+            # version 0.1: merge of a word-final unit with the end-of-word symbol
+            units.add(first)
+            continue
+        units.add(first + separator)
+        if second.endswith(eow):
+            units.add(second[:-len(eow)])
+        else:
+            units.add(second + separator)
+    return units
+
+def has_new_merge(units, new_merges, separator, eow, version, segments=False):
+    """check if any two neighbouring subword units of a word (segmented into units) form a merge operation in new_merges.
+    Word-final units are checked with the end-of-word symbol; with segments=True (glossaries or long tokens, which
+    split words into segments that are encoded separately), non-final units are checked both with and without it."""
+    prev = None
+    for unit in units:
+        if unit.endswith(separator):
+            symbol = unit[:-len(separator)]
+            if prev is not None and ((prev, symbol) in new_merges or (segments and (prev, symbol + eow) in new_merges)):
+                return True
+            prev = symbol
+        else:
+            if prev is not None and (prev, unit + eow) in new_merges:
+                return True
+            # version 0.1: the end-of-word symbol may not be merged with the final unit
+            if version == (0, 1) and ((prev, unit) in new_merges or (unit, eow) in new_merges):
+                return True
+            prev = None
+    return False
+
+def update_segmentation(old_bpe, new_bpe, infile, outfile):
+    """re-segment lines of infile (segmented with old_bpe) that may be segmented differently with new_bpe,
+    and copy all other lines. Returns the number of lines, and the number of re-segmented lines.
+
+    Lines are split into words (sequences of subword units), and each distinct word is only checked once."""
+
+    affected = get_affected_units(old_bpe, new_bpe)
+    new_merges = set(pair for pair in new_bpe.bpe_codes if pair not in old_bpe.bpe_codes)
+    separator = new_bpe.separator
+    strip_chars, split_char = new_bpe.strip_chars, new_bpe.split_char
+    segments = bool(new_bpe.glossaries or new_bpe.max_token_length)
+    if new_bpe.is_bytes:
+        eow = b'</w>'
+        boundary = re.compile(b'(?<!' + re.escape(separator) + b') ')
+    else:
+        eow = '</w>'
+        boundary = re.compile('(?<!' + re.escape(separator) + ') ')
+
+    seen = set()
+    changed_words = set()
+    lines = changed = 0
+    for line in infile:
+        lines += 1
+        words = set(boundary.split(line.strip(strip_chars)))
+        for word in words - seen:
+            seen.add(word)
+            units = word.split(split_char)
+            if not affected.isdisjoint(units) and has_new_merge(units, new_merges, separator, eow, new_bpe.version, segments):
+                changed_words.add(word)
+        if changed_words.isdisjoint(words):
+            outfile.write(line)
+        else:
+            changed += 1
+            outfile.write(new_bpe.process_line(decode_line(line, separator)))
+    return lines, changed
+
+def main(args):
+
+    is_bytes = get_byte_mode(args.codes.name)
+    if is_bytes:
+        separator = args.separator.encode('utf-8')
+        if args.input.name == '<stdin>':
+            args.input = sys.stdin.buffer
+        if args.output.name == '<stdout>':
+            args.output = sys.stdout.buffer
+    else:
+        separator = args.separator
+        args.codes = codecs.open(args.codes.name, encoding='utf-8')
+        args.old_codes = codecs.open(args.old_codes.name, encoding='utf-8')
+        # read/write files as UTF-8 (without translating line endings, so that unchanged lines are copied exactly)
+        args.input = io.TextIOWrapper(args.input.buffer if args.input.name == '<stdin>' else args.input, encoding='utf-8', newline='')
+        args.output = io.TextIOWrapper(args.output.buffer if args.output.name == '<stdout>' else args.output, encoding='utf-8', newline='')
+
+    old_bpe = BPE(args.old_codes, args.old_merges, separator, None, args.glossaries, is_bytes)
+    new_bpe = BPE(args.codes, args.merges, separator, None, args.glossaries, is_bytes)
+
+    try:
+        lines, changed = update_segmentation(old_bpe, new_bpe, args.input, args.output)
+    except ValueError as e:
+        sys.stderr.write('Error: {0}\n'.format(e))
+        sys.exit(1)
+    sys.stderr.write('{0} of {1} lines re-segmented\n'.format(changed, lines))
+
+    args.codes.close()
+    args.old_codes.close()
+    if args.input.name != '<stdin>':
+        args.input.close()
+    if args.output.name != '<stdout>':
+        args.output.close()
+    else:
+        args.output.flush()
+
+if __name__ == '__main__':
+
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    main(args)